@@ -0,0 +1,134 @@
+import discord
+from discord.ext import commands, tasks
+from discord import app_commands
+from datetime import datetime, timedelta
+from typing import List, Optional
+from utils import db, tracing
+from utils.activity import (
+    ACTIVITY_SCHEMA, MAX_QUERY_HOURS, ActivityCollector, hourly_series, summarize_activity, write_buckets
+)
+
+COG_MANIFEST = {
+    "events": ["on_message"],
+}
+
+# バケットを書き出す間隔（秒）
+FLUSH_SECONDS = 60
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values: List[int]) -> str:
+    peak = max(values, default=0)
+    if not peak:
+        return SPARK_CHARS[0] * len(values)
+    return "".join(SPARK_CHARS[min(len(SPARK_CHARS) - 1, v * len(SPARK_CHARS) // (peak + 1))] for v in values)
+
+
+class Activity(commands.Cog):
+    """チャンネル・サーバーの活動統計（メッセージ数・ユニークユーザー・よく話す人）
+
+    メッセージ本文や1件ごとの記録は保存せず、時間帯ごとのスケッチだけを持つ。
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.collector = ActivityCollector()
+
+    async def cog_load(self):
+        await db.execute_db_operation(ACTIVITY_SCHEMA)
+        self.flush_loop.start()
+
+    async def cog_unload(self):
+        self.flush_loop.cancel()
+        await self._flush()
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.author.bot or not message.guild:
+            return
+        self.collector.record(message.guild.id, message.channel.id, message.author.id, datetime.now())
+
+    async def _flush(self):
+        rows = self.collector.take_dirty()
+        if not rows:
+            return
+        conn = await db.pool.acquire()
+        discard = False
+        try:
+            await tracing.to_thread(write_buckets, conn, rows, datetime.now())
+        except Exception as e:
+            # バケットは dirty のままメモリに残るので、次の書き出しで同じ行を書き直す
+            print(f"活動統計の書き込みエラー（{len(rows)} 行）: {e}")
+            discard = True
+            return
+        finally:
+            await db.pool.release(conn, discard=discard)
+        self.collector.mark_written(rows, datetime.now())
+
+    @tasks.loop(seconds=FLUSH_SECONDS)
+    async def flush_loop(self):
+        await self._flush()
+
+    # -----------------------------
+    # /activity
+    # -----------------------------
+    @app_commands.command(name="activity", description="サーバーまたはチャンネルの活動統計を表示します")
+    @app_commands.describe(channel="対象のチャンネル（省略するとサーバー全体）", hours="遡る時間数")
+    async def activity(
+        self, interaction: discord.Interaction,
+        channel: Optional[discord.TextChannel] = None,
+        hours: app_commands.Range[int, 1, MAX_QUERY_HOURS] = 24
+    ):
+        await interaction.response.defer()
+        # 集計前に手元の分を書き出しておく
+        await self._flush()
+        since = datetime.now() - timedelta(hours=hours)
+        conn = await db.pool.acquire()
+        discard = False
+        try:
+            summary = await tracing.to_thread(
+                summarize_activity, conn, interaction.guild.id, since, channel.id if channel else None
+            )
+        except Exception:
+            discard = True
+            raise
+        finally:
+            await db.pool.release(conn, discard=discard)
+
+        target = channel.mention if channel else interaction.guild.name
+        embed = discord.Embed(
+            title=f"📊 活動統計（直近 {hours} 時間）",
+            description=target,
+            color=discord.Color.blue()
+        )
+        if not summary.messages:
+            embed.add_field(name="メッセージ", value="この期間の記録はありません。", inline=False)
+            await interaction.followup.send(embed=embed)
+            return
+
+        embed.add_field(name="メッセージ数", value=f"{summary.messages:,}")
+        embed.add_field(name="発言したユーザー（推定）", value=f"約 {summary.unique_users:,} 人")
+        if not channel:
+            embed.add_field(name="チャンネル数", value=str(summary.channels))
+
+        series = hourly_series(summary.hourly, since, hours)
+        peak_hour, peak = max(summary.hourly, key=lambda item: item[1])
+        embed.add_field(
+            name="1時間ごとのメッセージ数" + ("（直近48時間）" if len(series) > 48 else ""),
+            value=f"`{sparkline(series[-48:])}`\n最多: {peak_hour:%m/%d %H}時台 {peak:,} 件",
+            inline=False
+        )
+
+        if summary.top_chatters:
+            users = await self.bot.user_resolver.resolve_many([user_id for user_id, _ in summary.top_chatters], interaction.guild)
+            lines = [
+                f"#{i} {self.bot.user_resolver.label(users[user_id], user_id)} — 約 {count:,} 件"
+                for i, (user_id, count) in enumerate(summary.top_chatters, start=1)
+            ]
+            embed.add_field(name="よく話す人（推定）", value="\n".join(lines), inline=False)
+        embed.set_footer(text="ユーザー数・発言数は確率的スケッチによる推定値です")
+        await interaction.followup.send(embed=embed)
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Activity(bot))
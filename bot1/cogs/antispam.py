@@ -0,0 +1,397 @@
+import discord
+from discord.ext import commands, tasks
+from discord import app_commands
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+from utils.antispam import SpamDetector, SpamRules, Verdict
+from utils.db import execute_db_operation
+from utils.members import resolve_members
+
+# 重複・一斉投稿の判定には本文が必要。message_content は特権インテントなので
+# Cog からは宣言せず、使うときは EXTRA_INTENTS=message_content を設定する
+# （無い場合は投稿頻度とメンション数の判定だけ行う）
+COG_MANIFEST = {
+    "events": ["on_message"],
+}
+
+ANTISPAM_SETTINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS antispam_settings (
+    guild_id BIGINT PRIMARY KEY,
+    enabled TINYINT(1) NOT NULL DEFAULT 0,
+    rate_count INT NOT NULL,
+    rate_seconds DOUBLE NOT NULL,
+    duplicate_count INT NOT NULL,
+    duplicate_seconds DOUBLE NOT NULL,
+    mention_limit INT NOT NULL,
+    mention_seconds DOUBLE NOT NULL,
+    raid_users INT NOT NULL,
+    raid_seconds DOUBLE NOT NULL,
+    timeout_minutes INT NOT NULL,
+    delete_messages TINYINT(1) NOT NULL DEFAULT 1,
+    log_channel_id BIGINT NULL,
+    updated_at DATETIME NOT NULL
+)
+"""
+
+# 溜まった処分をまとめて実行する間隔（秒）
+FLUSH_INTERVAL = 1.0
+# 一括削除は1回100件まで
+BULK_DELETE_LIMIT = 100
+# 同じユーザーを続けて処分しない時間（秒）
+ACTION_COOLDOWN = 60.0
+# 権限不足だったチャンネル・メンバーはしばらく処分を試みない（秒）
+FORBIDDEN_BACKOFF = 600.0
+
+
+class AntiSpamSettings(NamedTuple):
+    # サーバーごとに /antispam config で有効にするまでは何もしない
+    enabled: bool = False
+    rules: SpamRules = SpamRules()
+    # 旧 AntiSpam と同じく既定は1時間
+    timeout_minutes: int = 60
+    delete_messages: bool = True
+    log_channel_id: Optional[int] = None
+
+
+DEFAULT_SETTINGS = AntiSpamSettings()
+
+
+class ActionQueue:
+    """スパムへの処分を溜めておき、まとめて実行する
+
+    削除はチャンネルごとに一括削除 API で、タイムアウトは (サーバー, ユーザー) ごとに
+    1回だけ、同時実行数を絞って行う。スパムの波が来ても API 呼び出しは
+    チャンネル数・ユーザー数に比例するだけで、メッセージ数には比例しない。
+    """
+
+    def __init__(self, bot: commands.Bot, concurrency: int = 3):
+        self.bot = bot
+        self._slots = asyncio.Semaphore(concurrency)
+        # channel_id -> (guild_id, 削除するメッセージID)
+        self._deletes: Dict[int, Tuple[int, Set[int]]] = {}
+        # (guild_id, user_id) -> 理由
+        self._timeouts: Dict[Tuple[int, int], List[str]] = {}
+        # 処分済みのユーザー・メッセージ（重複して API を呼ばない）
+        self._recent_users: "OrderedDict[Tuple[int, int], float]" = OrderedDict()
+        self._deleted: "OrderedDict[int, None]" = OrderedDict()
+        # ("channel", channel_id) / ("member", guild_id, user_id) -> この時刻まで試みない
+        self._forbidden: "OrderedDict[Tuple, float]" = OrderedDict()
+        self.deleted = 0
+        self.timed_out = 0
+
+    def add(self, guild_id: int, verdict: Verdict, delete: bool, timeout: bool):
+        now = time.monotonic()
+        if delete:
+            for channel_id, message_id in verdict.messages:
+                if self._forbidden.get(("channel", channel_id), 0.0) > now:
+                    continue
+                if message_id not in self._deleted:
+                    self._deletes.setdefault(channel_id, (guild_id, set()))[1].add(message_id)
+        if timeout:
+            for user_id in verdict.user_ids:
+                key = (guild_id, user_id)
+                if self._recent_users.get(key, 0.0) > now or self._forbidden.get(("member", *key), 0.0) > now:
+                    continue
+                self._timeouts.setdefault(key, verdict.reasons)
+
+    def _remember(self, cache: OrderedDict, key, value, limit: int = 10000):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+    async def flush(self, settings_of) -> Dict[int, List[str]]:
+        """溜まった処分を実行し、サーバーごとの報告行を返す"""
+        deletes, self._deletes = self._deletes, {}
+        timeouts, self._timeouts = self._timeouts, {}
+        reports: Dict[int, List[str]] = {}
+        jobs = [self._delete(channel_id, guild_id, ids) for channel_id, (guild_id, ids) in deletes.items()]
+
+        by_guild: Dict[int, Dict[int, List[str]]] = {}
+        for (guild_id, user_id), reasons in timeouts.items():
+            by_guild.setdefault(guild_id, {})[user_id] = reasons
+        for guild_id, users in by_guild.items():
+            jobs.append(self._timeout_all(guild_id, users, settings_of(guild_id), reports))
+        await asyncio.gather(*jobs)
+        return reports
+
+    async def _delete(self, channel_id: int, guild_id: int, message_ids: Set[int]):
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return
+        if not channel.permissions_for(channel.guild.me).manage_messages:
+            self._remember(self._forbidden, ("channel", channel_id), time.monotonic() + FORBIDDEN_BACKOFF)
+            print(f"スパム削除の権限がありません (guild={guild_id}, channel={channel_id})")
+            return
+        ids = sorted(message_ids)
+        for start in range(0, len(ids), BULK_DELETE_LIMIT):
+            chunk = ids[start:start + BULK_DELETE_LIMIT]
+            for message_id in chunk:
+                self._remember(self._deleted, message_id, None)
+            async with self._slots:
+                try:
+                    # 1件なら通常の削除、2件以上なら一括削除になる
+                    await channel.delete_messages([discord.Object(id=i) for i in chunk], reason="スパム対策")
+                    self.deleted += len(chunk)
+                except discord.Forbidden:
+                    # このチャンネルだけ見送る（他のチャンネルの処分は続ける）
+                    self._remember(self._forbidden, ("channel", channel_id), time.monotonic() + FORBIDDEN_BACKOFF)
+                    print(f"スパム削除の権限がありません (guild={guild_id}, channel={channel_id})")
+                    return
+                except discord.HTTPException as e:
+                    # 既に消されたメッセージが混ざっていても残りは続ける
+                    print(f"スパム削除エラー (channel={channel_id}): {e}")
+
+    async def _timeout_all(self, guild_id: int, users: Dict[int, List[str]],
+                           settings: AntiSpamSettings, reports: Dict[int, List[str]]):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+        me = guild.me
+        if not me.guild_permissions.moderate_members:
+            print(f"タイムアウトの権限がありません (guild={guild_id})")
+            return
+        members = await resolve_members(guild, list(users))
+        until = timedelta(minutes=settings.timeout_minutes)
+        now = time.monotonic()
+        for user_id, member in members.items():
+            self._remember(self._recent_users, (guild_id, user_id), now + ACTION_COOLDOWN)
+            if member.is_timed_out() or member.guild_permissions.manage_messages:
+                continue
+            # オーナーや Bot より上のロールのメンバーはタイムアウトできない
+            if member.id == guild.owner_id or member.top_role >= me.top_role:
+                self._remember(self._forbidden, ("member", guild_id, user_id), now + FORBIDDEN_BACKOFF)
+                continue
+            async with self._slots:
+                try:
+                    await member.timeout(until, reason="スパム行為のためタイムアウト: " + " / ".join(users[user_id]))
+                except discord.Forbidden:
+                    # このメンバーだけ見送り、残りのユーザーの処分は続ける
+                    self._remember(self._forbidden, ("member", guild_id, user_id), now + FORBIDDEN_BACKOFF)
+                    print(f"タイムアウトの権限がありません (guild={guild_id}, user={user_id})")
+                    continue
+                except discord.HTTPException as e:
+                    print(f"タイムアウト処理エラー ({user_id}): {e}")
+                    continue
+            self.timed_out += 1
+            print(f"{member.display_name} をスパム行為のためタイムアウトしました。")
+            reports.setdefault(guild_id, []).append(f"{member.mention}: {' / '.join(users[user_id])}")
+
+
+class AntiSpam(commands.Cog):
+    """連投・同一内容の繰り返し・大量メンション・一斉投稿を検出して処分する"""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.detector = SpamDetector()
+        self.actions = ActionQueue(bot)
+        self.settings: Dict[int, AntiSpamSettings] = {}
+        self.content_rules = False
+
+    async def cog_load(self):
+        self.content_rules = self.bot.intents.message_content
+        if not self.content_rules:
+            print("⚠️ message_content インテントが無効のため、アンチスパムは投稿頻度とメンション数だけで判定します"
+                  "（重複・一斉投稿の判定には EXTRA_INTENTS=message_content が必要）")
+        await execute_db_operation(ANTISPAM_SETTINGS_SCHEMA)
+        rows = await execute_db_operation(
+            """
+            SELECT guild_id, enabled, rate_count, rate_seconds, duplicate_count, duplicate_seconds,
+                mention_limit, mention_seconds, raid_users, raid_seconds, timeout_minutes,
+                delete_messages, log_channel_id
+            FROM antispam_settings
+            """,
+            is_read=True
+        )
+        for guild_id, enabled, *rules, timeout_minutes, delete_messages, log_channel_id in rows:
+            self.settings[guild_id] = AntiSpamSettings(
+                bool(enabled), SpamRules(*rules), timeout_minutes, bool(delete_messages), log_channel_id
+            )
+        self.flush_loop.start()
+
+    async def cog_unload(self):
+        self.flush_loop.cancel()
+
+    def settings_of(self, guild_id: int) -> AntiSpamSettings:
+        return self.settings.get(guild_id, DEFAULT_SETTINGS)
+
+    # -----------------------------
+    # 判定（メッセージごとに O(1)、DB や API は呼ばない）
+    # -----------------------------
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.author.bot or not message.guild:
+            return
+        settings = self.settings_of(message.guild.id)
+        if not settings.enabled:
+            return
+        if isinstance(message.author, discord.Member) and message.author.guild_permissions.manage_messages:
+            return
+
+        verdict = self.detector.check(
+            settings.rules, message.guild.id, message.channel.id, message.author.id, message.id,
+            message.content if self.content_rules else "", len(message.raw_mentions) + len(message.raw_role_mentions) + int(message.mention_everyone),
+            time.monotonic()
+        )
+        if verdict:
+            self.actions.add(message.guild.id, verdict, settings.delete_messages, settings.timeout_minutes > 0)
+
+    # -----------------------------
+    # 処分の一括実行
+    # -----------------------------
+    @tasks.loop(seconds=FLUSH_INTERVAL)
+    async def flush_loop(self):
+        try:
+            reports = await self.actions.flush(self.settings_of)
+        except Exception as e:
+            # ループを止めないよう、失敗してもその回の処分を捨てて続ける
+            print(f"スパム処分の実行エラー: {e}")
+            return
+        for guild_id, lines in reports.items():
+            await self._report(guild_id, lines)
+
+    @flush_loop.before_loop
+    async def before_flush_loop(self):
+        await self.bot.wait_until_ready()
+
+    async def _report(self, guild_id: int, lines: List[str]):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+        settings = self.settings_of(guild_id)
+        channel = guild.get_channel(settings.log_channel_id) if settings.log_channel_id else guild.system_channel
+        if channel is None:
+            return
+        # 1回の実行でまとめて1通にする
+        text = f"🚨 スパム行為のため {len(lines)} 人を{settings.timeout_minutes}分間タイムアウトしました。\n" + "\n".join(lines)
+        try:
+            await channel.send(text[:2000], allowed_mentions=discord.AllowedMentions.none())
+        except discord.HTTPException as e:
+            print(f"スパム報告の送信エラー: {e}")
+
+    # -----------------------------
+    # /antispam
+    # -----------------------------
+    antispam_group = app_commands.Group(name="antispam", description="スパム対策の設定")
+
+    @antispam_group.command(name="config", description="スパム対策の判定基準と処分を設定します（管理者専用）")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        enabled="スパム対策を有効にする（初回の設定時は省略すると有効）",
+        rate_count="この件数以上を rate_seconds 秒以内に投稿したらスパム",
+        rate_seconds="投稿数を数える秒数",
+        duplicate_count="同じ内容をこの回数以上投稿したらスパム",
+        duplicate_seconds="同じ内容を数える秒数",
+        mention_limit="メンションをこの数以上送ったらスパム",
+        mention_seconds="メンションを数える秒数",
+        raid_users="同じ内容をこの人数以上が投稿したら一斉投稿とみなす",
+        raid_seconds="一斉投稿を数える秒数",
+        timeout_minutes="タイムアウトの長さ（分、0 でタイムアウトしない）",
+        delete_messages="スパムと判定したメッセージを削除する",
+        log_channel="処分の報告先（省略時はシステムチャンネル）"
+    )
+    async def antispam_config(
+        self, interaction: discord.Interaction,
+        enabled: Optional[bool] = None,
+        rate_count: Optional[app_commands.Range[int, 2, 50]] = None,
+        rate_seconds: Optional[app_commands.Range[float, 1, 600]] = None,
+        duplicate_count: Optional[app_commands.Range[int, 2, 50]] = None,
+        duplicate_seconds: Optional[app_commands.Range[float, 1, 3600]] = None,
+        mention_limit: Optional[app_commands.Range[int, 1, 200]] = None,
+        mention_seconds: Optional[app_commands.Range[float, 1, 600]] = None,
+        raid_users: Optional[app_commands.Range[int, 2, 50]] = None,
+        raid_seconds: Optional[app_commands.Range[float, 1, 600]] = None,
+        timeout_minutes: Optional[app_commands.Range[int, 0, 40320]] = None,
+        delete_messages: Optional[bool] = None,
+        log_channel: Optional[discord.TextChannel] = None
+    ):
+        current = self.settings_of(interaction.guild.id)
+        changes = {
+            "rate_count": rate_count, "rate_seconds": rate_seconds,
+            "duplicate_count": duplicate_count, "duplicate_seconds": duplicate_seconds,
+            "mention_limit": mention_limit, "mention_seconds": mention_seconds,
+            "raid_users": raid_users, "raid_seconds": raid_seconds,
+        }
+        rules = current.rules._replace(**{k: v for k, v in changes.items() if v is not None})
+        if enabled is None:
+            # 初めて設定したサーバーは、明示的に無効にしない限り有効にする
+            enabled = current.enabled or interaction.guild.id not in self.settings
+        settings = AntiSpamSettings(
+            enabled,
+            rules,
+            current.timeout_minutes if timeout_minutes is None else timeout_minutes,
+            current.delete_messages if delete_messages is None else delete_messages,
+            log_channel.id if log_channel else current.log_channel_id
+        )
+        await execute_db_operation(
+            """
+            INSERT INTO antispam_settings (guild_id, enabled, rate_count, rate_seconds, duplicate_count,
+                duplicate_seconds, mention_limit, mention_seconds, raid_users, raid_seconds,
+                timeout_minutes, delete_messages, log_channel_id, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE enabled=VALUES(enabled), rate_count=VALUES(rate_count),
+                rate_seconds=VALUES(rate_seconds), duplicate_count=VALUES(duplicate_count),
+                duplicate_seconds=VALUES(duplicate_seconds), mention_limit=VALUES(mention_limit),
+                mention_seconds=VALUES(mention_seconds), raid_users=VALUES(raid_users),
+                raid_seconds=VALUES(raid_seconds), timeout_minutes=VALUES(timeout_minutes),
+                delete_messages=VALUES(delete_messages), log_channel_id=VALUES(log_channel_id),
+                updated_at=VALUES(updated_at)
+            """,
+            (interaction.guild.id, int(settings.enabled), *settings.rules, settings.timeout_minutes,
+             int(settings.delete_messages), settings.log_channel_id, datetime.now())
+        )
+        self.settings[interaction.guild.id] = settings
+        # 窓の幅が変わるので、このサーバーの状態は数え直す
+        self.detector.forget_guild(interaction.guild.id)
+        await interaction.response.send_message(embed=self._settings_embed(settings), ephemeral=True)
+
+    @antispam_group.command(name="status", description="スパム対策の設定と動作状況を表示します")
+    @app_commands.checks.has_permissions(manage_messages=True)
+    async def antispam_status(self, interaction: discord.Interaction):
+        embed = self._settings_embed(self.settings_of(interaction.guild.id))
+        embed.add_field(
+            name="動作状況",
+            value=(
+                f"追跡中のユーザー: {self.detector.tracked_users:,}\n"
+                f"削除したメッセージ: {self.actions.deleted:,}\n"
+                f"タイムアウト: {self.actions.timed_out:,}"
+            ),
+            inline=False
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @staticmethod
+    def _settings_embed(settings: AntiSpamSettings) -> discord.Embed:
+        rules = settings.rules
+        embed = discord.Embed(
+            title="🛡️ スパム対策",
+            description="有効" if settings.enabled else "無効",
+            color=discord.Color.green() if settings.enabled else discord.Color.greyple()
+        )
+        embed.add_field(
+            name="判定基準",
+            value=(
+                f"連投: {rules.rate_seconds:g}秒間に{rules.rate_count}件\n"
+                f"同じ内容: {rules.duplicate_seconds:g}秒間に{rules.duplicate_count}回\n"
+                f"メンション: {rules.mention_seconds:g}秒間に{rules.mention_limit}件\n"
+                f"一斉投稿: {rules.raid_seconds:g}秒間に{rules.raid_users}人"
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="処分",
+            value=(
+                f"タイムアウト: {f'{settings.timeout_minutes}分' if settings.timeout_minutes else 'しない'}\n"
+                f"メッセージ削除: {'する' if settings.delete_messages else 'しない'}\n"
+                f"報告先: {f'<#{settings.log_channel_id}>' if settings.log_channel_id else 'システムチャンネル'}"
+            ),
+            inline=False
+        )
+        return embed
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(AntiSpam(bot))
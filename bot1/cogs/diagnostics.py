@@ -0,0 +1,62 @@
+import discord
+from discord.ext import commands
+from discord import app_commands
+from utils.metrics import registry
+
+KIND_LABELS = {
+    "command": "スラッシュコマンド",
+    "listener": "イベントリスナー",
+    "sql": "SQL",
+}
+
+class Diagnostics(commands.Cog):
+    """レイテンシ統計などの診断情報を表示するCog（管理者向け）"""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    @staticmethod
+    def _ms(value) -> str:
+        return f"{value * 1000:.1f}" if value is not None else "-"
+
+    # -----------------------------
+    # /perfstats（スラッシュ）
+    # -----------------------------
+    @app_commands.command(name="perfstats", description="コマンド・リスナー・SQLのレイテンシ統計を表示します（管理者専用）")
+    @app_commands.describe(kind="表示する種類", limit="表示件数")
+    @app_commands.choices(
+        kind=[app_commands.Choice(name=label, value=value) for value, label in KIND_LABELS.items()]
+    )
+    @app_commands.checks.has_permissions(administrator=True)
+    async def perfstats(self, interaction: discord.Interaction, kind: str = "command", limit: app_commands.Range[int, 1, 20] = 10):
+        rows = registry.summary(kind)[:limit]
+
+        embed = discord.Embed(
+            title=f"⏱️ {KIND_LABELS[kind]}のレイテンシ（p95 の遅い順）",
+            color=discord.Color.blue()
+        )
+        if not rows:
+            embed.description = "まだ記録がありません。"
+        else:
+            lines = []
+            for row in rows:
+                lines.append(
+                    f"{row['name'][:60]}\n"
+                    f"  n={row['count']} err={row['errors']} "
+                    f"p50={self._ms(row['p50'])} p95={self._ms(row['p95'])} p99={self._ms(row['p99'])} ms"
+                )
+            embed.description = "```\n" + "\n".join(lines)[:3900] + "\n```"
+
+        monitor = getattr(self.bot, "loop_monitor", None)
+        if monitor is not None:
+            lag = monitor.summary()
+            embed.add_field(
+                name="イベントループ遅延",
+                value=f"p50 {lag['p50_ms']}ms / p99 {lag['p99_ms']}ms / 最大 {lag['max_ms']}ms / ブロック検出 {lag['stalls']}回",
+                inline=False
+            )
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Diagnostics(bot))
@@ -1,9 +1,16 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
+import asyncio
 import random
-import re
 from typing import Optional
+from utils.dice import DiceError, parse, roll_async, summarize_rolls
+from utils.dice_stats import bucketed, distribution, summarize
+
+# Embed のフィールド値の上限（コードブロックの分を引いた長さ）
+FIELD_LIMIT = 1000
+# 集計表示で度数分布まで出す項の数（Embed 全体の上限 6000 文字に収めるため）
+SUMMARY_TERMS = 5
 
 class Dice(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -11,40 +18,136 @@ class Dice(commands.Cog):
 
     @app_commands.command(
         name="roll",
-        description="TRPGで一般的なダイスロール（XdY+Z）を実行します。"
+        description="ダイスロールを実行します（例: 2d6+3, 4d6kh3, 10d10!>=8）"
     )
     @app_commands.describe(
-        dice="振るダイスの形式（例: 2d6, 1d100+10）"
+        dice="ダイス式（XdY、定数、+/-、kh/kl/dh/dl で採用数、! で爆発、>=N で成功数）",
+        stats="振らずに出目の確率分布を表示する（/rollstats と同じ）"
     )
-    async def roll(self, interaction: discord.Interaction, dice: str):
+    async def roll(self, interaction: discord.Interaction, dice: str, stats: bool = False):
+        if stats:
+            await self._send_stats(interaction, dice, None)
+            return
+        try:
+            expression = parse(dice)
+        except DiceError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
+            return
+
         await interaction.response.defer()
+        result = await roll_async(expression)
 
-        # 正規表現でXdY+Zの形式を解析
-        match = re.match(r'(\d+)d(\d+)(?:([+\-]\d+))?', dice.lower())
-        if not match:
-            await interaction.followup.send("ダイス形式が無効です。（例: 2d6, 1d100+10）", ephemeral=True)
-            return
+        embed = discord.Embed(
+            title="🎲 ダイスロール",
+            description=f"**{expression}**",
+            color=discord.Color.blue()
+        )
+        detail = self._format_rolls(result)
+        if len(detail) <= FIELD_LIMIT:
+            embed.add_field(name="ロール結果", value=f"```fix\n{detail}```", inline=False)
+        else:
+            # 出目を全部は載せられないので項ごとの集計に切り替える
+            # （最大 100 万個の出目を集計するのでスレッドで）
+            dice_results = [r for r in result.terms if r.term.is_dice]
+            summaries = await asyncio.to_thread(
+                lambda: [summarize_rolls(r.rolls, r.term.faces) for r in dice_results[:SUMMARY_TERMS]]
+            )
+            self._add_summary_fields(embed, dice_results, summaries)
+        embed.add_field(name="合計", value=f"**{result.total:,}**", inline=False)
+        embed.set_footer(text=f"実行者: {interaction.user.display_name}")
+
+        await interaction.followup.send(embed=embed)
 
-        num_dice = int(match.group(1))
-        num_faces = int(match.group(2))
-        modifier = int(match.group(3)) if match.group(3) else 0
+    # -----------------------------
+    # 表示
+    # -----------------------------
+    def _format_rolls(self, result) -> str:
+        lines = []
+        for term_result in result.terms:
+            term = term_result.term
+            if not term.is_dice:
+                lines.append(f"{'-' if term.sign < 0 else '+'}{term.count}")
+                continue
+            # 長さだけ先に見積もり、明らかに入らないときは文字列を作らない
+            if len(term_result.rolls) * 2 > FIELD_LIMIT:
+                return "x" * (FIELD_LIMIT + 1)
+            # 採用されなかった出目は括弧で囲む
+            rolls = ", ".join(
+                str(r) if k else f"({r})" for r, k in zip(term_result.rolls, term_result.kept)
+            )
+            unit = " 成功" if term.success else ""
+            lines.append(f"{term}: [{rolls}] = {abs(term_result.value)}{unit}")
+        return "\n".join(lines)
 
-        if num_dice <= 0 or num_faces <= 0:
-            await interaction.followup.send("ダイスの数と面数は1以上で指定してください。", ephemeral=True)
+    def _add_summary_fields(self, embed: discord.Embed, dice_results, summaries):
+        for term_result, summary in zip(dice_results, summaries):
+            term = term_result.term
+            lines = [
+                f"ダイス数 {summary.count:,} / 最小 {summary.minimum} / 最大 {summary.maximum} / 平均 {summary.mean:.2f}",
+                f"{'成功数' if term.success else '値'} {abs(term_result.value):,}",
+            ]
+            table = summary.table
+            peak = max(c for _, c in table) or 1
+            width = max(len(label) for label, _ in table)
+            lines += [f"{label:>{width}} {'█' * round(c / peak * 20):<20} {c:,}" for label, c in table]
+            embed.add_field(name=str(term), value="```\n" + "\n".join(lines) + "```", inline=False)
+        if len(dice_results) > SUMMARY_TERMS:
+            embed.add_field(name="…", value=f"ほか {len(dice_results) - SUMMARY_TERMS} 項", inline=False)
+
+    # -----------------------------
+    # /rollstats（出目の厳密な確率分布）
+    # Discord ではサブコマンドを持つコマンド自体は実行できないため、/roll を
+    # グループにして /roll stats にすると既存の /roll dice:... が使えなくなる。
+    # 独立した /rollstats と、/roll の stats オプションの両方から呼べるようにしている。
+    # -----------------------------
+    @app_commands.command(
+        name="rollstats",
+        description="ダイス式の出目の確率分布（平均・分散・パーセンタイル・目標値以上の確率）を表示します"
+    )
+    @app_commands.describe(
+        dice="ダイス式（/roll と同じ書式）",
+        target="この値以上になる確率を表示する（任意）"
+    )
+    async def rollstats(self, interaction: discord.Interaction, dice: str, target: Optional[int] = None):
+        await self._send_stats(interaction, dice, target)
+
+    async def _send_stats(self, interaction: discord.Interaction, dice: str, target: Optional[int]):
+        try:
+            expression = parse(dice)
+        except DiceError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
             return
 
-        rolls = [random.randint(1, num_faces) for _ in range(num_dice)]
-        total = sum(rolls) + modifier
-        
-        rolls_str = ", ".join(map(str, rolls))
-        modifier_str = f" + {modifier}" if modifier > 0 else f" - {abs(modifier)}" if modifier < 0 else ""
+        await interaction.response.defer()
+        try:
+            # 畳み込みは大きなダイスプールだと重いのでスレッドで（小さい分布だけ式ごとにメモ化）
+            dist = await asyncio.to_thread(distribution, expression)
+        except DiceError as e:
+            await interaction.followup.send(str(e), ephemeral=True)
+            return
+        summary = summarize(dist, target)
 
         embed = discord.Embed(
-            title="🎲 ダイスロール",
-            description=f"**{dice}**",
+            title="📊 ダイスの確率分布",
+            description=f"**{expression}**",
             color=discord.Color.blue()
         )
-        embed.add_field(name="ロール結果", value=f"```fix\n{rolls_str}{modifier_str} = {total}```")
+        embed.add_field(name="範囲", value=f"{summary.minimum:,} ～ {summary.maximum:,}", inline=True)
+        embed.add_field(name="平均", value=f"{summary.mean:,.2f}", inline=True)
+        embed.add_field(name="標準偏差", value=f"{summary.stdev:,.2f}（分散 {summary.stdev ** 2:,.2f}）", inline=True)
+        embed.add_field(
+            name="パーセンタイル",
+            value=" / ".join(f"{q}%: {value:,}" for q, value in summary.percentiles),
+            inline=False
+        )
+        if summary.at_least is not None:
+            embed.add_field(name=f"{target:,} 以上になる確率", value=f"**{summary.at_least:.2%}**", inline=False)
+
+        rows = bucketed(dist)
+        peak = max(p for _, p in rows) or 1.0
+        width = max(len(label) for label, _ in rows)
+        chart = "\n".join(f"{label:>{width}} {'█' * round(p / peak * 20):<20} {p:6.2%}" for label, p in rows)
+        embed.add_field(name="分布", value=f"```\n{chart}```", inline=False)
         embed.set_footer(text=f"実行者: {interaction.user.display_name}")
 
         await interaction.followup.send(embed=embed)
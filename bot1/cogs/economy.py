@@ -6,6 +6,8 @@ import os
 import asyncio
 from typing import Optional, List, Dict, Tuple, Any
 from datetime import datetime, timedelta
+from utils import tracing
+from utils.metrics import InstrumentedCursor
 
 # DBヘルパーメソッド（非同期対応）
 async def execute_db_operation(query: str, params: Optional[Tuple[Any, ...]] = None, is_read: bool = False):
@@ -19,26 +21,26 @@ async def execute_db_operation(query: str, params: Optional[Tuple[Any, ...]] = N
             database=os.getenv("DB_NAME"),
             port=int(os.getenv("DB_PORT", 3306))
         )
-        cursor = conn.cursor()
+        cursor = InstrumentedCursor(conn.cursor())
         
-        await asyncio.to_thread(cursor.execute, query, params)
+        await tracing.to_thread(cursor.execute, query, params)
         
         if is_read:
-            result = await asyncio.to_thread(cursor.fetchall)
+            result = await tracing.to_thread(cursor.fetchall)
             return result
         else:
-            await asyncio.to_thread(conn.commit)
+            await tracing.to_thread(conn.commit)
             return None
     except mysql.connector.Error as err:
         print(f"データベースエラー: {err}")
         if conn and conn.is_connected():
-            await asyncio.to_thread(conn.rollback)
+            await tracing.to_thread(conn.rollback)
         raise err
     finally:
         if cursor:
-            await asyncio.to_thread(cursor.close)
+            await tracing.to_thread(cursor.close)
         if conn and conn.is_connected():
-            await asyncio.to_thread(conn.close)
+            await tracing.to_thread(conn.close)
 
 class Economy(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -179,7 +181,7 @@ class Economy(commands.Cog):
                 database=os.getenv("DB_NAME"),
                 port=int(os.getenv("DB_PORT", 3306))
             )
-            cursor = conn.cursor()
+            cursor = InstrumentedCursor(conn.cursor())
             
             if economy_type == "server":
                 # サーバー経済の送金処理
@@ -243,11 +245,17 @@ class Economy(commands.Cog):
             color=discord.Color.gold()
         )
         
+        # 表示名はまとめて解決する（キャッシュに無いユーザーも落とさない）
+        resolver = self.bot.user_resolver
+        server_users, global_users = await asyncio.gather(
+            resolver.resolve_many([user_id for user_id, _ in server_leaderboard_data], interaction.guild),
+            resolver.resolve_many([user_id for user_id, _ in global_leaderboard_data])
+        )
+
         server_rank_str = ""
         for i, (user_id, balance) in enumerate(server_leaderboard_data):
-            user = self.bot.get_user(user_id)
-            if user:
-                server_rank_str += f"`{i+1}.` {user.name} - **{balance}**\n"
+            name = resolver.label(server_users[user_id], user_id)
+            server_rank_str += f"`{i+1}.` {name} - **{balance}**\n"
         if not server_rank_str:
             server_rank_str = "データがありません。"
         
@@ -255,9 +263,8 @@ class Economy(commands.Cog):
         
         global_rank_str = ""
         for i, (user_id, balance) in enumerate(global_leaderboard_data):
-            user = self.bot.get_user(user_id)
-            if user:
-                global_rank_str += f"`{i+1}.` {user.name} - **{balance}**\n"
+            name = resolver.label(global_users[user_id], user_id)
+            global_rank_str += f"`{i+1}.` {name} - **{balance}**\n"
         if not global_rank_str:
             global_rank_str = "データがありません。"
 
@@ -336,7 +343,7 @@ class Economy(commands.Cog):
                 database=os.getenv("DB_NAME"),
                 port=int(os.getenv("DB_PORT", 3306))
             )
-            cursor = conn.cursor()
+            cursor = InstrumentedCursor(conn.cursor())
             
             cursor.execute("SELECT price FROM shop_items WHERE guild_id = %s AND item_name = %s", (interaction.guild.id, item_name))
             item_data = cursor.fetchone()
@@ -1,59 +1,104 @@
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands
-import psutil
 import platform
 import asyncio
 import time
+from utils.system_sampler import SystemSampler
 
 class Info(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.start_time = time.time()  # ← Bot起動時間を記録
+        # CPU・メモリ等は別スレッドで5秒ごとに採取（直近10分を保持）
+        self.sampler = SystemSampler(bot, interval=5.0, size=120)
+        self.sampler.start()
         self.update_status.start()
 
     def cog_unload(self):
         self.update_status.cancel()
+        self.sampler.stop()
 
     # /info コマンド
     @app_commands.command(name="info", description="Botの情報を表示します")
-    async def info(self, interaction: discord.Interaction):
-        cpu = psutil.cpu_percent(interval=0.5)
-        memory = psutil.virtual_memory().percent
+    @app_commands.describe(detail="直近10分間の最小/平均/最大も表示する")
+    async def info(self, interaction: discord.Interaction, detail: bool = False):
+        sample = self.sampler.latest()
         uptime = self.get_bot_uptime()
 
         embed = discord.Embed(title="🤖 Bot情報", color=discord.Color.blue())
         embed.add_field(name="サーバー数", value=f"{len(self.bot.guilds)}", inline=True)
-        embed.add_field(name="ユーザー数", value=f"{len(self.bot.users)}", inline=True)
-        embed.add_field(name="CPU使用率", value=f"{cpu}%", inline=True)
-        embed.add_field(name="メモリ使用率", value=f"{memory}%", inline=True)
+        # メンバーキャッシュを絞っているので bot.users では少なく出る。各サーバーの人数の合計（重複あり）
+        embed.add_field(name="ユーザー数", value=f"{sum(g.member_count or 0 for g in self.bot.guilds):,}", inline=True)
+        if sample:
+            embed.add_field(name="CPU使用率", value=f"{sample.cpu_percent}%", inline=True)
+            embed.add_field(name="メモリ使用率", value=f"{sample.memory_percent}%", inline=True)
+            embed.add_field(name="プロセスメモリ", value=f"{sample.rss / 1024 / 1024:.1f} MB", inline=True)
+            embed.add_field(name="スレッド / FD", value=f"{sample.threads} / {sample.open_fds if sample.open_fds is not None else '-'}", inline=True)
+            if sample.latency_ms is not None:
+                embed.add_field(name="レイテンシ", value=f"{sample.latency_ms:.0f} ms", inline=True)
+        else:
+            embed.add_field(name="CPU使用率", value="計測中", inline=True)
         embed.add_field(name="稼働時間", value=uptime, inline=False)
+        if detail:
+            embed.add_field(name="直近10分間（最小 / 平均 / 最大）", value=self.format_summary(), inline=False)
         embed.add_field(name="Python", value=platform.python_version(), inline=True)
         embed.add_field(name="discord.py", value=discord.__version__, inline=True)
 
         await interaction.response.send_message(embed=embed)
 
-    # ステータスを定期的に更新
+    # ステータスを定期的に更新（シャードごとに、そのシャードのサーバー数を表示）
     @tasks.loop(minutes=1)
     async def update_status(self):
-        servers = len(self.bot.guilds)
-        users = len(self.bot.users)
-        cpu = psutil.cpu_percent(interval=0.5)
+        sample = self.sampler.latest()
+        shard_ids = sorted(getattr(self.bot, "shards", {}) or [None])
+        shard_count = getattr(self.bot, "shard_count", None) or 1
 
-        statuses = [
-            discord.Game(f"{servers} サーバーに導入中"),
-            discord.Game(f"{users} ユーザー監視中"),
-            discord.Game(f"CPU {cpu}%使用中"),
-        ]
-
-        for status in statuses:
-            await self.bot.change_presence(activity=status)
+        for index in range(3 if sample else 2):
+            await asyncio.gather(*(
+                self._set_presence(shard_id, shard_count, index, sample) for shard_id in shard_ids
+            ))
             await asyncio.sleep(20)  # 20秒ごとに切り替え
 
+    async def _set_presence(self, shard_id, shard_count, index, sample):
+        guilds = [g for g in self.bot.guilds if shard_id is None or g.shard_id == shard_id]
+        if index == 0:
+            text = f"{len(guilds)} サーバーに導入中"
+        elif index == 1:
+            text = f"{sum(g.member_count or 0 for g in guilds)} ユーザー監視中"
+        else:
+            text = f"CPU {sample.cpu_percent}%使用中"
+        if shard_id is not None and shard_count > 1:
+            text += f" | shard {shard_id}"
+        kwargs = {} if shard_id is None else {"shard_id": shard_id}
+        try:
+            await self.bot.change_presence(activity=discord.Game(text), **kwargs)
+        except discord.ConnectionClosed:
+            # 再接続中のシャードは次の周期で更新する
+            pass
+
     @update_status.before_loop
     async def before_update_status(self):
         await self.bot.wait_until_ready()
 
+    def format_summary(self) -> str:
+        summary = self.sampler.summary()
+        if not summary:
+            return "データがありません。"
+        rows = [
+            ("Bot CPU", "process_cpu", lambda v: f"{v:.1f}%"),
+            ("メモリ", "rss", lambda v: f"{v / 1024 / 1024:.1f}MB"),
+            ("FD", "open_fds", lambda v: f"{v:.0f}"),
+            ("スレッド", "threads", lambda v: f"{v:.0f}"),
+            ("レイテンシ", "latency_ms", lambda v: f"{v:.0f}ms"),
+        ]
+        lines = []
+        for label, field, fmt in rows:
+            if field in summary:
+                low, avg, high = summary[field]
+                lines.append(f"{label}: {fmt(low)} / {fmt(avg)} / {fmt(high)}")
+        return "\n".join(lines)
+
     def get_bot_uptime(self):
         uptime_seconds = int(time.time() - self.start_time)
         hours, remainder = divmod(uptime_seconds, 3600)
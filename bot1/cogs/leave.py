@@ -1,59 +1,103 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import mysql.connector
-import os
+import asyncio
 from datetime import datetime
-from typing import Optional
+from typing import Dict, NamedTuple, Optional
+from utils import db
+from utils.log_sink import BatchLogSink
+from utils.member_stats import MemberStatsRollup, ensure_schema
+from utils.message_template import MessageTemplate
+from utils.metrics import InstrumentedCursor
+
+# mo!setleave / mo!delleave のためにギルドのメッセージも受け取る
+COG_MANIFEST = {
+    "intents": ["guild_messages"],
+    "events": ["on_raw_member_remove"],
+}
+
+# Leaveメッセージで使えるプレースホルダ（ロールメンションは不要なため {stuff} は対象外）
+LEAVE_PLACEHOLDERS = ("member", "guild_name", "count")
+
+class LeaveSettings(NamedTuple):
+    channel_id: int
+    template: MessageTemplate
 
 class Leave(commands.Cog):
     """高度なLeaveメッセージ管理Cog（/ と prefix 両対応）"""
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.conn = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME"),
-            port=int(os.getenv("DB_PORT", 3306))
+        # 接続は cog_load で非同期に行う
+        self.conn = None
+        self.cursor = None
+        # guild_id -> 有効な設定（設定のないギルドは登録しない）
+        self.settings: Dict[int, LeaveSettings] = {}
+        # 退出ログは1秒ごとにまとめて書き込み、同時にロールアップを更新する
+        self.log_sink = BatchLogSink(
+            "INSERT INTO leave_logs (guild_id, member_id, left_at, member_count) VALUES (%s, %s, %s, %s)",
+            on_flush=MemberStatsRollup("leave")
+        )
+
+    async def cog_load(self):
+        self.conn = await asyncio.to_thread(db.connect)
+        self.cursor = InstrumentedCursor(self.conn.cursor())
+        await asyncio.to_thread(self._load_settings)
+        self.log_sink.start()
+
+    async def cog_unload(self):
+        # 未書き込みの退出ログを書き出してから終了
+        await self.log_sink.close()
+        if self.conn:
+            await asyncio.to_thread(self.conn.close)
+
+    def _load_settings(self):
+        ensure_schema(self.cursor)
+        # 有効な設定を起動時に一括で読み込み、退出イベントではDBを読まない
+        self.cursor.execute(
+            "SELECT guild_id, channel_id, message FROM leave_settings WHERE deleted_at IS NULL"
+        )
+        for guild_id, channel_id, message in self.cursor.fetchall():
+            self._cache_settings(guild_id, channel_id, message)
+
+    # -----------------------------
+    # 内部: 設定キャッシュ
+    # -----------------------------
+    def _cache_settings(self, guild_id: int, channel_id: int, message: str):
+        self.settings[guild_id] = LeaveSettings(
+            channel_id, MessageTemplate(message or "", LEAVE_PLACEHOLDERS)
         )
-        self.cursor = self.conn.cursor()
 
     # -----------------------------
     # 退出時の送信（共通処理）
     # -----------------------------
+    # メンバーキャッシュに居なかった人の退出も拾えるよう raw イベントを使う
     @commands.Cog.listener()
-    async def on_member_remove(self, member: discord.Member):
-        self.cursor.execute(
-            "SELECT channel_id, message FROM leave_settings WHERE guild_id=%s AND deleted_at IS NULL",
-            (member.guild.id,)
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        guild = self.bot.get_guild(payload.guild_id)
+        member_count = guild.member_count if guild else None
+
+        # 退出ログ（バッチ書き込み）。メッセージの設定や送信の成否に関係なく残す
+        await self.log_sink.put(
+            (payload.guild_id, payload.user.id, datetime.now(), member_count)
         )
-        result = self.cursor.fetchone()
-        if not result:
-            return
 
-        channel_id, message = result
-        channel = member.guild.get_channel(channel_id)
+        settings = self.settings.get(payload.guild_id)
+        if not settings or not guild:
+            return
+        channel = guild.get_channel(settings.channel_id)
         if not channel:
             return
 
         # プレースホルダ置換
-        msg = (message or "")
-        msg = msg.replace("{member}", member.mention)
-        msg = msg.replace("{guild_name}", member.guild.name)
-        msg = msg.replace("{count}", str(member.guild.member_count))
-        # 退出メッセージにはロールメンションは不要なため、{stuff}の置換は削除
+        msg = settings.template.render({
+            "member": payload.user.mention,
+            "guild_name": guild.name,
+            "count": str(guild.member_count),
+        })
 
         await channel.send(msg)
 
-        # 退出ログ
-        self.cursor.execute(
-            "INSERT INTO leave_logs (guild_id, member_id, left_at, member_count) VALUES (%s, %s, %s, %s)",
-            (member.guild.id, member.id, datetime.now(), member.guild.member_count)
-        )
-        self.conn.commit()
-
     # -----------------------------
     # 内部: 設定の保存（共通化）
     # -----------------------------
@@ -70,6 +114,18 @@ class Leave(commands.Cog):
             (guild_id, channel_id, message, datetime.now())
         )
         self.conn.commit()
+        self._cache_settings(guild_id, channel_id, message)
+
+    # -----------------------------
+    # 内部: 設定の削除（共通化）
+    # -----------------------------
+    def _delete_leave(self, guild_id: int):
+        self.cursor.execute(
+            "UPDATE leave_settings SET deleted_at=%s WHERE guild_id=%s AND deleted_at IS NULL",
+            (datetime.now(), guild_id)
+        )
+        self.conn.commit()
+        self.settings.pop(guild_id, None)
 
     # -----------------------------
     # /setleave（スラッシュ）
@@ -105,11 +161,7 @@ class Leave(commands.Cog):
     @app_commands.command(name="delleave", description="Leaveメッセージを削除")
     @app_commands.checks.has_permissions(administrator=True)
     async def delleave(self, interaction: discord.Interaction):
-        self.cursor.execute(
-            "UPDATE leave_settings SET deleted_at=%s WHERE guild_id=%s AND deleted_at IS NULL",
-            (datetime.now(), interaction.guild.id)
-        )
-        self.conn.commit()
+        self._delete_leave(interaction.guild.id)
         await interaction.response.send_message("Leaveメッセージを削除しました。", ephemeral=True)
 
     # -----------------------------
@@ -118,11 +170,7 @@ class Leave(commands.Cog):
     @commands.command(name="delleave")
     @commands.has_permissions(administrator=True)
     async def delleave_prefix(self, ctx: commands.Context):
-        self.cursor.execute(
-            "UPDATE leave_settings SET deleted_at=%s WHERE guild_id=%s AND deleted_at IS NULL",
-            (datetime.now(), ctx.guild.id)
-        )
-        self.conn.commit()
+        self._delete_leave(ctx.guild.id)
         await ctx.send("Leaveメッセージを削除しました。")
 
 async def setup(bot: commands.Bot):
@@ -1,23 +1,98 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
-import mysql.connector
+import asyncio
 import os
+import time
 from datetime import datetime
+from typing import Dict, List, Optional
+from utils import db, tracing
+from utils.level_curve import (
+    CURVE_SCHEMA, DEFAULT_CURVE, LevelCurve, curve_from_row, custom_curve, power_curve,
+    recalculate_levels, save_curve
+)
+from utils.jobs import chunked_update
+from utils.members import resolve_members
+from utils.metrics import InstrumentedCursor
+from utils.voice_xp import (
+    VOICE_SETTINGS_SCHEMA, VoiceSessionTracker, VoiceXPSettings, eligible_members, settle_voice_xp,
+    voice_channels
+)
+
+COG_MANIFEST = {
+    "events": ["on_message", "on_voice_state_update"],
+}
+
+# VC の XP をまとめて書き込む間隔（秒）
+VOICE_SETTLE_INTERVAL = float(os.getenv("VOICE_XP_SETTLE_SECONDS", 60))
+DEFAULT_VOICE_SETTINGS = VoiceXPSettings()
 
 class Level(commands.Cog):
     """XP・レベル管理＋通知チャンネル＋サーバー/グローバルランキング"""
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.conn = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME"),
-            port=int(os.getenv("DB_PORT", 3306))
+        # 接続は cog_load で非同期に行う
+        self.conn = None
+        self.cursor = None
+        # サーバーID -> レベルカーブ（未設定のサーバーは DEFAULT_CURVE）
+        self.curves: Dict[int, LevelCurve] = {}
+        # 再計算中のサーバー
+        self._recalculating = set()
+        # VC 滞在時間の集計（DB への書き込みは voice_settle_loop でまとめて行う）
+        self.voice = VoiceSessionTracker()
+        self.voice_settings: Dict[int, VoiceXPSettings] = {}
+
+    async def cog_load(self):
+        self.conn = await asyncio.to_thread(db.connect)
+        self.cursor = InstrumentedCursor(self.conn.cursor())
+        await asyncio.to_thread(self._load_curves)
+        # 全ユーザーに触る操作はジョブとして user_id 順に少しずつ更新する
+        self.bot.job_runner.register(
+            "level.reset_xp",
+            chunked_update("サーバー内XPのリセット", "user_levels", "xp=0, level=1, updated_at=NOW()")
+        )
+        self.bot.job_runner.register(
+            "level.setxp",
+            chunked_update("1メッセージあたりのXPの変更", "user_levels", "xp_per_message=%s",
+                           lambda params: (params["xp"],))
+        )
+        await asyncio.to_thread(self._load_voice_settings)
+        self.voice_settle_loop.change_interval(seconds=VOICE_SETTLE_INTERVAL)
+        self.voice_settle_loop.start()
+        # リロード時は ready 済みなので、ここでセッションを作り直す
+        if self.bot.is_ready():
+            self._rebuild_voice_sessions()
+
+    def _load_curves(self):
+        for statement in CURVE_SCHEMA:
+            self.cursor.execute(statement)
+        self.cursor.execute("SELECT guild_id, kind, base, exponent, thresholds FROM level_curves")
+        for guild_id, kind, base, exponent, thresholds in self.cursor.fetchall():
+            self.curves[guild_id] = curve_from_row(kind, base, exponent, thresholds)
+        self.conn.commit()
+
+    def _load_voice_settings(self):
+        self.cursor.execute(VOICE_SETTINGS_SCHEMA)
+        self.cursor.execute(
+            "SELECT guild_id, enabled, xp_per_minute, require_unmuted, min_members FROM level_voice_settings"
         )
-        self.cursor = self.conn.cursor()
+        for guild_id, enabled, xp_per_minute, require_unmuted, min_members in self.cursor.fetchall():
+            self.voice_settings[guild_id] = VoiceXPSettings(bool(enabled), xp_per_minute, bool(require_unmuted), min_members)
+        self.conn.commit()
+
+    def curve_for(self, guild_id: int) -> LevelCurve:
+        return self.curves.get(guild_id, DEFAULT_CURVE)
+
+    def voice_settings_for(self, guild_id: int) -> VoiceXPSettings:
+        return self.voice_settings.get(guild_id, DEFAULT_VOICE_SETTINGS)
+
+    async def cog_unload(self):
+        self.voice_settle_loop.cancel()
+        # 未精算の分を書き込んでから閉じる
+        await self._settle_voice()
+        if self.conn:
+            await asyncio.to_thread(self.conn.close)
 
     # メッセージ送信でXP付与
     @commands.Cog.listener()
@@ -38,34 +113,47 @@ class Level(commands.Cog):
 
         # ユーザー情報取得
         self.cursor.execute(
-            "SELECT xp, level, xp_per_message, notify_channel_id FROM user_levels WHERE guild_id=%s AND user_id=%s",
+            "SELECT level, xp_per_message, notify_channel_id FROM user_levels WHERE guild_id=%s AND user_id=%s",
             (guild_id, user_id)
         )
         user_result = self.cursor.fetchone()
 
+        # XP は相対で足す（VC の精算と同時に書いても消し合わない）
         if user_result:
-            xp, level, xp_per_msg, notify_channel_id = user_result
+            level, xp_per_msg, notify_channel_id = user_result
             xp_per_msg = xp_per_msg or 10
-            notify_channel_id = notify_channel_id
-            xp += xp_per_msg
+            self.cursor.execute(
+                "UPDATE user_levels SET xp=xp+%s, updated_at=%s WHERE guild_id=%s AND user_id=%s",
+                (xp_per_msg, datetime.now(), guild_id, user_id)
+            )
         else:
-            xp = 10
             level = 1
             xp_per_msg = 10
             notify_channel_id = None
             self.cursor.execute(
                 "INSERT INTO user_levels (guild_id, user_id, xp, level, xp_per_message, created_at) "
-                "VALUES (%s, %s, %s, %s, %s, %s)",
-                (guild_id, user_id, xp, level, xp_per_msg, datetime.now())
+                "VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE xp=xp+VALUES(xp)",
+                (guild_id, user_id, xp_per_msg, level, xp_per_msg, datetime.now())
             )
-            self.conn.commit()
+        self.cursor.execute(
+            "SELECT xp FROM user_levels WHERE guild_id=%s AND user_id=%s",
+            (guild_id, user_id)
+        )
+        xp = self.cursor.fetchone()[0]
+        self.conn.commit()
 
-        # レベル計算
-        new_level = int(xp ** (1/4))
-        leveled_up = False
+        # レベル計算（サーバーごとの閾値テーブルを二分探索）
+        new_level = self.curve_for(guild_id).level_for(xp)
         if new_level > level:
+            # VC の精算が先に上げていたら通知しない（レベルは下げない）
+            self.cursor.execute(
+                "UPDATE user_levels SET level=%s, updated_at=%s WHERE guild_id=%s AND user_id=%s AND level<%s",
+                (new_level, datetime.now(), guild_id, user_id, new_level)
+            )
+            self.conn.commit()
+            if not self.cursor.rowcount:
+                return
             level = new_level
-            leveled_up = True
 
             # レベルアップ通知
             if notify_channel_id:
@@ -87,30 +175,154 @@ class Level(commands.Cog):
                 if role:
                     await message.author.add_roles(role, reason=f"レベル {level} 到達による自動付与")
 
-        # DB更新
-        if leveled_up:
-            self.cursor.execute(
-                "UPDATE user_levels SET xp=%s, level=%s, updated_at=%s WHERE guild_id=%s AND user_id=%s",
-                (xp, level, datetime.now(), guild_id, user_id)
-            )
-        else:
-            self.cursor.execute(
-                "UPDATE user_levels SET xp=%s, updated_at=%s WHERE guild_id=%s AND user_id=%s",
-                (xp, datetime.now(), guild_id, user_id)
-            )
+    # -----------------------------
+    # VC 滞在による XP
+    # -----------------------------
+    def _sync_voice_channel(self, channel, now: float):
+        if channel is None:
+            return
+        settings = self.voice_settings_for(channel.guild.id)
+        present = [member.id for member in channel.members]
+        self.voice.sync_channel(channel.guild.id, present, eligible_members(channel, settings), now)
+
+    def _rebuild_voice_sessions(self, guild: Optional[discord.Guild] = None):
+        """VC の状態キャッシュからセッションを作り直す（起動・再接続・設定変更時）"""
+        now = time.monotonic()
+        for g in ([guild] if guild else self.bot.guilds):
+            settings = self.voice_settings_for(g.id)
+            eligible = set()
+            for channel in voice_channels(g):
+                eligible |= eligible_members(channel, settings)
+            self.voice.sync_guild(g.id, eligible, now)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self._rebuild_voice_sessions()
+        print(f"🎙️ VC の XP 集計を再開しました（{self.voice.active} 人）")
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.voice.forget_guild(guild.id)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        now = time.monotonic()
+        if after.channel is None:
+            self.voice.set_active((member.guild.id, member.id), False, now)
+        # 入退室・ミュートで人数条件が変わるので、関係するチャンネルの全員を見直す
+        self._sync_voice_channel(before.channel, now)
+        if after.channel != before.channel:
+            self._sync_voice_channel(after.channel, now)
+
+    async def _settle_voice(self):
+        rate_for = lambda guild_id: self.voice_settings_for(guild_id).xp_per_minute
+        awards = self.voice.settle(time.monotonic(), rate_for)
+        if not awards:
+            return
+        conn = await db.pool.acquire()
+        discard = False
+        try:
+            level_ups, failed = await tracing.to_thread(settle_voice_xp, conn, awards, self.curve_for, datetime.now())
+            discard = bool(failed)
+        except Exception as e:
+            # 接続そのものが使えなかった場合。全員分を次回に持ち越す
+            print(f"VC の XP 書き込みエラー（{len(awards)} 人分を次回に持ち越し）: {e}")
+            self.voice.restore(awards, rate_for)
+            discard = True
+            return
+        finally:
+            await db.pool.release(conn, discard=discard)
+        if failed:
+            self.voice.restore(failed, rate_for)
+
+        # VC を抜けた人はキャッシュから外れているので、サーバーごとにまとめて取得し直す
+        by_guild: Dict[int, List[int]] = {}
+        for level_up in level_ups:
+            by_guild.setdefault(level_up.guild_id, []).append(level_up.user_id)
+        members: Dict[int, Dict[int, discord.Member]] = {}
+        for guild_id, user_ids in by_guild.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+            try:
+                members[guild_id] = await resolve_members(guild, user_ids)
+            except discord.HTTPException as e:
+                print(f"レベルアップしたメンバーを取得できません（サーバー {guild_id}）: {e}")
+
+        for level_up in level_ups:
+            guild = self.bot.get_guild(level_up.guild_id)
+            member = members.get(level_up.guild_id, {}).get(level_up.user_id)
+            if guild is None or member is None:
+                continue
+            if level_up.notify_channel_id:
+                channel = guild.get_channel(level_up.notify_channel_id)
+                if channel:
+                    await channel.send(f"🎉 {member.mention} がレベル {level_up.level} に上がりました！")
+            role = guild.get_role(level_up.role_id) if level_up.role_id else None
+            if role:
+                try:
+                    await member.add_roles(role, reason=f"レベル {level_up.level} 到達による自動付与")
+                except discord.HTTPException as e:
+                    print(f"レベルロール付与エラー: {e}")
+
+    @tasks.loop(seconds=60)
+    async def voice_settle_loop(self):
+        await self._settle_voice()
+
+    @voice_settle_loop.before_loop
+    async def before_voice_settle(self):
+        # /reload など、コマンドの中から起動されてもそのトレースを引き継がない
+        tracing.detach()
+
+    @app_commands.command(name="voicexp", description="VC に居る時間で貯まる XP を設定")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        enabled="VC の XP を有効にする",
+        xp_per_minute="1分あたりの XP",
+        require_unmuted="ミュート中は XP を貯めない（スピーカーミュートは常に対象外）",
+        min_members="この人数以上いるチャンネルでだけ XP を貯める（Bot を除く）"
+    )
+    async def voicexp(
+        self, interaction: discord.Interaction,
+        enabled: Optional[bool] = None,
+        xp_per_minute: Optional[app_commands.Range[int, 1, 1000]] = None,
+        require_unmuted: Optional[bool] = None,
+        min_members: Optional[app_commands.Range[int, 1, 25]] = None
+    ):
+        await interaction.response.defer(ephemeral=True)
+        current = self.voice_settings_for(interaction.guild.id)
+        settings = VoiceXPSettings(
+            current.enabled if enabled is None else enabled,
+            current.xp_per_minute if xp_per_minute is None else xp_per_minute,
+            current.require_unmuted if require_unmuted is None else require_unmuted,
+            current.min_members if min_members is None else min_members
+        )
+        self.cursor.execute(
+            "INSERT INTO level_voice_settings (guild_id, enabled, xp_per_minute, require_unmuted, min_members, updated_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE enabled=VALUES(enabled), xp_per_minute=VALUES(xp_per_minute), "
+            "require_unmuted=VALUES(require_unmuted), min_members=VALUES(min_members), updated_at=VALUES(updated_at)",
+            (interaction.guild.id, int(settings.enabled), settings.xp_per_minute, int(settings.require_unmuted),
+             settings.min_members, datetime.now())
+        )
         self.conn.commit()
+        # 変更前の条件で貯まった分を精算してから、新しい条件でセッションを作り直す
+        await self._settle_voice()
+        self.voice_settings[interaction.guild.id] = settings
+        self._rebuild_voice_sessions(interaction.guild)
+        state = "有効" if settings.enabled else "無効"
+        await interaction.followup.send(
+            f"VC の XP を{state}にしました（1分あたり {settings.xp_per_minute} XP・{settings.min_members}人以上"
+            f"{'・ミュート中は対象外' if settings.require_unmuted else ''}）。",
+            ephemeral=True
+        )
 
     # 管理者向け：XP設定
     @app_commands.command(name="setxp", description="1メッセージあたりのXP量を設定")
     @app_commands.describe(xp="XPの値")
     @app_commands.checks.has_permissions(administrator=True)
     async def setxp(self, interaction: discord.Interaction, xp: int):
-        self.cursor.execute(
-            "UPDATE user_levels SET xp_per_message=%s WHERE guild_id=%s",
-            (xp, interaction.guild.id)
-        )
-        self.conn.commit()
-        await interaction.response.send_message(f"1メッセージあたりのXPを {xp} に設定しました。", ephemeral=True)
+        await self.bot.job_runner.submit(interaction, "level.setxp", {"xp": xp})
 
     # 管理者向け：通知チャンネル設定
     @app_commands.command(name="setnotify", description="レベルアップ通知チャンネルを設定")
@@ -139,43 +351,97 @@ class Level(commands.Cog):
     # サーバー内ランキング
     @app_commands.command(name="rank", description="サーバー内ランキングを表示")
     async def rank(self, interaction: discord.Interaction):
+        # 表示名の取得で API を待つことがあるので先に応答を保留する
+        await interaction.response.defer()
         guild_id = interaction.guild.id
         self.cursor.execute(
             "SELECT user_id, level, xp FROM user_levels WHERE guild_id=%s ORDER BY level DESC, xp DESC LIMIT 10",
             (guild_id,)
         )
         top_users = self.cursor.fetchall()
+        # キャッシュに無いメンバーはまとめて問い合わせる
+        resolver = self.bot.user_resolver
+        users = await resolver.resolve_many([user_id for user_id, _, _ in top_users], interaction.guild)
         embed = discord.Embed(title="サーバー内ランキング", color=discord.Color.green())
         for i, (user_id, level, xp) in enumerate(top_users, 1):
-            member = interaction.guild.get_member(user_id)
-            name = member.display_name if member else str(user_id)
+            name = resolver.label(users[user_id], user_id)
             embed.add_field(name=f"#{i} {name}", value=f"Level {level} / XP {xp}", inline=False)
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
 
     # グローバルランキング
     @app_commands.command(name="rank_global", description="Bot導入サーバー全体のランキングを表示")
     async def rank_global(self, interaction: discord.Interaction):
+        await interaction.response.defer()
         self.cursor.execute(
             "SELECT user_id, level, xp FROM user_levels ORDER BY level DESC, xp DESC LIMIT 10"
         )
         top_users = self.cursor.fetchall()
         embed = discord.Embed(title="グローバルランキング", color=discord.Color.gold())
+        resolver = self.bot.user_resolver
+        users = await resolver.resolve_many([user_id for user_id, _, _ in top_users])
         for i, (user_id, level, xp) in enumerate(top_users, 1):
-            user = self.bot.get_user(user_id)
-            name = user.name if user else str(user_id)
+            name = resolver.label(users[user_id], user_id)
             embed.add_field(name=f"#{i} {name}", value=f"Level {level} / XP {xp}", inline=False)
-        await interaction.response.send_message(embed=embed)
+        await interaction.followup.send(embed=embed)
+
+    # -----------------------------
+    # レベルカーブ
+    # -----------------------------
+    @app_commands.command(name="setlevelcurve", description="レベルに必要なXPのカーブを設定し、全員のレベルを再計算")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        base="係数（レベルLの必要XP = 係数 × L^指数）",
+        exponent="指数（既定の 4 は従来と同じ）",
+        thresholds="カスタム: レベル2以降に必要な累計XPをカンマ区切りで（指定すると係数・指数は無視）"
+    )
+    async def setlevelcurve(
+        self, interaction: discord.Interaction,
+        base: app_commands.Range[float, 0.01, 1_000_000] = 1.0,
+        exponent: app_commands.Range[float, 0.5, 6] = 4.0,
+        thresholds: Optional[str] = None
+    ):
+        try:
+            if thresholds:
+                curve = custom_curve([int(x) for x in thresholds.replace(" ", "").split(",") if x])
+            else:
+                curve = power_curve(base, exponent)
+        except ValueError as e:
+            await interaction.response.send_message(f"カーブを設定できません: {e}", ephemeral=True)
+            return
+
+        save_curve(self.cursor, interaction.guild.id, curve, datetime.now())
+        self.conn.commit()
+        self.curves[interaction.guild.id] = curve
+        await self._recalculate(interaction, curve)
+
+    @app_commands.command(name="recalc_levels", description="現在のカーブで全員のレベルを再計算")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def recalc_levels(self, interaction: discord.Interaction):
+        await self._recalculate(interaction, self.curve_for(interaction.guild.id))
+
+    async def _recalculate(self, interaction: discord.Interaction, curve: LevelCurve):
+        guild_id = interaction.guild.id
+        if guild_id in self._recalculating:
+            await interaction.response.send_message("⏳ このサーバーのレベルは再計算中です。", ephemeral=True)
+            return
+        self._recalculating.add(guild_id)
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            started = datetime.now()
+            # 専用の接続で、user_id の範囲ごとに集合演算の UPDATE を流す
+            changed = await asyncio.to_thread(recalculate_levels, guild_id, curve)
+            elapsed = (datetime.now() - started).total_seconds()
+            await interaction.followup.send(
+                f"✅ レベルカーブ: {curve.describe()}\n{changed}人のレベルを更新しました（{elapsed:.1f}秒）。",
+                ephemeral=True
+            )
+        finally:
+            self._recalculating.discard(guild_id)
 
     @app_commands.command(name="reset_xp", description="サーバー内全ユーザーのXPをリセット")
     @app_commands.checks.has_permissions(administrator=True)
     async def reset_xp(self, interaction: discord.Interaction):
-        guild_id = interaction.guild.id
-        self.cursor.execute(
-            "UPDATE user_levels SET xp=0, level=1, updated_at=NOW() WHERE guild_id=%s",
-            (guild_id,)
-        )
-        self.conn.commit()
-        await interaction.response.send_message("サーバー内全ユーザーのXPとレベルをリセットしました。", ephemeral=True)
+        await self.bot.job_runner.submit(interaction, "level.reset_xp")
 
     @app_commands.command(name="reset_user_xp", description="特定ユーザーのXPをリセット")
     @app_commands.checks.has_permissions(administrator=True)
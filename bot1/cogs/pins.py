@@ -4,7 +4,12 @@ from discord import app_commands
 import mysql.connector
 import os
 from datetime import datetime
-import asyncio
+from utils import tracing
+from utils.metrics import InstrumentedCursor
+
+COG_MANIFEST = {
+    "events": ["on_message"],
+}
 
 class Pins(commands.Cog):
     """メッセージピン留め管理コグ"""
@@ -34,27 +39,27 @@ class Pins(commands.Cog):
                 database=os.getenv("DB_NAME"),
                 port=int(os.getenv("DB_PORT", 3306))
             )
-            cursor = conn.cursor()
+            cursor = InstrumentedCursor(conn.cursor())
             
-            await asyncio.to_thread(cursor.execute, query, params)
+            await tracing.to_thread(cursor.execute, query, params)
 
             if is_read:
-                result = await asyncio.to_thread(cursor.fetchall)
+                result = await tracing.to_thread(cursor.fetchall)
                 return result
             else:
-                await asyncio.to_thread(conn.commit)
+                await tracing.to_thread(conn.commit)
                 return None
                 
         except mysql.connector.Error as err:
             print(f"データベースエラーが発生しました: {err}")
             if conn:
-                await asyncio.to_thread(conn.rollback)
+                await tracing.to_thread(conn.rollback)
             raise err
         finally:
             if cursor:
-                await asyncio.to_thread(cursor.close)
+                await tracing.to_thread(cursor.close)
             if conn:
-                await asyncio.to_thread(conn.close)
+                await tracing.to_thread(conn.close)
 
     # -----------------------------
     # メッセージ送信時の自動更新
@@ -88,9 +93,9 @@ class Pins(commands.Cog):
                     description=content,
                     color=discord.Color.blue()
                 )
-                author = self.bot.get_user(author_id)
+                author = await self.bot.user_resolver.resolve(author_id, message.guild)
                 if author:
-                    embed.set_author(name=f"{author.display_name}の投稿", icon_url=author.avatar.url)
+                    embed.set_author(name=f"{author.display_name}の投稿", icon_url=author.avatar_url)
                 else:
                     embed.set_author(name=f"不明なユーザー (ID: {author_id})の投稿")
                 
@@ -159,7 +164,7 @@ class Pins(commands.Cog):
                 description=target_message.content,
                 color=discord.Color.blue()
             )
-            embed.set_author(name=f"{target_message.author.display_name}の投稿", icon_url=target_message.author.avatar.url)
+            embed.set_author(name=f"{target_message.author.display_name}の投稿", icon_url=target_message.author.display_avatar.url)
 
             new_pinned_message = await interaction.channel.send(embed=embed)
 
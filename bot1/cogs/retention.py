@@ -0,0 +1,62 @@
+import discord
+from discord.ext import commands, tasks
+import asyncio
+import os
+from utils.retention import RetentionRunner, load_policies
+
+# mo!retention（オーナー専用）はサーバーでも DM でも受け付ける
+COG_MANIFEST = {
+    "intents": ["guild_messages", "dm_messages"],
+}
+
+class Retention(commands.Cog):
+    """ログ・論理削除済み設定の保持期間管理Cog"""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.runner = RetentionRunner(
+            load_policies(),
+            archive_dir=os.getenv("RETENTION_ARCHIVE_DIR", "archive"),
+            chunk_size=int(os.getenv("RETENTION_CHUNK_SIZE", 1000))
+        )
+        self._lock = asyncio.Lock()
+        # 複数プロセスで動かすときは同じテーブルを二重に整理しないようクラスタ0だけで回す
+        shard_config = getattr(bot, "shard_config", None)
+        if shard_config is None or shard_config.is_primary:
+            self.purge_loop.start()
+
+    def cog_unload(self):
+        self.purge_loop.cancel()
+
+    async def _run(self):
+        # 同時に2回走らないようにし、重い処理はスレッドで実行する
+        async with self._lock:
+            results = await asyncio.to_thread(self.runner.run)
+        summary = ", ".join(f"{table}: {count}件" for table, count in results.items())
+        print(f"🧹 保持期間処理完了 ({summary})")
+        return results
+
+    # 6時間ごとに期限切れの行を整理
+    @tasks.loop(hours=6)
+    async def purge_loop(self):
+        await self._run()
+
+    @purge_loop.before_loop
+    async def before_purge_loop(self):
+        await self.bot.wait_until_ready()
+
+    # -----------------------------
+    # mo!retention（Botオーナー専用・即時実行）
+    # -----------------------------
+    @commands.command(name="retention")
+    @commands.is_owner()
+    async def retention_prefix(self, ctx: commands.Context):
+        if self._lock.locked():
+            return await ctx.send("保持期間処理はすでに実行中です。")
+        await ctx.send("⏳ 保持期間処理を実行します...")
+        results = await self._run()
+        lines = [f"`{table}`: {count}件" for table, count in results.items()]
+        await ctx.send("✅ 保持期間処理が完了しました。\n" + ("\n".join(lines) or "対象テーブルはありません。"))
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Retention(bot))
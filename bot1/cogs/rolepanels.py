@@ -3,9 +3,16 @@ from discord.ext import commands
 from discord import app_commands
 import mysql.connector
 import os
-import asyncio
 from typing import Optional, List, Dict, Tuple, Any
 import re
+from utils import tracing
+from utils.jobs import JobKind
+from utils.members import resolve_member
+from utils.metrics import InstrumentedCursor
+
+COG_MANIFEST = {
+    "events": ["on_raw_reaction_add", "on_raw_reaction_remove"],
+}
 
 # DBヘルパーメソッド（非同期対応）
 async def execute_db_operation(query: str, params: Optional[Tuple[Any, ...]] = None, is_read: bool = False):
@@ -19,26 +26,26 @@ async def execute_db_operation(query: str, params: Optional[Tuple[Any, ...]] = N
             database=os.getenv("DB_NAME"),
             port=int(os.getenv("DB_PORT", 3306))
         )
-        cursor = conn.cursor()
+        cursor = InstrumentedCursor(conn.cursor())
         
-        await asyncio.to_thread(cursor.execute, query, params)
+        await tracing.to_thread(cursor.execute, query, params)
         
         if is_read:
-            result = await asyncio.to_thread(cursor.fetchall)
+            result = await tracing.to_thread(cursor.fetchall)
             return result
         else:
-            await asyncio.to_thread(conn.commit)
+            await tracing.to_thread(conn.commit)
             return None
     except mysql.connector.Error as err:
         print(f"データベースエラー: {err}")
         if conn and conn.is_connected():
-            await asyncio.to_thread(conn.rollback)
+            await tracing.to_thread(conn.rollback)
         raise err
     finally:
         if cursor:
-            await asyncio.to_thread(cursor.close)
+            await tracing.to_thread(cursor.close)
         if conn and conn.is_connected():
-            await asyncio.to_thread(conn.close)
+            await tracing.to_thread(conn.close)
 
 # 絵文字ヘルパー
 def get_emoji_id(emoji_string: str) -> str:
@@ -47,10 +54,31 @@ def get_emoji_id(emoji_string: str) -> str:
         return match.group(1)
     return emoji_string
 
+def _count_panel_rows(cursor, guild_id: int, params: Dict[str, Any]) -> Optional[int]:
+    cursor.execute(
+        "SELECT COUNT(*) FROM role_panels WHERE guild_id = %s AND panel_message_id = %s",
+        (guild_id, params["message_id"])
+    )
+    return cursor.fetchone()[0]
+
+
+def _delete_panel_rows(cursor, guild_id: int, params: Dict[str, Any], last_key: int, limit: int):
+    # 削除した行は次の検索に出てこないので、キーを進めずに LIMIT ずつ消していく。
+    # ORDER BY を付けて、レプリケーションでも消える行が一意に決まるようにする
+    cursor.execute(
+        "DELETE FROM role_panels WHERE guild_id = %s AND panel_message_id = %s ORDER BY emoji LIMIT %s",
+        (guild_id, params["message_id"], limit)
+    )
+    return cursor.rowcount, last_key, cursor.rowcount < limit
+
+
 class RolePanels(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
+    async def cog_load(self):
+        self.bot.job_runner.register("rolepanels.delete", JobKind("ロールパネルの削除", _count_panel_rows, _delete_panel_rows))
+
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         if payload.guild_id is None or payload.member.bot:
@@ -66,15 +94,15 @@ class RolePanels(commands.Cog):
                 guild = self.bot.get_guild(payload.guild_id)
                 if not guild: return
                 role = guild.get_role(role_id)
-                member = guild.get_member(payload.user_id)
-                if role and member:
-                    await member.add_roles(role)
+                # リアクション追加イベントにはメンバーが付いてくるのでキャッシュは不要
+                if role:
+                    await payload.member.add_roles(role)
         except Exception as e:
             print(f"リアクション追加時のエラー: {e}")
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
-        if payload.guild_id is None or self.bot.get_user(payload.user_id).bot:
+        if payload.guild_id is None or payload.user_id == self.bot.user.id:
             return
 
         emoji_id = str(payload.emoji.id) if payload.emoji.id else payload.emoji.name
@@ -87,8 +115,9 @@ class RolePanels(commands.Cog):
                 guild = self.bot.get_guild(payload.guild_id)
                 if not guild: return
                 role = guild.get_role(role_id)
-                member = guild.get_member(payload.user_id)
-                if role and member:
+                # 削除イベントにはメンバーが付かないので、パネルへの反応のときだけ取得する
+                member = await resolve_member(guild, payload.user_id) if role else None
+                if role and member and not member.bot:
                     await member.remove_roles(role)
         except Exception as e:
             print(f"リアクション削除時のエラー: {e}")
@@ -165,21 +194,22 @@ class RolePanels(commands.Cog):
 
         try:
             message_id = int(message_id)
-            
-            # DBからパネル情報を削除
-            query = "DELETE FROM role_panels WHERE panel_message_id = %s"
-            await execute_db_operation(query, (message_id,))
-            
+
             # Discord上のメッセージを削除
             panel_message = await interaction.channel.fetch_message(message_id)
             await panel_message.delete()
-            
-            await interaction.followup.send("パネルを正常に削除しました。", ephemeral=True)
-        
+        except ValueError:
+            await interaction.followup.send("メッセージIDは数字で指定してください。", ephemeral=True)
+            return
         except discord.NotFound:
-            await interaction.followup.send("指定されたパネルメッセージが見つかりません。", ephemeral=True)
+            # メッセージが既に消されていても、DBに残った記録は片付ける
+            pass
         except Exception as e:
             await interaction.followup.send(f"エラーが発生しました: {e}", ephemeral=True)
+            return
+
+        # DBからパネル情報を削除（ジョブとして裏で進め、進捗はこの応答を編集して知らせる）
+        await self.bot.job_runner.submit(interaction, "rolepanels.delete", {"message_id": message_id})
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(RolePanels(bot))
@@ -0,0 +1,114 @@
+import discord
+from discord.ext import commands
+from discord import app_commands
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from utils.db import execute_db_operation
+from utils.member_stats import ROLLUP_TABLES
+
+# ロールアップテーブルは Welcome / Leave の cog_load で作成される
+COG_MANIFEST = {
+    "requires": ["cogs.welcome", "cogs.leave"],
+}
+
+# 期間 -> (遡る長さ, 参照するロールアップの粒度, 表示単位)
+PERIODS = {
+    "24h": (timedelta(hours=24), "hour", "hour"),
+    "7d": (timedelta(days=7), "day", "day"),
+    "30d": (timedelta(days=30), "day", "day"),
+    "365d": (timedelta(days=365), "day", "month"),
+}
+
+LABEL_FORMATS = {
+    "hour": "%m/%d %H時",
+    "day": "%m/%d",
+    "month": "%Y/%m",
+}
+
+class ServerStats(commands.Cog):
+    """参加・退出ロールアップからサーバーの成長を表示するCog"""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    # -----------------------------
+    # 内部: 表示単位ごとにまとめる
+    # -----------------------------
+    @staticmethod
+    def _group_rows(rows, unit: str) -> List[Tuple[datetime, int, int, int]]:
+        grouped: List[list] = []
+        for bucket_start, joins, leaves, member_count in rows:
+            key = bucket_start.replace(day=1) if unit == "month" else bucket_start
+            if grouped and grouped[-1][0] == key:
+                entry = grouped[-1]
+                entry[1] += joins
+                entry[2] += leaves
+                if member_count is not None:
+                    entry[3] = member_count
+            else:
+                grouped.append([key, joins, leaves, member_count])
+        return [tuple(entry) for entry in grouped]
+
+    # -----------------------------
+    # /serverstats（スラッシュ）
+    # -----------------------------
+    @app_commands.command(name="serverstats", description="サーバーの参加・退出の推移を表示します")
+    @app_commands.describe(period="集計期間")
+    @app_commands.choices(
+        period=[
+            app_commands.Choice(name="24時間", value="24h"),
+            app_commands.Choice(name="7日間", value="7d"),
+            app_commands.Choice(name="30日間", value="30d"),
+            app_commands.Choice(name="1年間", value="365d"),
+        ]
+    )
+    async def serverstats(self, interaction: discord.Interaction, period: str = "7d"):
+        await interaction.response.defer()
+
+        span, granularity, unit = PERIODS[period]
+        since = datetime.now() - span
+        table = ROLLUP_TABLES[granularity]
+        rows = await execute_db_operation(
+            f"SELECT bucket_start, joins, leaves, member_count FROM {table} "
+            "WHERE guild_id = %s AND bucket_start >= %s ORDER BY bucket_start",
+            (interaction.guild.id, since.replace(minute=0, second=0, microsecond=0)),
+            is_read=True
+        )
+
+        embed = discord.Embed(title=f"📈 {interaction.guild.name} の成長", color=discord.Color.green())
+        if not rows:
+            embed.description = "この期間の参加・退出記録はありません。"
+            await interaction.followup.send(embed=embed)
+            return
+
+        grouped = self._group_rows(rows, unit)
+        total_joins = sum(row[1] for row in grouped)
+        total_leaves = sum(row[2] for row in grouped)
+
+        # 期間開始時点のメンバー数は、最初のバケット末の値からそのバケットの増減を戻して求める
+        first = grouped[0]
+        start_count = first[3] - (first[1] - first[2]) if first[3] is not None else None
+        end_count = next((row[3] for row in reversed(grouped) if row[3] is not None), None)
+
+        embed.add_field(name="参加", value=f"{total_joins}", inline=True)
+        embed.add_field(name="退出", value=f"{total_leaves}", inline=True)
+        embed.add_field(name="純増", value=f"{total_joins - total_leaves:+d}", inline=True)
+        if start_count is not None and end_count is not None:
+            embed.add_field(name="メンバー数", value=f"{start_count} → {end_count}", inline=False)
+
+        label_format = LABEL_FORMATS[unit]
+        lines = []
+        for start, joins, leaves, member_count in grouped:
+            count = f"{member_count}" if member_count is not None else "-"
+            lines.append(f"{start.strftime(label_format):<11} +{joins:<5} -{leaves:<5} {joins - leaves:+6d} {count:>7}")
+
+        # 埋め込みの上限を超える場合は新しい方を残す
+        while sum(len(line) + 1 for line in lines) > 3900:
+            lines.pop(0)
+        embed.description = "```\n" + "\n".join(lines) + "\n```"
+        embed.set_footer(text=f"要求者: {interaction.user.display_name}")
+
+        await interaction.followup.send(embed=embed)
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(ServerStats(bot))
@@ -3,8 +3,13 @@ from discord.ext import commands
 from discord import app_commands
 import mysql.connector
 import os
-import asyncio
 from typing import Optional, List, Dict, Tuple, Any
+from utils import tracing
+from utils.metrics import InstrumentedCursor
+
+COG_MANIFEST = {
+    "events": ["on_voice_state_update"],
+}
 
 # DBヘルパーメソッド（非同期対応）
 async def execute_db_operation(query: str, params: Optional[Tuple[Any, ...]] = None, is_read: bool = False):
@@ -18,26 +23,26 @@ async def execute_db_operation(query: str, params: Optional[Tuple[Any, ...]] = N
             database=os.getenv("DB_NAME"),
             port=int(os.getenv("DB_PORT", 3306))
         )
-        cursor = conn.cursor()
+        cursor = InstrumentedCursor(conn.cursor())
         
-        await asyncio.to_thread(cursor.execute, query, params)
+        await tracing.to_thread(cursor.execute, query, params)
         
         if is_read:
-            result = await asyncio.to_thread(cursor.fetchall)
+            result = await tracing.to_thread(cursor.fetchall)
             return result
         else:
-            await asyncio.to_thread(conn.commit)
+            await tracing.to_thread(conn.commit)
             return None
     except mysql.connector.Error as err:
         print(f"データベースエラー: {err}")
         if conn and conn.is_connected():
-            await asyncio.to_thread(conn.rollback)
+            await tracing.to_thread(conn.rollback)
         raise err
     finally:
         if cursor:
-            await asyncio.to_thread(cursor.close)
+            await tracing.to_thread(cursor.close)
         if conn and conn.is_connected():
-            await asyncio.to_thread(conn.close)
+            await tracing.to_thread(conn.close)
 
 class TempVoice(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -2,50 +2,150 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
+import asyncio
+import os
+import re
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+from utils.db import execute_db_operation
+from utils.transcript import ATTACHMENT_MAX_BYTES, ATTACHMENT_TOTAL_BYTES, export_channel
 
-# --- チケット作成ボタン用View ---
-class TicketView(discord.ui.View):
-    def __init__(self, role: discord.Role = None, title: str = "サポートチケット"):
-        super().__init__(timeout=None)  # 永続化
-        self.role = role
-        self.title = title
+# トランスクリプトに本文を残すには message_content インテントが必要（特権インテントなので
+# Cog からは宣言しない。EXTRA_INTENTS=message_content で有効にする。無いと本文は空になる）
+COG_MANIFEST = {
+    "events": ["on_guild_channel_delete"],
+}
 
-    @discord.ui.button(label="🎫 チケットを作成", style=discord.ButtonStyle.green, custom_id="create_ticket_button")
-    async def create_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
-        guild = interaction.guild
-        user = interaction.user
+DEFAULT_TITLE = "サポートチケット"
+# custom_id は100文字まで: "ticket:create:<role_id>:" の残りがタイトルに使える
+CUSTOM_ID_PREFIX = "ticket:create"
+MAX_TITLE_LENGTH = 100 - len(CUSTOM_ID_PREFIX) - 22
+
+TICKET_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'open',
+    created_at DATETIME NOT NULL,
+    closed_at DATETIME NULL,
+    INDEX idx_tickets_status (status),
+    INDEX idx_tickets_channel (channel_id),
+    INDEX idx_tickets_owner (guild_id, user_id, status)
+)
+"""
+
+
+TICKET_SETTINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ticket_settings (
+    guild_id BIGINT PRIMARY KEY,
+    log_channel_id BIGINT NULL,
+    html_transcript TINYINT(1) NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL
+)
+"""
+
+# トランスクリプトの一時保存先（アップロードできなかったものはここに残る）
+TRANSCRIPT_DIR = os.getenv("TICKET_TRANSCRIPT_DIR", "transcripts")
+
+
+class TicketSettings(NamedTuple):
+    log_channel_id: Optional[int]
+    html_transcript: bool
+
+
+# --- 開いているチケットの索引 ---
+class TicketRegistry:
+    """開いているチケットを DB に記録し、(サーバー, ユーザー) -> チャンネルをメモリに持つ
+
+    1ユーザー1チケットの判定は辞書の参照だけで済む。チャンネル作成中のユーザーは
+    pending に入れておき、ボタンの連打で2つ作られないようにする。
+    """
+
+    def __init__(self):
+        self.open: Dict[Tuple[int, int], int] = {}
+        self.owners: Dict[int, Tuple[int, int]] = {}
+        self._pending: Set[Tuple[int, int]] = set()
 
-        # 権限設定
-        overwrites = {
-            guild.default_role: discord.PermissionOverwrite(view_channel=False),
-            user: discord.PermissionOverwrite(view_channel=True, send_messages=True, attach_files=True),
-            guild.me: discord.PermissionOverwrite(view_channel=True, send_messages=True, manage_channels=True)
-        }
-
-        # サポートロールが指定されている場合
-        if self.role:
-            overwrites[self.role] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
-
-        # チャンネル作成
-        ticket_channel = await guild.create_text_channel(
-            name=f"{self.title}-{user.name}",
-            overwrites=overwrites,
-            category=None  # 必要ならカテゴリIDを指定
+    async def load(self):
+        await execute_db_operation(TICKET_SCHEMA)
+        rows = await execute_db_operation(
+            "SELECT guild_id, user_id, channel_id FROM tickets WHERE status='open'", is_read=True
         )
+        for guild_id, user_id, channel_id in rows:
+            self._index(guild_id, user_id, channel_id)
 
-        # role にメンションを付与してメッセージ送信
-        mention_text = self.role.mention if self.role else ""
-        await ticket_channel.send(
-            content=f"{user.mention} さんのチケットが作成されました！ {mention_text}\n管理者が対応するまでお待ちください。",
-            view=CloseTicketView()
+    def _index(self, guild_id: int, user_id: int, channel_id: int):
+        self.open[(guild_id, user_id)] = channel_id
+        self.owners[channel_id] = (guild_id, user_id)
+
+    def channel_of(self, guild_id: int, user_id: int) -> Optional[int]:
+        return self.open.get((guild_id, user_id))
+
+    def owner_of(self, channel_id: int) -> Optional[Tuple[int, int]]:
+        return self.owners.get(channel_id)
+
+    def reserve(self, guild_id: int, user_id: int) -> bool:
+        key = (guild_id, user_id)
+        if key in self.open or key in self._pending:
+            return False
+        self._pending.add(key)
+        return True
+
+    def release(self, guild_id: int, user_id: int):
+        self._pending.discard((guild_id, user_id))
+
+    async def register(self, guild_id: int, user_id: int, channel_id: int):
+        await execute_db_operation(
+            "INSERT INTO tickets (guild_id, user_id, channel_id, status, created_at) VALUES (%s, %s, %s, 'open', %s)",
+            (guild_id, user_id, channel_id, datetime.now())
         )
+        self._index(guild_id, user_id, channel_id)
 
-        # ユーザーへの返信（ephemeral）
-        await interaction.response.send_message(
-            f"✅ チケットを作成しました: {ticket_channel.mention}",
-            ephemeral=True
+    async def close(self, channel_id: int):
+        owner = self.owners.pop(channel_id, None)
+        if owner is None:
+            return
+        self.open.pop(owner, None)
+        await execute_db_operation(
+            "UPDATE tickets SET status='closed', closed_at=%s WHERE channel_id=%s AND status='open'",
+            (datetime.now(), channel_id)
         )
 
+
+# --- チケット作成ボタン（設定を custom_id に持つので再起動後もそのまま動く） ---
+class CreateTicketButton(discord.ui.DynamicItem[discord.ui.Button], template=r"ticket:create:(?P<role_id>\d+):(?P<title>.*)"):
+    def __init__(self, role_id: int, title: str):
+        super().__init__(
+            discord.ui.Button(
+                label="🎫 チケットを作成",
+                style=discord.ButtonStyle.green,
+                custom_id=f"{CUSTOM_ID_PREFIX}:{role_id}:{title[:MAX_TITLE_LENGTH]}"
+            )
+        )
+        self.role_id = role_id
+        self.title = title
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str]):
+        return cls(int(match["role_id"]), match["title"])
+
+    async def callback(self, interaction: discord.Interaction):
+        cog: TicketCog = interaction.client.get_cog("TicketCog")
+        await cog.open_ticket(interaction, self.role_id, self.title)
+
+
+# --- 旧パネル用View（custom_id 固定。設定は保持できないので既定値で作成する） ---
+class TicketView(discord.ui.View):
+    def __init__(self):
+        super().__init__(timeout=None)  # 永続化
+
+    @discord.ui.button(label="🎫 チケットを作成", style=discord.ButtonStyle.green, custom_id="create_ticket_button")
+    async def create_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
+        cog: TicketCog = interaction.client.get_cog("TicketCog")
+        await cog.open_ticket(interaction, 0, DEFAULT_TITLE)
+
 # --- チケット閉鎖ボタン用View ---
 class CloseTicketView(discord.ui.View):
     def __init__(self):
@@ -53,24 +153,197 @@ class CloseTicketView(discord.ui.View):
 
     @discord.ui.button(label="🔒 チケットを閉じる", style=discord.ButtonStyle.red, custom_id="close_ticket_button")
     async def close_ticket(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await interaction.response.send_message("⏳ チケットを削除します...", ephemeral=True)
-        await interaction.channel.delete()
+        cog: TicketCog = interaction.client.get_cog("TicketCog")
+        await cog.close_ticket(interaction)
 
 # --- Cog ---
 class TicketCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.registry = TicketRegistry()
+        # サーバーID -> トランスクリプトの送信先
+        self.settings: Dict[int, TicketSettings] = {}
+        # 閉鎖処理中のチャンネル（ボタンの連打対策）
+        self._closing: Set[int] = set()
         # 永続View登録
         self.bot.add_view(TicketView())
         self.bot.add_view(CloseTicketView())
 
+    async def cog_load(self):
+        if not self.bot.intents.message_content:
+            print("⚠️ message_content インテントが無効のため、チケットのトランスクリプトに本文が残りません"
+                  "（EXTRA_INTENTS=message_content で有効にできます）")
+        await self.registry.load()
+        await execute_db_operation(TICKET_SETTINGS_SCHEMA)
+        rows = await execute_db_operation(
+            "SELECT guild_id, log_channel_id, html_transcript FROM ticket_settings", is_read=True
+        )
+        for guild_id, log_channel_id, html_transcript in rows:
+            self.settings[guild_id] = TicketSettings(log_channel_id, bool(html_transcript))
+        self.bot.add_dynamic_items(CreateTicketButton)
+
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(CreateTicketButton)
+
+    # -----------------------------
+    # 作成・閉鎖
+    # -----------------------------
+    async def open_ticket(self, interaction: discord.Interaction, role_id: int, title: str):
+        guild = interaction.guild
+        user = interaction.user
+
+        # 1ユーザー1チケット（チャンネルが手動で消されていたら閉じた扱いにする）
+        channel_id = self.registry.channel_of(guild.id, user.id)
+        if channel_id is not None:
+            existing = guild.get_channel(channel_id)
+            if existing:
+                await interaction.response.send_message(f"⚠️ すでにチケットがあります: {existing.mention}", ephemeral=True)
+                return
+            await self.registry.close(channel_id)
+
+        if not self.registry.reserve(guild.id, user.id):
+            await interaction.response.send_message("⏳ チケットを作成中です。しばらくお待ちください。", ephemeral=True)
+            return
+
+        try:
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            role = guild.get_role(role_id) if role_id else None
+
+            # 権限設定
+            overwrites = {
+                guild.default_role: discord.PermissionOverwrite(view_channel=False),
+                user: discord.PermissionOverwrite(view_channel=True, send_messages=True, attach_files=True),
+                guild.me: discord.PermissionOverwrite(
+                    view_channel=True, send_messages=True, manage_channels=True, read_message_history=True
+                )
+            }
+
+            # サポートロールが指定されている場合
+            if role:
+                overwrites[role] = discord.PermissionOverwrite(view_channel=True, send_messages=True)
+
+            # チャンネル作成
+            ticket_channel = await guild.create_text_channel(
+                name=f"{title}-{user.name}",
+                overwrites=overwrites,
+                category=None  # 必要ならカテゴリIDを指定
+            )
+            try:
+                await self.registry.register(guild.id, user.id, ticket_channel.id)
+            except Exception:
+                # 記録できないチケットは重複判定から漏れるので作らない
+                await ticket_channel.delete()
+                raise
+        except Exception as e:
+            print(f"チケット作成エラー: {e}")
+            await interaction.followup.send("❌ チケットを作成できませんでした。", ephemeral=True)
+            return
+        finally:
+            self.registry.release(guild.id, user.id)
+
+        # role にメンションを付与してメッセージ送信
+        mention_text = role.mention if role else ""
+        await ticket_channel.send(
+            content=f"{user.mention} さんのチケットが作成されました！ {mention_text}\n管理者が対応するまでお待ちください。",
+            view=CloseTicketView()
+        )
+
+        # ユーザーへの返信（ephemeral）
+        await interaction.followup.send(f"✅ チケットを作成しました: {ticket_channel.mention}", ephemeral=True)
+
+    async def close_ticket(self, interaction: discord.Interaction):
+        channel = interaction.channel
+        if channel.id in self._closing:
+            await interaction.response.send_message("⏳ すでに閉鎖処理中です。", ephemeral=True)
+            return
+        self._closing.add(channel.id)
+        try:
+            settings = self.settings.get(interaction.guild.id)
+            log_channel = interaction.guild.get_channel(settings.log_channel_id) if settings and settings.log_channel_id else None
+            if log_channel:
+                await interaction.response.send_message("⏳ トランスクリプトを保存してからチケットを削除します...", ephemeral=True)
+                try:
+                    await self._archive(channel, log_channel, settings, interaction.user)
+                except Exception as e:
+                    # 履歴を失わないよう、保存できなければ削除しない
+                    print(f"トランスクリプト保存エラー: {e}")
+                    await interaction.followup.send("❌ トランスクリプトを保存できなかったため、削除を中止しました。", ephemeral=True)
+                    return
+            else:
+                await interaction.response.send_message("⏳ チケットを削除します...", ephemeral=True)
+            await self.registry.close(channel.id)
+            await channel.delete()
+        finally:
+            self._closing.discard(channel.id)
+
+    async def _archive(self, channel: discord.TextChannel, log_channel: discord.abc.Messageable,
+                       settings: TicketSettings, closed_by: discord.abc.User):
+        """履歴をファイルに書き出してログチャンネルへ送る（送れたらローカルの分は消す）"""
+        files = await export_channel(channel, TRANSCRIPT_DIR, with_html=settings.html_transcript)
+        paths = [path for path in (files.jsonl_path, files.html_path) if path]
+        zip_too_large = False
+
+        owner = self.registry.owner_of(channel.id)
+        embed = discord.Embed(title="🗂️ チケットのトランスクリプト", color=discord.Color.greyple(), timestamp=datetime.now())
+        embed.add_field(name="チャンネル", value=f"#{channel.name}", inline=True)
+        embed.add_field(name="作成者", value=f"<@{owner[1]}>" if owner else "不明", inline=True)
+        embed.add_field(name="閉鎖者", value=closed_by.mention, inline=True)
+        embed.add_field(name="メッセージ数", value=f"{files.messages:,}（添付 {files.attachments:,}）", inline=True)
+        if files.attachments:
+            embed.add_field(
+                name="添付ファイル",
+                value=f"{files.saved_attachments:,} 件を zip に保存しました。"
+                      + ("残りは Discord の期限付き URL のみのため、しばらくすると開けなくなります。"
+                         if files.saved_attachments < files.attachments else ""),
+                inline=False
+            )
+
+        sizes = await asyncio.to_thread(lambda: sum(os.path.getsize(path) for path in paths))
+        if files.attachments_path:
+            zip_size = await asyncio.to_thread(os.path.getsize, files.attachments_path)
+            if sizes + zip_size <= channel.guild.filesize_limit:
+                paths.append(files.attachments_path)
+            else:
+                # トランスクリプトだけでも送れるよう、zip は Bot のサーバーに残す
+                zip_too_large = True
+        if sizes > channel.guild.filesize_limit:
+            embed.add_field(
+                name="ファイル",
+                value=f"サイズ上限を超えたため Bot のサーバーに保存しました: `{os.path.basename(files.jsonl_path)}`",
+                inline=False
+            )
+            await log_channel.send(embed=embed)
+            return
+        if zip_too_large:
+            embed.add_field(
+                name="添付ファイルの zip",
+                value=f"サイズ上限を超えたため Bot のサーバーに保存しました: `{os.path.basename(files.attachments_path)}`",
+                inline=False
+            )
+
+        # discord.File はパスから読みながら送信するので、全体をメモリに載せない
+        await log_channel.send(embed=embed, files=[discord.File(path) for path in paths])
+        await asyncio.to_thread(lambda: [os.remove(path) for path in paths])
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        # 手動で削除されたチケットも閉じた扱いにする
+        if self.registry.owner_of(channel.id):
+            await self.registry.close(channel.id)
+
+    # -----------------------------
+    # /ticketpanel
+    # -----------------------------
     @app_commands.command(name="ticketpanel", description="チケット作成パネルを設置します（管理者専用）")
     @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(title=f"チケットチャンネル名の先頭（{MAX_TITLE_LENGTH}文字まで）")
     async def ticket_panel(
-        self, interaction: discord.Interaction, role: discord.Role = None, title: str = "サポートチケット"
+        self, interaction: discord.Interaction, role: discord.Role = None,
+        title: app_commands.Range[str, 1, MAX_TITLE_LENGTH] = DEFAULT_TITLE
     ):
         """管理者がチケットパネルを設置する"""
-        view = TicketView(role=role, title=title)
+        view = discord.ui.View(timeout=None)
+        view.add_item(CreateTicketButton(role.id if role else 0, title))
         embed = discord.Embed(
             title="🎫 サポートチケット",
             description="下のボタンを押すとチケットが作成されます。",
@@ -79,6 +352,33 @@ class TicketCog(commands.Cog):
         await interaction.channel.send(embed=embed, view=view)
         await interaction.response.send_message("✅ チケットパネルを設置しました。", ephemeral=True)
 
+    # -----------------------------
+    # /ticketlog（トランスクリプトの送信先）
+    # -----------------------------
+    @app_commands.command(name="ticketlog", description="チケットを閉じたときのトランスクリプト送信先を設定します（管理者専用）")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(channel="送信先（省略するとトランスクリプトを保存しない）", html="HTML 版も添付する")
+    async def ticket_log(self, interaction: discord.Interaction, channel: Optional[discord.TextChannel] = None, html: bool = False):
+        await execute_db_operation(
+            """
+            INSERT INTO ticket_settings (guild_id, log_channel_id, html_transcript, updated_at)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE log_channel_id=VALUES(log_channel_id),
+                html_transcript=VALUES(html_transcript), updated_at=VALUES(updated_at)
+            """,
+            (interaction.guild.id, channel.id if channel else None, int(html), datetime.now())
+        )
+        self.settings[interaction.guild.id] = TicketSettings(channel.id if channel else None, html)
+        if channel:
+            await interaction.response.send_message(
+                f"✅ トランスクリプトを {channel.mention} に送信します。\n"
+                f"添付ファイルは {ATTACHMENT_MAX_BYTES // 2**20}MB 以下のものを合計 {ATTACHMENT_TOTAL_BYTES // 2**20}MB まで zip に保存します。"
+                "それ以外は Discord の期限付き URL だけが残るため、後から開けなくなることがあります。",
+                ephemeral=True
+            )
+        else:
+            await interaction.response.send_message("✅ トランスクリプトの送信を無効にしました。", ephemeral=True)
+
 # --- setup ---
 async def setup(bot: commands.Bot):
     await bot.add_cog(TicketCog(bot))
@@ -2,6 +2,11 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 
+# channel.members を使うため VC の状態を受け取る
+COG_MANIFEST = {
+    "intents": ["voice_states"],
+}
+
 class VcMove(commands.Cog):
     """VCにいるメンバーを一括移動するコグ"""
 
@@ -1,54 +1,95 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import mysql.connector
-import os
+import asyncio
 from datetime import datetime
+from typing import Dict, NamedTuple, Optional
+from utils import db
+from utils.log_sink import BatchLogSink
+from utils.member_stats import MemberStatsRollup, ensure_schema
+from utils.message_template import MessageTemplate
+from utils.metrics import InstrumentedCursor
+
+# Gateway intents はロードする Cog の宣言から決まる（utils/intents.py）
+COG_MANIFEST = {
+    "events": ["on_member_join"],
+}
+
+# Welcomeメッセージで使えるプレースホルダ
+WELCOME_PLACEHOLDERS = ("member", "guild_name", "count", "stuff")
+
+class WelcomeSettings(NamedTuple):
+    channel_id: int
+    role_id: Optional[int]
+    template: MessageTemplate
 
 class Welcome(commands.Cog):
     """高度なWelcomeメッセージ管理Cog"""
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.conn = mysql.connector.connect(
-            host=os.getenv("DB_HOST"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            database=os.getenv("DB_NAME"),
-            port=int(os.getenv("DB_PORT", 3306))
+        # 接続は cog_load で非同期に行う
+        self.conn = None
+        self.cursor = None
+        # guild_id -> 有効な設定（設定のないギルドは登録しない）
+        self.settings: Dict[int, WelcomeSettings] = {}
+        # 参加ログは1秒ごとにまとめて書き込み、同時にロールアップを更新する
+        self.log_sink = BatchLogSink(
+            "INSERT INTO welcome_logs (guild_id, member_id, joined_at, member_count) VALUES (%s, %s, %s, %s)",
+            on_flush=MemberStatsRollup("join")
+        )
+
+    async def cog_load(self):
+        self.conn = await asyncio.to_thread(db.connect)
+        self.cursor = InstrumentedCursor(self.conn.cursor())
+        await asyncio.to_thread(self._load_settings)
+        self.log_sink.start()
+
+    async def cog_unload(self):
+        # 未書き込みの参加ログを書き出してから終了
+        await self.log_sink.close()
+        if self.conn:
+            await asyncio.to_thread(self.conn.close)
+
+    def _load_settings(self):
+        ensure_schema(self.cursor)
+        # 有効な設定を起動時に一括で読み込み、参加イベントではDBを読まない
+        self.cursor.execute(
+            "SELECT guild_id, channel_id, message, role_id FROM welcome_settings WHERE deleted_at IS NULL"
+        )
+        for guild_id, channel_id, message, role_id in self.cursor.fetchall():
+            self._cache_settings(guild_id, channel_id, message, role_id)
+
+    # -----------------------------
+    # 内部: 設定キャッシュ
+    # -----------------------------
+    def _cache_settings(self, guild_id: int, channel_id: int, message: str, role_id: Optional[int]):
+        self.settings[guild_id] = WelcomeSettings(
+            channel_id, role_id, MessageTemplate(message or "", WELCOME_PLACEHOLDERS)
         )
-        self.cursor = self.conn.cursor()
 
     # メンバー参加時
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        self.cursor.execute(
-            "SELECT channel_id, message, role_id FROM welcome_settings WHERE guild_id=%s AND deleted_at IS NULL",
-            (member.guild.id,)
+        # DBに参加ログを記録（バッチ書き込み）。メッセージの設定や送信の成否に関係なく残す
+        await self.log_sink.put(
+            (member.guild.id, member.id, datetime.now(), member.guild.member_count)
         )
-        result = self.cursor.fetchone()
-        if result:
-            channel_id, message, role_id = result
-            channel = member.guild.get_channel(channel_id)
-            role = member.guild.get_role(role_id) if role_id else None
+
+        settings = self.settings.get(member.guild.id)
+        if settings:
+            channel = member.guild.get_channel(settings.channel_id)
+            role = member.guild.get_role(settings.role_id) if settings.role_id else None
             if channel:
                 # プレースホルダ置換
-                msg = message.replace("{member}", member.mention)
-                msg = msg.replace("{guild_name}", member.guild.name)
-                msg = msg.replace("{count}", str(member.guild.member_count))
-                if role:
-                    msg = msg.replace("{stuff}", role.mention)
-                else:
-                    msg = msg.replace("{stuff}", "")
+                msg = settings.template.render({
+                    "member": member.mention,
+                    "guild_name": member.guild.name,
+                    "count": str(member.guild.member_count),
+                    "stuff": role.mention if role else "",
+                })
                 await channel.send(msg)
 
-                # DBに参加ログを記録
-                self.cursor.execute(
-                    "INSERT INTO welcome_logs (guild_id, member_id, joined_at, member_count) VALUES (%s, %s, %s, %s)",
-                    (member.guild.id, member.id, datetime.now(), member.guild.member_count)
-                )
-                self.conn.commit()
-
     # Welcome登録
     @app_commands.command(name="setwelcome", description="Welcomeメッセージを設定")
     @app_commands.describe(channel="メッセージを送るチャンネル", message="Welcomeメッセージ", role="任意のロール")
@@ -68,6 +109,7 @@ class Welcome(commands.Cog):
             (interaction.guild.id, channel.id, message, role_id, datetime.now())
         )
         self.conn.commit()
+        self._cache_settings(interaction.guild.id, channel.id, message, role_id)
 
         await interaction.response.send_message(f"{channel.mention} に Welcomeメッセージを設定しました。", ephemeral=True)
 
@@ -80,6 +122,7 @@ class Welcome(commands.Cog):
             (datetime.now(), interaction.guild.id)
         )
         self.conn.commit()
+        self.settings.pop(interaction.guild.id, None)
         await interaction.response.send_message("Welcomeメッセージを削除しました。", ephemeral=True)
 
 # CogをBotに追加するsetup関数
@@ -1,15 +1,23 @@
 import discord
 from discord.ext import commands, tasks
-import traceback
 import os
 import asyncio
 from dotenv import load_dotenv
-import requests
-import datetime
 import signal
 import sys
+from utils import command_sync, tracing
+from utils.cluster import ClusterLauncher, fetch_gateway_info, shard_config_from_env
+from utils.cog_loader import CogLoader, read_manifest
+from utils.intents import extra_intents_from_env, format_reasons, resolve_intents
+from utils.instrumentation import InstrumentedCommandTree, instrument_listener, record_command
+from utils.jobs import JobRunner
+from utils.loop_monitor import LoopMonitor
+from utils.members import member_cache_flags_from_env
+from utils.status_reporter import StatusReporter
+from utils.user_resolver import UserResolver
 
 FASTAPI_URL = "http://127.0.0.1:8000/api/bot_status"
+METRICS_URL = "http://127.0.0.1:8000/api/bot_metrics"
 load_dotenv()
 TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 
@@ -20,6 +28,7 @@ DiscordBot_Cogs = [
     'cogs.leave',
     'cogs.level',
     'cogs.membermod',
+    'cogs.antispam',
     'cogs.info',
     'cogs.dice',
     'cogs.userinfo',
@@ -28,61 +37,129 @@ DiscordBot_Cogs = [
     'cogs.pins',
     'cogs.rolepanels',
     'cogs.tempvoice',
-    'cogs.economy'
+    'cogs.economy',
+    'cogs.serverstats',
+    'cogs.activity',
+    'cogs.retention',
+    'cogs.diagnostics'
 ]
 
-def send_bot_status(running=True):
-    """Bot の稼働状況を FastAPI に送信"""
-    data = {
-        "name": BOT_NAME,
-        "running": running,
-        "timestamp": datetime.datetime.now().isoformat()
-    }
-    try:
-        requests.post(FASTAPI_URL, json=data, timeout=3)
-    except Exception:
-        pass
-
-class MyBot(commands.Bot):
-    def __init__(self, command_prefix):
-        intents = discord.Intents.default()
-        intents.members = True
-        super().__init__(command_prefix=command_prefix, intents=intents)
+class MyBot(commands.AutoShardedBot):
+    def __init__(self, command_prefix, shard_config):
+        # ロードする Cog の COG_MANIFEST から必要最小限の intents を決める
+        manifests = {name: read_manifest(name) for name in DiscordBot_Cogs}
+        intents, reasons = resolve_intents(manifests, extra_intents_from_env())
+        print(format_reasons(reasons))
+        member_cache_flags = member_cache_flags_from_env()
+        # キャッシュ方針が依存する intent が無ければ、その分はキャッシュしない
+        member_cache_flags.voice = member_cache_flags.voice and intents.voice_states
+        member_cache_flags.joined = member_cache_flags.joined and intents.members
+        # リスナー -> 計測用ラッパー（remove_listener で元の関数から引けるように）
+        self._instrumented_listeners = {}
+        # このプロセスが担当するシャード（クラスタ起動時はランチャーが環境変数で渡す）
+        self.shard_config = shard_config
+        super().__init__(
+            command_prefix=command_prefix,
+            intents=intents,
+            tree_cls=InstrumentedCommandTree,
+            # メンバーは必要な分だけ保持し、起動時のチャンク取得もしない（不足分は utils.members で都度取得）
+            member_cache_flags=member_cache_flags,
+            chunk_guilds_at_startup=False,
+            shard_count=shard_config.shard_count,
+            shard_ids=shard_config.shard_ids
+        )
+        # Bot の稼働状況を FastAPI に送信（非同期・バックオフ付き）
+        self.status_reporter = StatusReporter(self, FASTAPI_URL, BOT_NAME, metrics_url=METRICS_URL)
+        self.cog_loader = CogLoader(self, DiscordBot_Cogs, manifests)
+        # ランキングやピン留めの表示名を引く共有リゾルバ（LRU・まとめて取得）
+        self.user_resolver = UserResolver(self)
+        # XPリセットなどの一括操作をチャンクに分けて裏で進めるジョブ実行器
+        self.job_runner = JobRunner.from_env(self)
+        # イベントループの遅延監視（閾値を超えてブロックしたらスタックを出力）
+        self.loop_monitor = LoopMonitor(threshold=float(os.getenv("LOOP_STALL_THRESHOLD", 0.5)))
+        # Discord REST 呼び出しをトレースの子スパンとして記録
+        tracing.instrument_http(self.http)
         self.heartbeat_task = self.heartbeat_loop.start()  # 心拍ループ開始
 
     async def setup_hook(self):
-        # Cogs をロード
-        for cog in DiscordBot_Cogs:
-            try:
-                await self.load_extension(cog)
-                print(f"✅ {cog} をロードしました")
-            except Exception:
-                traceback.print_exc()
+        tracing.tracer.start()
+        self.loop_monitor.start()
+        await self.status_reporter.start()
+
+        # Cogs をロード（依存関係の順に、独立したものは並行して）
+        try:
+            await self.cog_loader.load_all()
+        except ValueError as e:
+            print(f"❌ Cog のロード順を決められません: {e}")
+        print(self.cog_loader.report())
 
-        # スラッシュコマンド同期
+        # Cog がジョブの種類を登録し終えてから、未完了のジョブを再開する
         try:
-            synced = await self.tree.sync()
-            print(f"🌐 スラッシュコマンド同期: {len(synced)} 件")
+            await self.job_runner.start()
         except Exception as e:
-            print(f"❌ スラッシュコマンド同期失敗: {e}")
+            print(f"❌ ジョブの再開に失敗: {e}")
+
+        # スラッシュコマンド同期（前回からツリーが変わったときだけ、クラスタ0のみ）
+        if self.shard_config.is_primary:
+            try:
+                await command_sync.from_env(self).sync()
+            except Exception as e:
+                print(f"❌ スラッシュコマンド同期失敗: {e}")
+
+    async def add_cog(self, cog, /, **kwargs):
+        # import/__init__ と cog_load（非同期の初期化）の時間を分けて記録
+        with self.cog_loader.measure_add_cog():
+            await super().add_cog(cog, **kwargs)
+
+    def add_listener(self, func, /, name=discord.utils.MISSING):
+        # Cog のリスナーをすべて計測付きで登録する
+        event_name = func.__name__ if name is discord.utils.MISSING else name
+        wrapped = instrument_listener(func, event_name)
+        self._instrumented_listeners[(func, event_name)] = wrapped
+        super().add_listener(wrapped, event_name)
+
+    def remove_listener(self, func, /, name=discord.utils.MISSING):
+        event_name = func.__name__ if name is discord.utils.MISSING else name
+        wrapped = self._instrumented_listeners.pop((func, event_name), func)
+        super().remove_listener(wrapped, event_name)
+
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        record_command(interaction, command)
 
     async def on_ready(self):
-        print(f"BOT起動: {self.user}")
-        send_bot_status(True)  # 起動直後に通知
+        print(f"BOT起動: {self.user} (シャード {sorted(self.shards)} / {self.shard_count})")
+        await self.status_reporter.send(True, force=True)  # 起動直後に通知
+
+    async def on_shard_ready(self, shard_id):
+        print(f"シャード {shard_id} 準備完了")
 
     # 非同期で心拍を送るタスク
     @tasks.loop(seconds=5)
     async def heartbeat_loop(self):
-        send_bot_status(True)
+        await self.status_reporter.send(True)
+        # メトリクスは15秒ごと
+        if self.heartbeat_loop.current_loop % 3 == 0:
+            await self.status_reporter.send_metrics()
+
+    async def close(self):
+        await self.job_runner.close()
+        await super().close()
+        await self.status_reporter.close()
+        self.loop_monitor.stop()
+        tracing.tracer.close()
+
+async def shutdown(bot: MyBot):
+    print("Botを停止中...")
+    bot.heartbeat_loop.cancel()
+    await bot.status_reporter.send(False, force=True)  # 停止状態を通知
+    await bot.close()
 
 # 安全終了処理
 def shutdown_handler(bot: MyBot):
-    print("Botを停止中...")
-    send_bot_status(False)  # 停止状態を通知
-    asyncio.create_task(bot.close())
+    asyncio.create_task(shutdown(bot))
 
 async def main():
-    bot = MyBot(command_prefix="/")
+    bot = MyBot(command_prefix="/", shard_config=shard_config_from_env())
 
     # シグナル登録
     loop = asyncio.get_running_loop()
@@ -92,5 +169,18 @@ async def main():
     async with bot:
         await bot.start(TOKEN)
 
+def launch_cluster(clusters: int):
+    """CLUSTER_COUNT 個のプロセスにシャードを分けて起動する"""
+    info = asyncio.run(fetch_gateway_info(TOKEN))
+    shard_count = int(os.getenv("SHARD_COUNT") or info["shards"])
+    max_concurrency = info.get("session_start_limit", {}).get("max_concurrency", 1)
+    launcher = ClusterLauncher(os.path.abspath(__file__), shard_count, clusters, max_concurrency=max_concurrency)
+    sys.exit(launcher.run())
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    clusters = int(os.getenv("CLUSTER_COUNT", 1))
+    # ランチャーから起動された子プロセスは SHARD_IDS を持っている
+    if clusters > 1 and not os.getenv("SHARD_IDS"):
+        launch_cluster(clusters)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,179 @@
+import random
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from utils.metrics import InstrumentedCursor
+from utils.sketches import CountMinSketch, HyperLogLog
+
+ACTIVITY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS activity_buckets (
+    guild_id BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    writer_id BIGINT NOT NULL,
+    messages INT NOT NULL,
+    users_hll VARBINARY(2048) NOT NULL,
+    chatters_cms BLOB NOT NULL,
+    updated_at DATETIME NOT NULL,
+    PRIMARY KEY (guild_id, bucket_start, channel_id, writer_id)
+)
+"""
+
+# メモリに持つバケット（チャンネル × 時間）の上限
+MAX_OPEN_BUCKETS = 2000
+# /activity で遡れる時間の上限
+MAX_QUERY_HOURS = 168
+
+BucketKey = Tuple[int, int, datetime]
+
+
+def bucket_start(at: datetime) -> datetime:
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+class ActivityBucket:
+    """1チャンネル・1時間分の集計。メッセージ数・ユニークユーザー（HLL）・発言数（CMS）"""
+    __slots__ = ("writer_id", "messages", "users", "chatters", "dirty")
+
+    def __init__(self):
+        # このバケットの行を区別する ID。行ごと REPLACE するので、
+        # 別プロセスや再起動後の同じ時間帯の集計は別の行になり、上書きし合わない
+        self.writer_id = random.getrandbits(63)
+        self.messages = 0
+        self.users = HyperLogLog()
+        self.chatters = CountMinSketch()
+        self.dirty = False
+
+    def add(self, user_id: int):
+        self.messages += 1
+        self.users.add(user_id)
+        self.chatters.add(user_id)
+        self.dirty = True
+
+
+class ActivityCollector:
+    """メッセージごとに O(1) でバケットを更新し、変更のあったバケットだけを定期的に書き出す
+
+    メモリはバケット数 × 固定サイズ、書き込みは「前回から更新のあったバケット数」行で、
+    どちらもメッセージの流量には依存しない。
+    """
+
+    def __init__(self, max_buckets: int = MAX_OPEN_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[BucketKey, ActivityBucket]" = OrderedDict()
+        # 上限を超えて追い出したバケット（書き出せたら消す。それまでに発言があれば戻す）
+        self._closed: Dict[BucketKey, ActivityBucket] = {}
+
+    @property
+    def open_buckets(self) -> int:
+        return len(self._buckets)
+
+    def record(self, guild_id: int, channel_id: int, user_id: int, at: datetime):
+        key = (guild_id, channel_id, bucket_start(at))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._closed.pop(key, None) or ActivityBucket()
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_buckets:
+                old_key, old = self._buckets.popitem(last=False)
+                self._closed[old_key] = old
+        else:
+            self._buckets.move_to_end(key)
+        bucket.add(user_id)
+
+    def take_dirty(self) -> List[Tuple[BucketKey, int, int, bytes, bytes]]:
+        """書き出す行を作る。メモリ上の状態は変えない（書けたら mark_written を呼ぶ）"""
+        rows = [self._row(key, bucket) for key, bucket in self._closed.items() if bucket.dirty]
+        rows.extend(self._row(key, bucket) for key, bucket in self._buckets.items() if bucket.dirty)
+        return rows
+
+    def mark_written(self, rows, now: datetime):
+        """書き出しが成功した行を反映する
+
+        書いている間に発言があったバケットは dirty のまま残し、次回に書き直す。
+        書けた前の時間帯のバケットと追い出したバケットはここでメモリから消す。
+        """
+        for key, writer_id, messages, _, _ in rows:
+            bucket = self._buckets.get(key) or self._closed.get(key)
+            if bucket is not None and bucket.writer_id == writer_id and bucket.messages == messages:
+                bucket.dirty = False
+        self._closed = {key: bucket for key, bucket in self._closed.items() if bucket.dirty}
+        current = bucket_start(now)
+        for key in [key for key, bucket in self._buckets.items() if key[2] < current and not bucket.dirty]:
+            del self._buckets[key]
+
+    @staticmethod
+    def _row(key: BucketKey, bucket: ActivityBucket):
+        return key, bucket.writer_id, bucket.messages, bucket.users.to_bytes(), bucket.chatters.to_bytes()
+
+
+def write_buckets(conn, rows, now: datetime):
+    """バケットを行ごと REPLACE する（読み込み不要・何度書いても同じ結果。ブロッキング）"""
+    cursor = InstrumentedCursor(conn.cursor())
+    try:
+        cursor.executemany(
+            "REPLACE INTO activity_buckets "
+            "(guild_id, channel_id, bucket_start, writer_id, messages, users_hll, chatters_cms, updated_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+            [(g, c, start, writer_id, messages, hll, cms, now)
+             for (g, c, start), writer_id, messages, hll, cms in rows]
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+class ActivitySummary(NamedTuple):
+    messages: int
+    unique_users: int
+    # 時間帯 -> メッセージ数（古い順）
+    hourly: List[Tuple[datetime, int]]
+    # (user_id, 推定発言数)
+    top_chatters: List[Tuple[int, int]]
+    channels: int
+
+
+def summarize_activity(conn, guild_id: int, since: datetime, channel_id: Optional[int] = None,
+                       top: int = 5) -> ActivitySummary:
+    """保存されたバケットを読み、HLL と CMS を併合して集計する（ブロッキング）"""
+    cursor = InstrumentedCursor(conn.cursor())
+    try:
+        query = (
+            "SELECT channel_id, bucket_start, messages, users_hll, chatters_cms FROM activity_buckets "
+            "WHERE guild_id=%s AND bucket_start>=%s"
+        )
+        params = [guild_id, since]
+        if channel_id is not None:
+            query += " AND channel_id=%s"
+            params.append(channel_id)
+        cursor.execute(query, tuple(params))
+
+        users = HyperLogLog()
+        chatters = CountMinSketch()
+        hourly: Dict[datetime, int] = {}
+        channels = set()
+        messages = 0
+        # 1行ずつ併合するので、メモリは行数によらず一定
+        for row_channel, start, count, hll, cms in cursor:
+            messages += count
+            hourly[start] = hourly.get(start, 0) + count
+            channels.add(row_channel)
+            users.merge(HyperLogLog.from_bytes(hll))
+            chatters.merge(CountMinSketch.from_bytes(cms))
+        return ActivitySummary(
+            messages=messages,
+            unique_users=users.estimate() if messages else 0,
+            hourly=sorted(hourly.items()),
+            top_chatters=chatters.heavy_hitters(top),
+            channels=len(channels),
+        )
+    finally:
+        cursor.close()
+
+
+def hourly_series(hourly: List[Tuple[datetime, int]], since: datetime, hours: int) -> List[int]:
+    """メッセージの無い時間帯を 0 で埋めた時間ごとの件数"""
+    counts = dict(hourly)
+    start = bucket_start(since)
+    return [counts.get(start + timedelta(hours=i), 0) for i in range(hours + 1)]
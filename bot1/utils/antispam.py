@@ -0,0 +1,215 @@
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+# これより短いメッセージは重複判定の対象にしない（「草」「おはよう」の連投で引っかけない）
+DUPLICATE_MIN_LENGTH = 5
+# 一斉投稿の判定に使う最短の長さ（「おめでとう！」などの定型の挨拶は対象外にする）
+RAID_MIN_LENGTH = 20
+# 一斉投稿とみなすには、各投稿者が同じ内容をこの回数以上繰り返している必要がある
+RAID_REPEATS_PER_USER = 2
+# 追跡するユーザー・チャンネル数の上限（古いものから捨てる）
+MAX_TRACKED_USERS = 50000
+MAX_TRACKED_CHANNELS = 5000
+# チャンネルごとに覚えておくメッセージ数（同じ内容の一斉投稿の検出用）
+CHANNEL_RING_SIZE = 100
+
+
+class SpamRules(NamedTuple):
+    """サーバーごとの判定基準（秒数はスライディングウィンドウの幅）"""
+    rate_count: int = 5
+    rate_seconds: float = 10.0
+    duplicate_count: int = 4
+    duplicate_seconds: float = 30.0
+    mention_limit: int = 10
+    mention_seconds: float = 30.0
+    # 同じ内容を繰り返し投稿した人がこの人数以上いたら一斉投稿（レイド）とみなす
+    raid_users: int = 4
+    raid_seconds: float = 20.0
+
+
+class Verdict(NamedTuple):
+    reasons: List[str]
+    # 処分するユーザー（一斉投稿なら投稿者全員）
+    user_ids: List[int]
+    # 削除するメッセージ (channel_id, message_id)
+    messages: List[Tuple[int, int]]
+
+
+class SlidingCounter:
+    """ウィンドウ内の重み付きイベント数。古いものを左から捨てるリングバッファ"""
+    __slots__ = ("window", "capacity", "_events", "total")
+
+    def __init__(self, window: float, capacity: int):
+        self.window = window
+        self.capacity = capacity
+        self._events: Deque[Tuple[float, int]] = deque()
+        self.total = 0
+
+    def add(self, now: float, weight: int = 1) -> int:
+        events = self._events
+        events.append((now, weight))
+        self.total += weight
+        limit = now - self.window
+        while events and (events[0][0] < limit or len(events) > self.capacity):
+            self.total -= events.popleft()[1]
+        return self.total
+
+
+class DuplicateCounter:
+    """ウィンドウ内で同じ内容（ハッシュ）が何回出たか"""
+    __slots__ = ("window", "capacity", "_events", "_counts")
+
+    def __init__(self, window: float, capacity: int):
+        self.window = window
+        self.capacity = capacity
+        self._events: Deque[Tuple[float, int]] = deque()
+        self._counts: Dict[int, int] = {}
+
+    def add(self, now: float, key: int) -> int:
+        events, counts = self._events, self._counts
+        events.append((now, key))
+        counts[key] = counts.get(key, 0) + 1
+        limit = now - self.window
+        while events and (events[0][0] < limit or len(events) > self.capacity):
+            _, old = events.popleft()
+            remaining = counts[old] - 1
+            if remaining:
+                counts[old] = remaining
+            else:
+                del counts[old]
+        return counts[key]
+
+
+class _UserState:
+    __slots__ = ("rate", "duplicates", "mentions", "recent")
+
+    def __init__(self, rules: SpamRules):
+        self.rate = SlidingCounter(rules.rate_seconds, rules.rate_count * 2)
+        self.duplicates = DuplicateCounter(rules.duplicate_seconds, rules.duplicate_count * 2)
+        self.mentions = SlidingCounter(rules.mention_seconds, rules.rate_count * 4)
+        # 処分時にまとめて消す直近のメッセージ (時刻, channel_id, message_id)
+        self.recent: Deque[Tuple[float, int, int]] = deque(maxlen=max(rules.rate_count, rules.duplicate_count) * 2)
+
+
+class _ChannelState:
+    """チャンネル内の直近の投稿（内容のハッシュ -> 投稿者ごとの件数）"""
+    __slots__ = ("window", "_events", "_posters")
+
+    def __init__(self, window: float):
+        self.window = window
+        self._events: Deque[Tuple[float, int, int, int]] = deque()
+        self._posters: Dict[int, Counter] = {}
+
+    def add(self, now: float, key: int, user_id: int, message_id: int):
+        events, posters = self._events, self._posters
+        events.append((now, key, user_id, message_id))
+        posters.setdefault(key, Counter())[user_id] += 1
+        limit = now - self.window
+        while events and (events[0][0] < limit or len(events) > CHANNEL_RING_SIZE):
+            _, old, old_user, _ = events.popleft()
+            counter = posters[old]
+            counter[old_user] -= 1
+            if not counter[old_user]:
+                del counter[old_user]
+                if not counter:
+                    del posters[old]
+
+    def repeaters(self, key: int) -> List[int]:
+        """ウィンドウ内で同じ内容を RAID_REPEATS_PER_USER 回以上投稿したユーザー"""
+        return [user_id for user_id, n in self._posters.get(key, {}).items() if n >= RAID_REPEATS_PER_USER]
+
+    def copies(self, key: int, user_ids: List[int]) -> List[Tuple[int, int]]:
+        """指定したユーザーによる同じ内容の (user_id, message_id)"""
+        users = set(user_ids)
+        return [(user_id, message_id) for _, k, user_id, message_id in self._events if k == key and user_id in users]
+
+
+def normalize(content: str) -> str:
+    """大文字小文字と空白の違いを無視するための正規化"""
+    return " ".join(content.casefold().split())
+
+
+class SpamDetector:
+    """メッセージごとに O(1) でスパムかどうかを判定する
+
+    ユーザーごとに投稿数・同一内容・メンション数のスライディングウィンドウを、
+    チャンネルごとに同じ内容の投稿者を持つ。状態は LRU で上限を設け、
+    しばらく発言していないユーザーから捨てるので、メモリは活動中のユーザー数で決まる。
+    """
+
+    def __init__(self, max_users: int = MAX_TRACKED_USERS, max_channels: int = MAX_TRACKED_CHANNELS):
+        self.max_users = max_users
+        self.max_channels = max_channels
+        self._users: "OrderedDict[Tuple[int, int], _UserState]" = OrderedDict()
+        self._channels: "OrderedDict[int, _ChannelState]" = OrderedDict()
+
+    @property
+    def tracked_users(self) -> int:
+        return len(self._users)
+
+    @property
+    def tracked_channels(self) -> int:
+        return len(self._channels)
+
+    def forget_guild(self, guild_id: int):
+        """判定基準が変わったサーバーの状態を捨てる（次の発言から新しい基準で数え直す）"""
+        for key in [key for key in self._users if key[0] == guild_id]:
+            del self._users[key]
+
+    def _user(self, guild_id: int, user_id: int, rules: SpamRules) -> _UserState:
+        key = (guild_id, user_id)
+        state = self._users.get(key)
+        if state is None:
+            state = self._users[key] = _UserState(rules)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+        return state
+
+    def _channel(self, channel_id: int, rules: SpamRules) -> _ChannelState:
+        state = self._channels.get(channel_id)
+        if state is None:
+            state = self._channels[channel_id] = _ChannelState(rules.raid_seconds)
+            if len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(channel_id)
+            state.window = rules.raid_seconds
+        return state
+
+    def check(self, rules: SpamRules, guild_id: int, channel_id: int, user_id: int, message_id: int,
+              content: str, mentions: int, now: float) -> Optional[Verdict]:
+        user = self._user(guild_id, user_id, rules)
+        user.recent.append((now, channel_id, message_id))
+        reasons = []
+
+        if user.rate.add(now) >= rules.rate_count:
+            reasons.append(f"{rules.rate_seconds:g}秒間に{rules.rate_count}件以上の投稿")
+        if mentions and user.mentions.add(now, mentions) >= rules.mention_limit:
+            reasons.append(f"{rules.mention_seconds:g}秒間に{rules.mention_limit}件以上のメンション")
+
+        normalized = normalize(content)
+        raid: List[Tuple[int, int]] = []
+        if len(normalized) >= DUPLICATE_MIN_LENGTH:
+            key = hash(normalized)
+            if user.duplicates.add(now, key) >= rules.duplicate_count:
+                reasons.append(f"同じ内容を{rules.duplicate_count}回以上投稿")
+            # 一斉投稿は、ある程度長い同じ文面を「それぞれが繰り返している」人が揃ったときだけ。
+            # 同じ挨拶を1回ずつ投稿しただけの人は含めない
+            if len(normalized) >= RAID_MIN_LENGTH:
+                channel = self._channel(channel_id, rules)
+                channel.add(now, key, user_id, message_id)
+                repeaters = channel.repeaters(key)
+                if user_id in repeaters and len(repeaters) >= rules.raid_users:
+                    reasons.append(f"{rules.raid_users}人以上が同じ内容を繰り返し一斉投稿")
+                    raid = channel.copies(key, repeaters)
+
+        if not reasons:
+            return None
+        user_ids = list(dict.fromkeys([user_id] + [uid for uid, _ in raid]))
+        since = now - max(rules.rate_seconds, rules.duplicate_seconds, rules.mention_seconds)
+        burst = [(cid, mid) for at, cid, mid in user.recent if at >= since]
+        messages = list(dict.fromkeys(burst + [(channel_id, mid) for _, mid in raid]))
+        user.recent.clear()
+        return Verdict(reasons, user_ids, messages)
@@ -0,0 +1,147 @@
+import aiohttp
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+# 1つの identify バケットで次の IDENTIFY まで空ける秒数（Discord の制限）
+IDENTIFY_INTERVAL = 5.0
+
+
+class ShardConfig(NamedTuple):
+    """このプロセスが担当するシャード"""
+    shard_count: Optional[int]
+    shard_ids: Optional[List[int]]
+    cluster_id: int
+    cluster_count: int
+
+    @property
+    def is_primary(self) -> bool:
+        # コマンド同期や保持期間処理など、全体で1回だけ行う処理はクラスタ0が担当する
+        return self.cluster_id == 0
+
+
+def shard_config_from_env() -> ShardConfig:
+    """SHARD_COUNT / SHARD_IDS / CLUSTER_ID / CLUSTER_COUNT を読む
+
+    SHARD_COUNT が無ければ AutoShardedBot に推奨シャード数を任せる。
+    """
+    count = os.getenv("SHARD_COUNT")
+    ids = os.getenv("SHARD_IDS")
+    shard_count = int(count) if count else None
+    shard_ids = [int(x) for x in ids.split(",") if x.strip()] if ids else None
+    if shard_ids is not None and shard_count is None:
+        raise ValueError("SHARD_IDS を指定するときは SHARD_COUNT も必要です")
+    return ShardConfig(
+        shard_count=shard_count,
+        shard_ids=shard_ids,
+        cluster_id=int(os.getenv("CLUSTER_ID", 0)),
+        cluster_count=int(os.getenv("CLUSTER_COUNT", 1)),
+    )
+
+
+def shard_ranges(shard_count: int, clusters: int) -> List[List[int]]:
+    """シャードを連続した範囲でクラスタに割り振る（端数は先頭のクラスタから1つずつ）"""
+    clusters = max(1, min(clusters, shard_count))
+    base, extra = divmod(shard_count, clusters)
+    ranges, start = [], 0
+    for i in range(clusters):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+async def fetch_gateway_info(token: str) -> Dict:
+    """推奨シャード数と identify の同時実行数を取得する"""
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+        async with session.get(GATEWAY_BOT_URL, headers=headers) as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+
+class ClusterLauncher:
+    """シャード範囲ごとに Bot プロセスを起動・監視する親プロセス
+
+    子プロセスは同じスクリプトを SHARD_IDS / SHARD_COUNT / CLUSTER_ID 付きの
+    環境変数で起動する。IDENTIFY の制限に当たらないよう、前のクラスタの
+    シャード数に応じて起動をずらし、異常終了したクラスタは待ってから再起動する。
+    SIGINT / SIGTERM は子プロセスに転送し、全員の終了を待つ。
+    """
+
+    def __init__(self, script: str, shard_count: int, clusters: int, max_concurrency: int = 1,
+                 restart_delay: float = 10.0, stop_timeout: float = 30.0):
+        self.script = script
+        self.shard_count = shard_count
+        self.ranges = shard_ranges(shard_count, clusters)
+        self.max_concurrency = max(1, max_concurrency)
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+        self.processes: Dict[int, subprocess.Popen] = {}
+        self._stopping = False
+
+    def _spawn(self, cluster_id: int) -> subprocess.Popen:
+        shard_ids = self.ranges[cluster_id]
+        env = dict(os.environ)
+        env.update({
+            "SHARD_COUNT": str(self.shard_count),
+            "SHARD_IDS": ",".join(map(str, shard_ids)),
+            "CLUSTER_ID": str(cluster_id),
+            "CLUSTER_COUNT": str(len(self.ranges)),
+        })
+        print(f"🚀 クラスタ {cluster_id} を起動 (シャード {shard_ids[0]}-{shard_ids[-1]} / {self.shard_count})")
+        # 端末の Ctrl+C は親だけが受け取り、子には _stop から1回だけ転送する
+        return subprocess.Popen([sys.executable, self.script], env=env, start_new_session=True)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+        for proc in self.processes.values():
+            if proc.poll() is None:
+                proc.send_signal(signum)
+
+    def run(self) -> int:
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        for cluster_id, shard_ids in enumerate(self.ranges):
+            if self._stopping:
+                break
+            self.processes[cluster_id] = self._spawn(cluster_id)
+            # 次のクラスタは、このクラスタの IDENTIFY が終わる頃に起動する
+            if cluster_id < len(self.ranges) - 1:
+                time.sleep(len(shard_ids) * IDENTIFY_INTERVAL / self.max_concurrency)
+
+        restart_at: Dict[int, float] = {}
+        while not self._stopping:
+            time.sleep(1)
+            now = time.monotonic()
+            for cluster_id, proc in list(self.processes.items()):
+                code = proc.poll()
+                if code is None or self._stopping:
+                    continue
+                if code == 0:
+                    print(f"クラスタ {cluster_id} が終了しました")
+                    del self.processes[cluster_id]
+                    continue
+                if cluster_id not in restart_at:
+                    print(f"❌ クラスタ {cluster_id} が異常終了しました (code={code})。{self.restart_delay:.0f}秒後に再起動します")
+                    restart_at[cluster_id] = now + self.restart_delay
+                elif now >= restart_at[cluster_id]:
+                    del restart_at[cluster_id]
+                    self.processes[cluster_id] = self._spawn(cluster_id)
+            if not self.processes:
+                return 0
+
+        deadline = time.monotonic() + self.stop_timeout
+        for cluster_id, proc in self.processes.items():
+            try:
+                proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                print(f"⚠️ クラスタ {cluster_id} が終了しないため強制終了します")
+                proc.kill()
+                proc.wait()
+        return 0
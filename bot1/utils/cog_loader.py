@@ -0,0 +1,161 @@
+import ast
+import asyncio
+import contextvars
+import importlib.util
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from utils import db
+from utils.intents import unsubscribed_listeners
+
+
+def read_manifest(name: str) -> Dict[str, Any]:
+    """Cog モジュールの COG_MANIFEST を import せずに読み取る
+
+    ロード順や intents はロード前に決める必要があるため、ソースを AST で解析して
+    リテラルの辞書だけを取り出す。定義がなければ空の辞書を返す。
+    """
+    spec = importlib.util.find_spec(name)
+    if spec is None or not spec.origin:
+        return {}
+    with open(spec.origin, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), spec.origin)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(target, ast.Name) and target.id == "COG_MANIFEST" for target in node.targets
+        ):
+            return ast.literal_eval(node.value)
+    return {}
+
+
+def plan_waves(manifests: Dict[str, Dict[str, Any]]) -> List[List[str]]:
+    """依存関係から、同時にロードできる Cog のまとまり（ウェーブ）を順に返す"""
+    remaining = {name: set(manifest.get("requires", ())) for name, manifest in manifests.items()}
+    for name, requires in remaining.items():
+        unknown = requires - remaining.keys()
+        if unknown:
+            raise ValueError(f"{name} が未登録の Cog に依存しています: {', '.join(sorted(unknown))}")
+
+    waves = []
+    done = set()
+    while remaining:
+        # 登録順を保ったまま、依存がすべてロード済みのものを取り出す
+        wave = [name for name, requires in remaining.items() if requires <= done]
+        if not wave:
+            raise ValueError(f"Cog の依存関係が循環しています: {', '.join(remaining)}")
+        for name in wave:
+            del remaining[name]
+        done.update(wave)
+        waves.append(wave)
+    return waves
+
+
+class CogTiming:
+    __slots__ = ("name", "started", "import_init", "cog_load", "db_connect", "total", "error")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.import_init: Optional[float] = None
+        self.cog_load: Optional[float] = None
+        # 最初の DB 接続にかかった時間
+        self.db_connect: Optional[float] = None
+        self.total: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def record_db_connect(self, elapsed: float):
+        if self.db_connect is None:
+            self.db_connect = elapsed
+
+
+_current_timing: contextvars.ContextVar[Optional[CogTiming]] = contextvars.ContextVar("current_cog_timing", default=None)
+
+
+class CogLoader:
+    """COG_MANIFEST の requires に従って Cog を並行ロードし、所要時間を記録する
+
+    依存のない Cog は同じウェーブで asyncio.gather によりロードされるので、
+    cog_load 内の非同期 I/O（DB 接続など）が重なって進む。
+    """
+
+    def __init__(self, bot, names: List[str], manifests: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.bot = bot
+        self.names = names
+        # intents の計算で先に読んでいればそれを使う
+        self.manifests: Dict[str, Dict[str, Any]] = manifests or {}
+        self.timings: Dict[str, CogTiming] = {}
+        self.wall_time = 0.0
+
+    async def load_all(self):
+        started = time.perf_counter()
+        if not self.manifests:
+            self.manifests = {name: read_manifest(name) for name in self.names}
+        failed = set()
+        for wave in plan_waves(self.manifests):
+            targets = []
+            for name in wave:
+                missing = set(self.manifests[name].get("requires", ())) & failed
+                if missing:
+                    print(f"⏭️ {name} は依存先 {', '.join(sorted(missing))} のロードに失敗したためスキップします")
+                    failed.add(name)
+                else:
+                    targets.append(name)
+            results = await asyncio.gather(*(self._load(name) for name in targets))
+            failed.update(name for name, ok in zip(targets, results) if not ok)
+        self.wall_time = time.perf_counter() - started
+
+    async def _load(self, name: str) -> bool:
+        timing = CogTiming(name)
+        self.timings[name] = timing
+        _current_timing.set(timing)
+        db.connect_listener.set(timing.record_db_connect)
+        try:
+            await self.bot.load_extension(name)
+            print(f"✅ {name} をロードしました")
+            self._warn_unsubscribed(name)
+            return True
+        except Exception as e:
+            timing.error = repr(e)
+            traceback.print_exc()
+            return False
+        finally:
+            timing.total = time.perf_counter() - timing.started
+
+    def _warn_unsubscribed(self, name: str):
+        # COG_MANIFEST に書き忘れたリスナーは intent が無効で呼ばれないので知らせる
+        for cog in self.bot.cogs.values():
+            if type(cog).__module__ != name:
+                continue
+            for event, intent in unsubscribed_listeners(cog, self.bot.intents):
+                print(f"⚠️ {name} の {event} は intent '{intent}' が無効なため呼ばれません（COG_MANIFEST の events に追加してください）")
+
+    @contextmanager
+    def measure_add_cog(self):
+        """Bot.add_cog を囲み、import+__init__ と cog_load の時間を分けて記録する"""
+        timing = _current_timing.get()
+        if timing is None:
+            yield
+            return
+        entered = time.perf_counter()
+        timing.import_init = entered - timing.started
+        try:
+            yield
+        finally:
+            timing.cog_load = time.perf_counter() - entered
+
+    def report(self) -> str:
+        def ms(value: Optional[float]) -> str:
+            return f"{value * 1000:8.1f}ms" if value is not None else "         -"
+
+        total = sum(timing.total or 0 for timing in self.timings.values())
+        lines = [f"⏱️ Cog ロード時間（合計 {total:.2f}s / 実時間 {self.wall_time:.2f}s）"]
+        lines.append(f"  {'cog':<20} {'import+init':>11} {'cog_load':>10} {'DB初回接続':>10} {'total':>10}")
+        for timing in sorted(self.timings.values(), key=lambda t: t.total or 0, reverse=True):
+            status = " ❌" if timing.error else ""
+            lines.append(
+                f"  {timing.name:<20} {ms(timing.import_init):>11} {ms(timing.cog_load):>10} "
+                f"{ms(timing.db_connect):>10} {ms(timing.total):>10}{status}"
+            )
+        return "\n".join(lines)
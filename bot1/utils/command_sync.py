@@ -0,0 +1,87 @@
+import discord
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+
+def tree_payload(tree: discord.app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None) -> List[Dict[str, Any]]:
+    """sync で送られるのと同じ形にコマンドツリーをシリアライズする"""
+    payload = []
+    for command in tree.get_commands(guild=guild):
+        try:
+            data = command.to_dict(tree)
+        except TypeError:
+            # 古い discord.py は引数なし
+            data = command.to_dict()
+        payload.append(data)
+    payload.sort(key=lambda data: (data.get("type", 1), data["name"]))
+    return payload
+
+
+def tree_hash(tree: discord.app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None) -> str:
+    serialized = json.dumps(tree_payload(tree, guild), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class CommandSyncer:
+    """コマンドツリーのハッシュが前回の同期時から変わったときだけ sync する
+
+    ハッシュは state_path の JSON に「アプリケーションID:スコープ」ごとに保存する。
+    dev_guild_ids を指定すると、グローバル同期の代わりにそのギルドへだけ同期する（開発用）。
+    """
+
+    def __init__(self, bot, state_path: str, dev_guild_ids: List[int], force: bool = False):
+        self.bot = bot
+        self.state_path = state_path
+        self.dev_guild_ids = dev_guild_ids
+        self.force = force
+
+    def _load_state(self) -> Dict[str, str]:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self, state: Dict[str, str]):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    async def sync(self):
+        tree = self.bot.tree
+        state = self._load_state()
+        if self.dev_guild_ids:
+            scopes = [discord.Object(id=guild_id) for guild_id in self.dev_guild_ids]
+        else:
+            scopes = [None]
+
+        for guild in scopes:
+            if guild is not None:
+                tree.copy_global_to(guild=guild)
+            scope = f"guild:{guild.id}" if guild else "global"
+            key = f"{self.bot.application_id}:{scope}"
+            digest = tree_hash(tree, guild)
+            if not self.force and state.get(key) == digest:
+                print(f"🌐 スラッシュコマンド変更なし（{scope}）: 同期をスキップ")
+                continue
+            try:
+                synced = await tree.sync(guild=guild)
+            except discord.HTTPException as e:
+                print(f"❌ スラッシュコマンド同期失敗（{scope}）: {e}")
+                continue
+            print(f"🌐 スラッシュコマンド同期（{scope}）: {len(synced)} 件")
+            state[key] = digest
+            self._save_state(state)
+
+
+def from_env(bot) -> CommandSyncer:
+    dev_guild_ids = [int(x) for x in os.getenv("DEV_GUILD_IDS", "").split(",") if x.strip()]
+    return CommandSyncer(
+        bot,
+        state_path=os.getenv("COMMAND_SYNC_STATE", ".command_sync_state.json"),
+        dev_guild_ids=dev_guild_ids,
+        force=os.getenv("FORCE_COMMAND_SYNC") == "1"
+    )
@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+import mysql.connector
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils import tracing
+from utils.metrics import InstrumentedCursor
+
+# 接続にかかった秒数を受け取るコールバック（起動時のロード時間計測などで使う）。
+# asyncio.to_thread はコンテキストを引き継ぐので、スレッド内の接続も通知される。
+connect_listener: contextvars.ContextVar[Optional[Callable[[float], None]]] = contextvars.ContextVar(
+    "connect_listener", default=None
+)
+
+
+def connect():
+    """環境変数の設定で MySQL に接続する（ブロッキング）"""
+    started = time.perf_counter()
+    conn = mysql.connector.connect(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        port=int(os.getenv("DB_PORT", 3306))
+    )
+    listener = connect_listener.get()
+    if listener:
+        listener(time.perf_counter() - started)
+    return conn
+
+
+# これより長く待機していた接続は、渡す前に生きているか確かめる（秒）
+IDLE_PING_SECONDS = 30
+
+
+def _revive(conn):
+    """待機中に切れた接続をつなぎ直す。だめなら新しく接続する（ブロッキング）"""
+    try:
+        conn.ping(reconnect=True, attempts=1, delay=0)
+        return conn
+    except mysql.connector.Error:
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+        return connect()
+
+
+class ConnectionPool:
+    """asyncio 用の簡易コネクションプール
+
+    同時に使える接続数を size で制限し、返却された接続は使い回す。
+    接続の作成・クエリ実行はスレッドで行うのでイベントループは止めない。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        # (接続, 返却された時刻)
+        self._idle: List[Tuple[Any, float]] = []
+        self._semaphore = asyncio.Semaphore(size)
+        self.created = 0
+        self.in_use = 0
+        self.waiting = 0
+
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            if self._idle:
+                conn, released_at = self._idle.pop()
+                if time.monotonic() - released_at > IDLE_PING_SECONDS:
+                    conn = await tracing.to_thread(_revive, conn)
+            else:
+                conn = await tracing.to_thread(connect)
+                self.created += 1
+        except BaseException:
+            self._semaphore.release()
+            raise
+        self.in_use += 1
+        return conn
+
+    async def release(self, conn, discard: bool = False):
+        self.in_use -= 1
+        # 読むだけで commit しない使い方でも、開いたままのトランザクション
+        # （REPEATABLE READ の古いスナップショット）を次の利用者に持ち越さない
+        if not discard and conn.in_transaction:
+            try:
+                await asyncio.to_thread(conn.rollback)
+            except mysql.connector.Error:
+                discard = True
+        if discard:
+            try:
+                await asyncio.to_thread(conn.close)
+            except mysql.connector.Error:
+                pass
+        else:
+            self._idle.append((conn, time.monotonic()))
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size,
+            "open": self.in_use + len(self._idle),
+            "in_use": self.in_use,
+            "idle": len(self._idle),
+            "waiting": self.waiting,
+            "created": self.created,
+        }
+
+
+pool = ConnectionPool(int(os.getenv("DB_POOL_SIZE", 5)))
+
+
+def _run_query(conn, query: str, params: Optional[Tuple[Any, ...]], is_read: bool):
+    cursor = InstrumentedCursor(conn.cursor())
+    try:
+        cursor.execute(query, params)
+        rows = cursor.fetchall() if is_read else None
+        # 読み込みでもトランザクションを閉じ、次の読み込みで最新の値が見えるようにする
+        conn.commit()
+        return rows
+    finally:
+        cursor.close()
+
+
+# DBヘルパーメソッド（非同期対応・プール使用）
+async def execute_db_operation(query: str, params: Optional[Tuple[Any, ...]] = None, is_read: bool = False):
+    conn = await pool.acquire()
+    discard = False
+    running = asyncio.ensure_future(tracing.to_thread(_run_query, conn, query, params, is_read))
+    try:
+        return await asyncio.shield(running)
+    except asyncio.CancelledError:
+        # スレッドはまだこの接続を使っている。別スレッドから rollback したり
+        # 次の利用者に渡したりしないよう、終わるまで待ってから捨てる
+        discard = True
+        await asyncio.wait([running])
+        if not running.cancelled():
+            running.exception()
+        raise
+    except mysql.connector.Error as err:
+        print(f"データベースエラー: {err}")
+        # 接続自体が壊れている可能性があるので使い回さない
+        discard = True
+        try:
+            await asyncio.to_thread(conn.rollback)
+        except mysql.connector.Error:
+            pass
+        raise err
+    finally:
+        await pool.release(conn, discard=discard)
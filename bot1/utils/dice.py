@@ -0,0 +1,290 @@
+import asyncio
+import functools
+import random
+import re
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy が無い環境では標準の random で振る（上限は低め）
+    np = None
+
+# 1回のロールで振るダイスの総数の上限（爆発で増えた分も含む）
+MAX_TOTAL_DICE = 1_000_000 if np is not None else 100_000
+MAX_FACES = 1_000_000
+MAX_TERMS = 20
+# 爆発ダイスの振り足しは最大この回数まで
+MAX_EXPLODE_ROUNDS = 100
+# これより多いダイスはイベントループを止めないようスレッドで振る
+INLINE_DICE_LIMIT = 10_000
+# スレッドで同時に処理する重いロールの数
+_heavy_rolls = asyncio.Semaphore(2)
+
+
+class DiceError(ValueError):
+    """ダイス式が不正・上限超過"""
+
+
+class Term(NamedTuple):
+    """式の1項。faces == 0 なら定数項（count が値）"""
+    sign: int
+    count: int
+    faces: int
+    explode: bool = False
+    # ("kh" | "kl" | "dh" | "dl", 個数)
+    keep: Optional[Tuple[str, int]] = None
+    # (">=" | ">" | "<=" | "<", 目標値)。指定すると合計ではなく成功数を数える
+    success: Optional[Tuple[str, int]] = None
+
+    @property
+    def is_dice(self) -> bool:
+        return self.faces > 0
+
+    def __str__(self) -> str:
+        if not self.is_dice:
+            return str(self.count)
+        text = f"{self.count}d{self.faces}"
+        if self.explode:
+            text += "!"
+        if self.keep:
+            text += f"{self.keep[0]}{self.keep[1]}"
+        if self.success:
+            text += f"{self.success[0]}{self.success[1]}"
+        return text
+
+
+class Expression(NamedTuple):
+    terms: Tuple[Term, ...]
+
+    @property
+    def dice_count(self) -> int:
+        return sum(term.count for term in self.terms if term.is_dice)
+
+    def __str__(self) -> str:
+        parts = []
+        for i, term in enumerate(self.terms):
+            if i == 0:
+                parts.append(("-" if term.sign < 0 else "") + str(term))
+            else:
+                parts.append(("- " if term.sign < 0 else "+ ") + str(term))
+        return " ".join(parts)
+
+
+class TermResult(NamedTuple):
+    term: Term
+    # 振った出目（爆発で振り足した分を含む）と、そのうち採用されたか
+    rolls: Sequence[int]
+    kept: Sequence[bool]
+    value: int
+
+
+class RollResult(NamedTuple):
+    expression: Expression
+    terms: List[TermResult]
+    total: int
+
+
+_TERM_RE = re.compile(
+    r"""
+    (?P<sign>[+-])?
+    (?:
+        (?P<count>\d+)?d(?P<faces>\d+|%)
+        (?P<explode>!)?
+        (?:(?P<keep>kh|kl|dh|dl|k)(?P<keep_n>\d+))?
+        (?:(?P<op>>=|<=|>|<)(?P<target>\d+))?
+      |
+        (?P<const>\d+)
+    )
+    """,
+    re.VERBOSE,
+)
+
+
+def normalize(text: str) -> str:
+    # 空白で区切られた数字をつなげて別の式にしないよう先に弾く
+    if re.search(r"[\d%]\s+[\dd]", text.lower()):
+        raise DiceError("項の間には + または - が必要です。")
+    return re.sub(r"\s+", "", text.lower())
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_normalized(text: str) -> Expression:
+    if not text:
+        raise DiceError("ダイス式が空です。")
+    terms = []
+    pos = 0
+    while pos < len(text):
+        match = _TERM_RE.match(text, pos)
+        if not match or match.end() == pos or (terms and not match.group("sign")):
+            raise DiceError(f"ダイス式を解釈できません: `{text[pos:pos + 10]}`")
+        pos = match.end()
+        sign = -1 if match.group("sign") == "-" else 1
+
+        if match.group("const") is not None:
+            terms.append(Term(sign, int(match.group("const")), 0))
+        else:
+            count = int(match.group("count") or 1)
+            faces = 100 if match.group("faces") == "%" else int(match.group("faces"))
+            if count < 1 or faces < 1:
+                raise DiceError("ダイスの数と面数は1以上で指定してください。")
+            if faces > MAX_FACES:
+                raise DiceError(f"面数は {MAX_FACES:,} 以下で指定してください。")
+            keep = None
+            if match.group("keep"):
+                mode = "kh" if match.group("keep") == "k" else match.group("keep")
+                keep = (mode, int(match.group("keep_n")))
+            success = (match.group("op"), int(match.group("target"))) if match.group("op") else None
+            explode = bool(match.group("explode"))
+            if explode and faces == 1:
+                raise DiceError("1面ダイスは爆発させられません。")
+            terms.append(Term(sign, count, faces, explode, keep, success))
+
+        if len(terms) > MAX_TERMS:
+            raise DiceError(f"項は {MAX_TERMS} 個までです。")
+
+    expression = Expression(tuple(terms))
+    if expression.dice_count > MAX_TOTAL_DICE:
+        raise DiceError(f"一度に振れるダイスは {MAX_TOTAL_DICE:,} 個までです。")
+    return expression
+
+
+def parse(text: str) -> Expression:
+    """ダイス式を解析する（正規化した式ごとにキャッシュ）
+
+    例: `2d6+3`, `4d6kh3`, `2d20kl1+5`, `10d10!>=8`, `3d6+1d4-2`, `1d%`
+    """
+    return _parse_normalized(normalize(text))
+
+
+# -----------------------------
+# ロール
+# -----------------------------
+def _sample(faces: int, count: int, rng) -> List[int]:
+    if np is not None:
+        return rng.integers(1, faces + 1, size=count)
+    return rng.choices(range(1, faces + 1), k=count)
+
+
+def _roll_term(term: Term, rng, budget: int) -> Tuple[TermResult, int]:
+    rolls = _sample(term.faces, term.count, rng)
+    used = term.count
+    if term.explode:
+        # 最大値が出たダイスの数だけ振り足す（振り足した分も爆発する）
+        chunks = [rolls]
+        pending = int((rolls == term.faces).sum()) if np is not None else rolls.count(term.faces)
+        for _ in range(MAX_EXPLODE_ROUNDS):
+            pending = min(pending, budget - used)
+            if pending <= 0:
+                break
+            extra = _sample(term.faces, pending, rng)
+            used += pending
+            chunks.append(extra)
+            pending = int((extra == term.faces).sum()) if np is not None else extra.count(term.faces)
+        rolls = np.concatenate(chunks) if np is not None else [r for chunk in chunks for r in chunk]
+
+    n = len(rolls)
+    kept = _keep_mask(rolls, term.keep, n)
+    if np is not None:
+        selected = rolls[kept]
+        if term.success:
+            value = int(meets(selected, term.success).sum())
+        else:
+            value = int(selected.sum())
+        return TermResult(term, rolls, kept, term.sign * value), used
+
+    selected = [r for r, k in zip(rolls, kept) if k]
+    if term.success:
+        value = sum(1 for r in selected if meets(r, term.success))
+    else:
+        value = sum(selected)
+    return TermResult(term, rolls, kept, term.sign * value), used
+
+
+def _keep_mask(rolls, keep: Optional[Tuple[str, int]], n: int):
+    if keep is None:
+        return np.ones(n, dtype=bool) if np is not None else [True] * n
+    mode, k = keep
+    k = max(0, min(k, n))
+    # 残す個数に直す（dh2 = 上位2個を捨てる = 下位 n-2 個を残す）
+    keep_high = mode in ("kh", "dl")
+    keep_count = k if mode in ("kh", "kl") else n - k
+    if np is not None:
+        # 同値の並びは元の順序を保つ（stable）
+        order = np.argsort(-rolls if keep_high else rolls, kind="stable")
+        mask = np.zeros(n, dtype=bool)
+        mask[order[:keep_count]] = True
+        return mask
+    order = sorted(range(n), key=lambda i: -rolls[i] if keep_high else rolls[i])
+    chosen = set(order[:keep_count])
+    return [i in chosen for i in range(n)]
+
+
+def meets(value, success: Tuple[str, int]):
+    op, target = success
+    if op == ">=":
+        return value >= target
+    if op == ">":
+        return value > target
+    if op == "<=":
+        return value <= target
+    return value < target
+
+
+def roll(expression: Expression) -> RollResult:
+    """式を振る（ブロッキング。大きな式は roll_async を使う）"""
+    rng = np.random.default_rng() if np is not None else random.Random()
+    budget = MAX_TOTAL_DICE
+    results = []
+    total = 0
+    for term in expression.terms:
+        if not term.is_dice:
+            results.append(TermResult(term, (), (), term.sign * term.count))
+        else:
+            result, used = _roll_term(term, rng, budget)
+            budget -= used
+            results.append(result)
+        total += results[-1].value
+    return RollResult(expression, results, total)
+
+
+async def roll_async(expression: Expression) -> RollResult:
+    """小さな式はその場で、大きな式はスレッドで（同時実行数を絞って）振る"""
+    if expression.dice_count <= INLINE_DICE_LIMIT and not any(t.explode for t in expression.terms):
+        return roll(expression)
+    async with _heavy_rolls:
+        return await asyncio.to_thread(roll, expression)
+
+
+# -----------------------------
+# 集計（出目を全部は表示できないとき）
+# -----------------------------
+def histogram(rolls: Sequence[int], faces: int, bins: int = 10) -> List[Tuple[str, int]]:
+    """出目の度数分布。面数が bins 以下なら面ごと、それ以上は等幅の区間ごと"""
+    width = 1 if faces <= bins else -(-faces // bins)
+    edges = list(range(1, faces + 1, width))
+    if np is not None:
+        counts = np.bincount((np.asarray(rolls) - 1) // width, minlength=len(edges))
+    else:
+        counts = [0] * len(edges)
+        for r in rolls:
+            counts[(r - 1) // width] += 1
+    labels = [str(lo) if width == 1 else f"{lo}-{min(lo + width - 1, faces)}" for lo in edges]
+    return list(zip(labels, (int(c) for c in counts)))
+
+
+class RollSummary(NamedTuple):
+    count: int
+    minimum: int
+    maximum: int
+    mean: float
+    table: List[Tuple[str, int]]
+
+
+def summarize_rolls(rolls: Sequence[int], faces: int) -> RollSummary:
+    """1項の出目の件数・最小・最大・平均と度数分布（大きな配列は NumPy でまとめて計算）"""
+    if np is not None:
+        values = np.asarray(rolls)
+        minimum, maximum, total = int(values.min()), int(values.max()), int(values.sum())
+    else:
+        minimum, maximum, total = min(rolls), max(rolls), sum(rolls)
+    return RollSummary(len(rolls), minimum, maximum, total / len(rolls), histogram(rolls, faces))
@@ -0,0 +1,286 @@
+import math
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from utils.dice import MAX_EXPLODE_ROUNDS, DiceError, Expression, Term, meets, np
+
+# 分布の台（取りうる値の数）の上限
+MAX_SUPPORT = 2_000_000
+# kh/kl などの採用数付きの項は DP で計算するので、ダイス数と面数を絞る
+MAX_KEEP_DICE = 100
+MAX_KEEP_FACES = 100
+# これより長い配列同士の畳み込みは FFT で行う
+FFT_THRESHOLD = 500
+# 爆発ダイスはこの確率より小さい連鎖を打ち切る
+EXPLODE_EPSILON = 1e-12
+# メモ化する分布の合計サイズの上限（バイト）と、1件あたりの上限
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_ENTRY_MAX_BYTES = 1024 * 1024
+
+
+class Distribution(NamedTuple):
+    """整数値の確率分布。probs[i] が P(X = offset + i)"""
+    offset: int
+    probs: "np.ndarray"
+
+    @property
+    def min(self) -> int:
+        return self.offset
+
+    @property
+    def max(self) -> int:
+        return self.offset + len(self.probs) - 1
+
+    def mean(self) -> float:
+        values = np.arange(len(self.probs)) + self.offset
+        return float((values * self.probs).sum())
+
+    def variance(self) -> float:
+        values = np.arange(len(self.probs)) + self.offset
+        mean = self.mean()
+        return float((((values - mean) ** 2) * self.probs).sum())
+
+    def percentile(self, q: float) -> int:
+        """累積確率が q 以上になる最小の値"""
+        cdf = np.cumsum(self.probs)
+        index = int(np.searchsorted(cdf, q * cdf[-1] - 1e-12))
+        return self.offset + min(index, len(self.probs) - 1)
+
+    def at_least(self, target: int) -> float:
+        index = target - self.offset
+        if index <= 0:
+            return 1.0
+        if index >= len(self.probs):
+            return 0.0
+        return float(min(1.0, self.probs[index:].sum()))
+
+    def mode(self) -> int:
+        return self.offset + int(np.argmax(self.probs))
+
+
+# -----------------------------
+# 畳み込み
+# -----------------------------
+def _convolve(a, b):
+    if len(a) * len(b) <= FFT_THRESHOLD * FFT_THRESHOLD or min(len(a), len(b)) < 32:
+        return np.convolve(a, b)
+    n = len(a) + len(b) - 1
+    size = 1 << (n - 1).bit_length()
+    result = np.fft.irfft(np.fft.rfft(a, size) * np.fft.rfft(b, size), size)[:n]
+    # FFT の丸め誤差で出る負の値を落とす
+    return np.clip(result, 0.0, None)
+
+
+def _power(dist: Distribution, n: int) -> Distribution:
+    """同じ分布の n 個の和（二乗を繰り返して log n 回の畳み込み）"""
+    result = Distribution(0, np.ones(1))
+    base = dist
+    while n:
+        if n & 1:
+            result = Distribution(result.offset + base.offset, _convolve(result.probs, base.probs))
+        n >>= 1
+        if n:
+            base = Distribution(base.offset * 2, _convolve(base.probs, base.probs))
+    return result
+
+
+def _add(a: Distribution, b: Distribution) -> Distribution:
+    return Distribution(a.offset + b.offset, _convolve(a.probs, b.probs))
+
+
+def _negate(dist: Distribution) -> Distribution:
+    return Distribution(-dist.max, dist.probs[::-1].copy())
+
+
+def _from_weights(weights: Sequence[int], probs: Sequence[float]) -> Distribution:
+    low, high = min(weights), max(weights)
+    out = np.zeros(high - low + 1)
+    np.add.at(out, np.asarray(weights) - low, probs)
+    return Distribution(low, out)
+
+
+# -----------------------------
+# 項ごとの分布
+# -----------------------------
+def _weights(term: Term) -> List[int]:
+    """出目 1..F それぞれが項の値にいくつ寄与するか（成功数なら 0/1）"""
+    faces = range(1, term.faces + 1)
+    if term.success:
+        return [1 if meets(v, term.success) else 0 for v in faces]
+    return list(faces)
+
+
+def _single_die(term: Term) -> Distribution:
+    weights = _weights(term)
+    f = term.faces
+    if not term.explode:
+        return _from_weights(weights, [1.0 / f] * f)
+    # 爆発: 最大値が j 回続いたあと最大値以外で止まる
+    #   P = (1/F)^j * (1/F)、寄与 = j * w(F) + w(x)
+    rounds = min(MAX_EXPLODE_ROUNDS, max(1, math.ceil(math.log(EXPLODE_EPSILON) / math.log(1.0 / f))))
+    values, probs = [], []
+    for j in range(rounds + 1):
+        chain = (1.0 / f) ** j
+        for x in range(1, f):
+            values.append(j * weights[-1] + weights[x - 1])
+            probs.append(chain / f)
+    return _from_weights(values, probs)
+
+
+def _keep_distribution(term: Term) -> Distribution:
+    """N 個のうち上位/下位 k 個の寄与の和を、出目の大きい（小さい）順に DP で求める
+
+    状態は（まだ値の決まっていないダイス数 → 採用分の和の分布）。残りのダイスは
+    未処理の面の上で一様なので、いま見ている面が出る個数は二項分布になる。
+    """
+    n, f = term.count, term.faces
+    if n > MAX_KEEP_DICE or f > MAX_KEEP_FACES:
+        raise DiceError(f"kh/kl 付きの確率計算はダイス {MAX_KEEP_DICE} 個・{MAX_KEEP_FACES} 面までです。")
+    mode, k = term.keep
+    k = max(0, min(k, n))
+    keep_high = mode in ("kh", "dl")
+    keep_count = k if mode in ("kh", "kl") else n - k
+    weights = _weights(term)
+    order = range(f, 0, -1) if keep_high else range(1, f + 1)
+    span = keep_count * max(weights) + 1
+
+    states = {n: np.zeros(span)}
+    states[n][0] = 1.0
+    for step, face in enumerate(order):
+        left = f - step  # まだ処理していない面の数
+        p = 1.0 / left
+        w = weights[face - 1]
+        next_states = {}
+        for remaining, dist in states.items():
+            kept_so_far = n - remaining
+            for m in range(remaining + 1):
+                prob = math.comb(remaining, m) * p ** m * (1 - p) ** (remaining - m)
+                if prob == 0.0:
+                    continue
+                shift = max(0, min(m, keep_count - kept_so_far)) * w
+                target = next_states.setdefault(remaining - m, np.zeros(span))
+                if shift:
+                    target[shift:] += prob * dist[:span - shift]
+                else:
+                    target += prob * dist
+        states = next_states
+    # 取りえない値（両端の 0）を落とす
+    nonzero = np.nonzero(states[0])[0]
+    first, last = int(nonzero[0]), int(nonzero[-1])
+    return Distribution(first, states[0][first:last + 1])
+
+
+def _term_distribution(term: Term) -> Distribution:
+    if not term.is_dice:
+        return Distribution(term.count, np.ones(1))
+    if term.keep:
+        if term.explode:
+            raise DiceError("爆発ダイスと kh/kl/dh/dl の組み合わせは確率計算に対応していません。")
+        return _keep_distribution(term)
+    die = _single_die(term)
+    if (len(die.probs) - 1) * term.count + 1 > MAX_SUPPORT:
+        raise DiceError("取りうる値が多すぎて確率を計算できません。")
+    return _power(die, term.count)
+
+
+def _distribution(terms: Tuple[Term, ...]) -> Distribution:
+    total = Distribution(0, np.ones(1))
+    for term in terms:
+        dist = _term_distribution(term._replace(sign=1))
+        if term.sign < 0:
+            dist = _negate(dist)
+        total = _add(total, dist)
+        if len(total.probs) > MAX_SUPPORT:
+            raise DiceError("取りうる値が多すぎて確率を計算できません。")
+    # 丸め誤差を正規化しておく
+    return Distribution(total.offset, total.probs / total.probs.sum())
+
+
+class _DistributionCache:
+    """式ごとの分布の LRU。件数ではなく配列の合計バイト数で上限を決める
+
+    大きな分布（100000d20 で 15MB 程度）は作り直した方が安いので保持しない。
+    スレッドから同時に呼ばれるのでロックで守る。
+    """
+
+    def __init__(self, max_bytes: int, entry_max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entry_max_bytes = entry_max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[Tuple[Term, ...], Distribution]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[Term, ...]) -> Optional[Distribution]:
+        with self._lock:
+            dist = self._entries.get(key)
+            if dist is not None:
+                self._entries.move_to_end(key)
+            return dist
+
+    def put(self, key: Tuple[Term, ...], dist: Distribution):
+        size = dist.probs.nbytes
+        if size > self.entry_max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.probs.nbytes
+            self._entries[key] = dist
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.probs.nbytes
+
+
+_cache = _DistributionCache(CACHE_MAX_BYTES, CACHE_ENTRY_MAX_BYTES)
+
+
+def distribution(expression: Expression) -> Distribution:
+    """式の出目の厳密な分布（小さいものだけ式ごとにメモ化。ブロッキング）"""
+    if np is None:
+        raise DiceError("確率計算には NumPy が必要です。")
+    dist = _cache.get(expression.terms)
+    if dist is None:
+        dist = _distribution(expression.terms)
+        _cache.put(expression.terms, dist)
+    return dist
+
+
+class DistributionSummary(NamedTuple):
+    mean: float
+    stdev: float
+    minimum: int
+    maximum: int
+    mode: int
+    percentiles: List[Tuple[int, int]]
+    at_least: Optional[float]
+
+
+def summarize(dist: Distribution, target: Optional[int] = None,
+              quantiles: Sequence[int] = (5, 25, 50, 75, 95)) -> DistributionSummary:
+    return DistributionSummary(
+        mean=dist.mean(),
+        stdev=math.sqrt(max(0.0, dist.variance())),
+        minimum=dist.min,
+        maximum=dist.max,
+        mode=dist.mode(),
+        percentiles=[(q, dist.percentile(q / 100)) for q in quantiles],
+        at_least=dist.at_least(target) if target is not None else None,
+    )
+
+
+def bucketed(dist: Distribution, bins: int = 12) -> List[Tuple[str, float]]:
+    """表示用に確率を等幅の区間にまとめる（確率がほぼ 0 の裾は除く）"""
+    cdf = np.cumsum(dist.probs)
+    low = int(np.searchsorted(cdf, 1e-4))
+    high = int(np.searchsorted(cdf, 1 - 1e-4))
+    high = max(low, min(high, len(dist.probs) - 1))
+    width = max(1, -(-(high - low + 1) // bins))
+    rows = []
+    for start in range(low, high + 1, width):
+        end = min(start + width - 1, high)
+        a, b = dist.offset + start, dist.offset + end
+        label = str(a) if a == b else f"{a}-{b}"
+        rows.append((label, float(dist.probs[start:end + 1].sum())))
+    return rows
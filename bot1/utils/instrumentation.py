@@ -0,0 +1,60 @@
+import discord
+import functools
+import time
+from discord import app_commands
+
+from utils.metrics import registry
+from utils.tracing import tracer
+
+
+class InstrumentedCommandTree(app_commands.CommandTree):
+    """アプリコマンドの所要時間とエラー数を記録する CommandTree
+
+    開始時刻は interaction_check で interaction.extras に入れ、完了は
+    on_app_command_completion イベント（record_command_completion）、
+    失敗は on_error で記録する。トレースのルートスパンもここで開き、
+    コマンド内の DB・REST 呼び出しはその子スパンになる。
+    """
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["started_at"] = time.perf_counter()
+        name = interaction.command.qualified_name if interaction.command else "unknown"
+        interaction.extras["span"] = tracer.start_root(
+            f"interaction:{name}", guild_id=interaction.guild_id, user_id=interaction.user.id
+        )
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        record_command(interaction, interaction.command, error=True)
+        await super().on_error(interaction, error)
+
+
+def record_command(interaction: discord.Interaction, command, error: bool = False):
+    span = interaction.extras.pop("span", None)
+    if span is not None:
+        tracer.finish(span, error)
+    started = interaction.extras.get("started_at")
+    if started is None or command is None:
+        return
+    registry.observe("command", command.qualified_name, time.perf_counter() - started, error)
+
+
+def instrument_listener(func, event_name: str):
+    """イベントリスナーを所要時間・エラー数の記録付きでラップする"""
+    label = f"{event_name}:{getattr(func, '__qualname__', func.__name__)}"
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        error = False
+        try:
+            # リスナーの呼び出しは1つずつ別タスクなので、それぞれがトレースのルートになる
+            with tracer.root_span(f"event:{label}"):
+                return await func(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            registry.observe("listener", label, time.perf_counter() - started, error)
+
+    return wrapper
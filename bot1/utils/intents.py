@@ -0,0 +1,74 @@
+import discord
+import os
+from typing import Any, Dict, Iterable, List, Tuple
+
+# リスナーのイベント名 -> そのイベントを受け取るのに必要な intent
+EVENT_INTENTS = {
+    "on_message": "guild_messages",
+    "on_message_edit": "guild_messages",
+    "on_message_delete": "guild_messages",
+    "on_raw_message_delete": "guild_messages",
+    "on_member_join": "members",
+    "on_member_remove": "members",
+    "on_raw_member_remove": "members",
+    "on_member_update": "members",
+    "on_reaction_add": "guild_reactions",
+    "on_reaction_remove": "guild_reactions",
+    "on_raw_reaction_add": "guild_reactions",
+    "on_raw_reaction_remove": "guild_reactions",
+    "on_voice_state_update": "voice_states",
+}
+
+# チャンネル・ロール・スレッドの状態を持つために常に必要
+BASE_INTENTS = ("guilds",)
+
+
+def _validate(name: str) -> str:
+    if name not in discord.Intents.VALID_FLAGS:
+        raise ValueError(f"不明な intent: {name}")
+    return name
+
+
+def resolve_intents(manifests: Dict[str, Dict[str, Any]], extra: Iterable[str] = ()) -> Tuple[discord.Intents, Dict[str, List[str]]]:
+    """各 Cog の COG_MANIFEST の intents / events から必要最小限の Intents を作る
+
+    戻り値は (Intents, intent -> それを必要とする理由のリスト)。events に書かれた
+    イベントは EVENT_INTENTS で intent に変換する。
+    """
+    reasons: Dict[str, List[str]] = {name: ["常に有効"] for name in BASE_INTENTS}
+    for cog, manifest in manifests.items():
+        for name in manifest.get("intents", ()):
+            reasons.setdefault(_validate(name), []).append(cog)
+        for event in manifest.get("events", ()):
+            name = EVENT_INTENTS.get(event)
+            if name:
+                reasons.setdefault(name, []).append(f"{cog} ({event})")
+    for name in extra:
+        reasons.setdefault(_validate(name), []).append("EXTRA_INTENTS")
+
+    intents = discord.Intents.none()
+    for name in reasons:
+        setattr(intents, name, True)
+    return intents, reasons
+
+
+def extra_intents_from_env() -> List[str]:
+    """EXTRA_INTENTS（カンマ区切り。message_content など Cog から宣言しないもの）"""
+    return [name.strip() for name in os.getenv("EXTRA_INTENTS", "").split(",") if name.strip()]
+
+
+def format_reasons(reasons: Dict[str, List[str]]) -> str:
+    lines = ["📡 Gateway intents"]
+    for name, sources in sorted(reasons.items()):
+        lines.append(f"  {name:<16} <- {', '.join(dict.fromkeys(sources))}")
+    return "\n".join(lines)
+
+
+def unsubscribed_listeners(cog, intents: discord.Intents) -> List[Tuple[str, str]]:
+    """intent が無効なため呼ばれないリスナー (イベント名, intent) の一覧"""
+    missing = []
+    for event, _ in cog.get_listeners():
+        name = EVENT_INTENTS.get(event)
+        if name and not getattr(intents, name):
+            missing.append((event, name))
+    return missing
@@ -0,0 +1,393 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, NamedTuple, Optional, Set, Tuple
+
+import discord
+
+from utils import db, tracing
+from utils.metrics import InstrumentedCursor
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bulk_jobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    kind VARCHAR(64) NOT NULL,
+    params TEXT NOT NULL,
+    status VARCHAR(16) NOT NULL,
+    last_key BIGINT NOT NULL DEFAULT -1,
+    processed BIGINT NOT NULL DEFAULT 0,
+    total BIGINT NULL,
+    error TEXT NULL,
+    user_id BIGINT NOT NULL,
+    channel_id BIGINT NULL,
+    application_id BIGINT NOT NULL,
+    -- 以前のバージョンが保存していたトークン。今は書き込まず、起動時に消す
+    interaction_token VARCHAR(255) NULL,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL,
+    finished_at DATETIME NULL,
+    INDEX idx_bulk_jobs_status (status),
+    INDEX idx_bulk_jobs_guild (guild_id, status)
+)
+"""
+
+# 未完了として再開の対象になる状態
+ACTIVE_STATUSES = ("queued", "running")
+# インタラクションのトークンは 15 分で失効する（余裕を見て少し手前で諦める）
+TOKEN_LIFETIME = timedelta(minutes=14)
+# 進捗メッセージを編集する最短間隔（秒）
+PROGRESS_INTERVAL = 3.0
+
+
+class JobKind(NamedTuple):
+    """ジョブの種類ごとの処理。count/step はスレッドから呼ばれる（ブロッキング）
+
+    count(cursor, guild_id, params) -> 対象件数（進捗表示用、不明なら None）
+    step(cursor, guild_id, params, last_key, limit) -> (処理件数, 新しい last_key, 完了したか)
+    """
+    label: str
+    count: Callable[[Any, int, Dict[str, Any]], Optional[int]]
+    step: Callable[[Any, int, Dict[str, Any], int, int], Tuple[int, int, bool]]
+
+
+class Job(NamedTuple):
+    id: int
+    guild_id: int
+    kind: str
+    params: Dict[str, Any]
+    status: str
+    last_key: int
+    processed: int
+    total: Optional[int]
+    user_id: int
+    channel_id: Optional[int]
+    application_id: int
+    # インタラクションのトークン。DB には保存せずメモリ上だけに持つ（再起動後は None）
+    token: Optional[str]
+    created_at: datetime
+
+
+_JOB_COLUMNS = (
+    "id, guild_id, kind, params, status, last_key, processed, total, "
+    "user_id, channel_id, application_id, NULL, created_at"
+)
+
+
+def _job_from_row(row) -> Job:
+    values = list(row)
+    values[3] = json.loads(values[3])
+    return Job(*values)
+
+
+def chunked_update(label: str, table: str, set_clause: str,
+                   set_params: Callable[[Dict[str, Any]], Tuple[Any, ...]] = lambda params: (),
+                   key: str = "user_id") -> JobKind:
+    """サーバー内の行を key の順に limit 件ずつ UPDATE するジョブ
+
+    1回の UPDATE が触るのは (last_key, 次の limit 件目] の範囲だけなので、
+    ロックは短く、途中で止まっても last_key から続きを再開できる。
+    """
+
+    def count(cursor, guild_id: int, params: Dict[str, Any]) -> Optional[int]:
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE guild_id=%s", (guild_id,))
+        return cursor.fetchone()[0]
+
+    def step(cursor, guild_id: int, params: Dict[str, Any], last_key: int, limit: int) -> Tuple[int, int, bool]:
+        cursor.execute(
+            f"SELECT {key} FROM {table} WHERE guild_id=%s AND {key}>%s ORDER BY {key} LIMIT %s",
+            (guild_id, last_key, limit)
+        )
+        keys = [row[0] for row in cursor.fetchall()]
+        if not keys:
+            return 0, last_key, True
+        cursor.execute(
+            f"UPDATE {table} SET {set_clause} WHERE guild_id=%s AND {key}>%s AND {key}<=%s",
+            (*set_params(params), guild_id, last_key, keys[-1])
+        )
+        return len(keys), keys[-1], len(keys) < limit
+
+    return JobKind(label, count, step)
+
+
+async def _to_thread_uncancelled(func, /, *args):
+    """スレッドで実行し、キャンセルされてもスレッドの処理が終わるまで待ってから伝える
+
+    ジョブの接続は1スレッドずつしか使えないので、close() でタスクを止めたときに
+    実行中のチャンクと並行して接続を閉じないようにする。
+    """
+    running = asyncio.ensure_future(tracing.to_thread(func, *args))
+    try:
+        return await asyncio.shield(running)
+    except asyncio.CancelledError:
+        await asyncio.wait([running])
+        if not running.cancelled():
+            running.exception()
+        raise
+
+
+class JobRunner:
+    """一括操作をバックグラウンドで少しずつ進めるジョブ実行器
+
+    ジョブは bulk_jobs テーブルに保存し、チャンクの処理と進捗（last_key）の更新を
+    同じトランザクションでコミットするので、再起動後は続きから再開する。
+    実行は専用の接続で行い、全体の同時実行数とサーバーごとの同時実行数を絞り、
+    チャンクの間に少し待つことで通常の XP 処理などを妨げないようにする。
+    進捗は元のインタラクションの応答を編集して知らせる（トークンはメモリ上だけに持つので、
+    再起動後に再開したジョブは完了時にチャンネルへ結果を送る）。
+    """
+
+    def __init__(self, bot, concurrency: int = 2, per_guild: int = 1, max_pending: int = 5,
+                 chunk_size: int = 1000, pause: float = 0.1):
+        self.bot = bot
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.per_guild = per_guild
+        self.max_pending = max_pending
+        self.kinds: Dict[str, JobKind] = {}
+        self._slots = asyncio.Semaphore(concurrency)
+        self._guild_slots: Dict[int, asyncio.Semaphore] = {}
+        # サーバーID -> 未完了のジョブID
+        self._pending: Dict[int, Set[int]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._last_report: Dict[int, float] = {}
+
+    @classmethod
+    def from_env(cls, bot) -> "JobRunner":
+        return cls(
+            bot,
+            concurrency=int(os.getenv("JOB_CONCURRENCY", 2)),
+            per_guild=int(os.getenv("JOB_PER_GUILD", 1)),
+            max_pending=int(os.getenv("JOB_MAX_PENDING", 5)),
+            chunk_size=int(os.getenv("JOB_CHUNK_SIZE", 1000)),
+            pause=float(os.getenv("JOB_CHUNK_PAUSE", 0.1)),
+        )
+
+    def register(self, kind: str, handler: JobKind):
+        self.kinds[kind] = handler
+
+    # -----------------------------
+    # 起動・停止
+    # -----------------------------
+    async def start(self):
+        """テーブルを用意し、このプロセスが担当するサーバーの未完了ジョブを再開する"""
+        rows = await tracing.to_thread(self._load_active)
+        resumed = 0
+        for row in rows:
+            job = _job_from_row(row)
+            if not self._owns(job.guild_id):
+                continue
+            self._pending.setdefault(job.guild_id, set()).add(job.id)
+            self._spawn(job)
+            resumed += 1
+        if resumed:
+            print(f"🔁 未完了のジョブを {resumed} 件再開します")
+
+    def _load_active(self):
+        conn = db.connect()
+        cursor = InstrumentedCursor(conn.cursor())
+        try:
+            cursor.execute(JOBS_SCHEMA)
+            cursor.execute("UPDATE bulk_jobs SET interaction_token=NULL WHERE interaction_token IS NOT NULL")
+            cursor.execute(
+                f"SELECT {_JOB_COLUMNS} FROM bulk_jobs WHERE status IN (%s, %s) ORDER BY id",
+                ACTIVE_STATUSES
+            )
+            rows = cursor.fetchall()
+            conn.commit()
+            return rows
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _owns(self, guild_id: int) -> bool:
+        shard_ids = self.bot.shard_ids
+        if shard_ids is None:
+            return True
+        return (guild_id >> 22) % self.bot.shard_count in shard_ids
+
+    async def close(self):
+        # 実行中のジョブは running のまま残り、次回起動時に再開される
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # -----------------------------
+    # 投入
+    # -----------------------------
+    async def submit(self, interaction: discord.Interaction, kind: str,
+                     params: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """ジョブを登録してすぐに返す。応答は defer（未応答なら ephemeral で）してから進捗で上書きする"""
+        handler = self.kinds[kind]
+        guild_id = interaction.guild.id
+        if not interaction.response.is_done():
+            await interaction.response.defer(ephemeral=True, thinking=True)
+        if len(self._pending.get(guild_id, ())) >= self.max_pending:
+            await interaction.edit_original_response(
+                content=f"⏳ このサーバーでは実行待ちのジョブが {self.max_pending} 件あります。完了してから再度お試しください。"
+            )
+            return None
+
+        now = datetime.now()
+        job = Job(
+            id=0, guild_id=guild_id, kind=kind, params=params or {}, status="queued",
+            last_key=-1, processed=0, total=None, user_id=interaction.user.id,
+            channel_id=interaction.channel_id, application_id=interaction.application_id,
+            token=interaction.token, created_at=now
+        )
+        job_id = await tracing.to_thread(self._insert, job, now)
+        job = job._replace(id=job_id)
+        self._pending.setdefault(guild_id, set()).add(job_id)
+        await interaction.edit_original_response(content=f"🕒 {handler.label}を受け付けました（ジョブ #{job_id}）。")
+        self._spawn(job)
+        return job_id
+
+    def _insert(self, job: Job, now: datetime) -> int:
+        conn = db.connect()
+        cursor = InstrumentedCursor(conn.cursor())
+        try:
+            cursor.execute(
+                "INSERT INTO bulk_jobs (guild_id, kind, params, status, user_id, channel_id, "
+                "application_id, created_at, updated_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                (job.guild_id, job.kind, json.dumps(job.params), job.status, job.user_id, job.channel_id,
+                 job.application_id, now, now)
+            )
+            conn.commit()
+            return cursor.lastrowid
+        finally:
+            cursor.close()
+            conn.close()
+
+    def _spawn(self, job: Job):
+        # 投入したコマンドのトレースには含めない（ジョブは応答後も長く続く）
+        task = tracing.create_detached_task(self._run(job), name=f"job-{job.id}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # -----------------------------
+    # 実行
+    # -----------------------------
+    async def _run(self, job: Job):
+        guild_slot = self._guild_slots.setdefault(job.guild_id, asyncio.Semaphore(self.per_guild))
+        try:
+            async with guild_slot, self._slots:
+                await self._execute(job)
+        finally:
+            self._pending.get(job.guild_id, set()).discard(job.id)
+            self._last_report.pop(job.id, None)
+
+    async def _execute(self, job: Job):
+        handler = self.kinds.get(job.kind)
+        conn = await tracing.to_thread(db.connect)
+        cursor = InstrumentedCursor(conn.cursor())
+        try:
+            if handler is None:
+                await _to_thread_uncancelled(self._finish, conn, cursor, job, "failed", f"unknown job kind: {job.kind}")
+                return
+            if job.total is None:
+                total = await _to_thread_uncancelled(handler.count, cursor, job.guild_id, job.params)
+                job = job._replace(total=total)
+            job = job._replace(status="running")
+            await _to_thread_uncancelled(self._save, conn, cursor, job)
+            await self._report(job, handler)
+
+            done = False
+            while not done:
+                job, done = await _to_thread_uncancelled(self._step, conn, cursor, handler, job)
+                await self._report(job, handler)
+                if not done and self.pause:
+                    await asyncio.sleep(self.pause)
+
+            await _to_thread_uncancelled(self._finish, conn, cursor, job, "done", None)
+            await self._report(job._replace(status="done"), handler, final=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"ジョブ #{job.id} ({job.kind}) 失敗: {e}")
+            try:
+                await _to_thread_uncancelled(conn.rollback)
+                await _to_thread_uncancelled(self._finish, conn, cursor, job, "failed", str(e))
+            except Exception as inner:
+                print(f"ジョブ #{job.id} の状態更新に失敗: {inner}")
+            if handler is not None:
+                await self._report(job._replace(status="failed"), handler, final=True, error=str(e))
+        finally:
+            # ここに来た時点でスレッド側の処理は終わっている（_to_thread_uncancelled）
+            await asyncio.to_thread(self._close, conn, cursor)
+
+    def _step(self, conn, cursor, handler: JobKind, job: Job) -> Tuple[Job, bool]:
+        # チャンクの処理と進捗の保存を同じトランザクションでコミットする
+        processed, last_key, done = handler.step(cursor, job.guild_id, job.params, job.last_key, self.chunk_size)
+        job = job._replace(last_key=last_key, processed=job.processed + processed)
+        cursor.execute(
+            "UPDATE bulk_jobs SET last_key=%s, processed=%s, updated_at=%s WHERE id=%s",
+            (job.last_key, job.processed, datetime.now(), job.id)
+        )
+        conn.commit()
+        return job, done
+
+    @staticmethod
+    def _save(conn, cursor, job: Job):
+        cursor.execute(
+            "UPDATE bulk_jobs SET status=%s, total=%s, updated_at=%s WHERE id=%s",
+            (job.status, job.total, datetime.now(), job.id)
+        )
+        conn.commit()
+
+    @staticmethod
+    def _finish(conn, cursor, job: Job, status: str, error: Optional[str]):
+        now = datetime.now()
+        cursor.execute(
+            "UPDATE bulk_jobs SET status=%s, error=%s, updated_at=%s, finished_at=%s "
+            "WHERE id=%s",
+            (status, error, now, now, job.id)
+        )
+        conn.commit()
+
+    @staticmethod
+    def _close(conn, cursor):
+        cursor.close()
+        conn.close()
+
+    # -----------------------------
+    # 進捗表示
+    # -----------------------------
+    @staticmethod
+    def _format(job: Job, handler: JobKind, error: Optional[str]) -> str:
+        if job.status == "done":
+            return f"✅ {handler.label}が完了しました（ジョブ #{job.id}・{job.processed:,} 件）。"
+        if job.status == "failed":
+            return f"❌ {handler.label}に失敗しました（ジョブ #{job.id}・{job.processed:,} 件処理済み）: {error}"
+        if job.total:
+            percent = min(100, job.processed * 100 // job.total)
+            return f"⏳ {handler.label}を実行中…（ジョブ #{job.id}・{job.processed:,}/{job.total:,} 件・{percent}%）"
+        return f"⏳ {handler.label}を実行中…（ジョブ #{job.id}・{job.processed:,} 件）"
+
+    async def _report(self, job: Job, handler: JobKind, final: bool = False, error: Optional[str] = None):
+        now = time.monotonic()
+        if not final and now - self._last_report.get(job.id, 0.0) < PROGRESS_INTERVAL:
+            return
+        self._last_report[job.id] = now
+        content = self._format(job, handler, error)
+
+        if job.token and datetime.now() - job.created_at < TOKEN_LIFETIME:
+            try:
+                webhook = discord.Webhook.partial(job.application_id, job.token, client=self.bot)
+                await webhook.edit_message("@original", content=content)
+                return
+            except discord.HTTPException as e:
+                print(f"ジョブ #{job.id} の進捗を更新できません: {e}")
+
+        # トークンが切れている・再起動で失われたときは、結果だけ実行者宛てにチャンネルへ送る
+        if final and job.channel_id:
+            channel = self.bot.get_channel(job.channel_id)
+            if channel is not None:
+                try:
+                    await channel.send(f"<@{job.user_id}> {content}",
+                                       allowed_mentions=discord.AllowedMentions(users=True))
+                except discord.HTTPException as e:
+                    print(f"ジョブ #{job.id} の結果を送信できません: {e}")
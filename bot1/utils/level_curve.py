@@ -0,0 +1,149 @@
+import bisect
+import functools
+import json
+from typing import List, NamedTuple, Optional, Tuple
+
+from utils import db
+from utils.metrics import InstrumentedCursor
+
+# 計算するレベルの上限（閾値テーブルの行数）
+MAX_LEVEL = 1000
+# 再計算で1回の UPDATE が触る行数（ロックを長く持たないように分割する）
+RECALC_CHUNK_SIZE = 5000
+
+CURVE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS level_curves (
+        guild_id BIGINT PRIMARY KEY,
+        kind VARCHAR(16) NOT NULL,
+        base DOUBLE NOT NULL DEFAULT 1,
+        exponent DOUBLE NOT NULL DEFAULT 4,
+        thresholds TEXT NULL,
+        updated_at DATETIME NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS level_thresholds (
+        guild_id BIGINT NOT NULL,
+        level INT NOT NULL,
+        min_xp BIGINT NOT NULL,
+        PRIMARY KEY (guild_id, level),
+        INDEX idx_level_thresholds_xp (guild_id, min_xp)
+    )
+    """,
+]
+
+
+class LevelCurve(NamedTuple):
+    """XP -> レベルの対応。thresholds[i] がレベル i+1 に必要な累計XP
+
+    kind:
+      power  レベル L の閾値 = base * L ** exponent（既定の base=1, exponent=4 は従来の xp ** (1/4)）
+      custom 管理者が指定した閾値の列
+    """
+    kind: str
+    base: float
+    exponent: float
+    thresholds: Tuple[int, ...]
+
+    def level_for(self, xp: int) -> int:
+        # 浮動小数の累乗根ではなく整数の閾値を二分探索する（最低レベルは1）
+        return max(1, bisect.bisect_right(self.thresholds, xp))
+
+    def describe(self) -> str:
+        if self.kind == "custom":
+            return f"カスタム（{len(self.thresholds)} レベル）"
+        return f"{self.base:g} × レベル^{self.exponent:g}"
+
+
+@functools.lru_cache(maxsize=64)
+def power_curve(base: float = 1.0, exponent: float = 4.0) -> LevelCurve:
+    thresholds = [int(round(base * level ** exponent)) for level in range(1, MAX_LEVEL + 1)]
+    for i in range(1, len(thresholds)):
+        # 丸めで同じ値が並ばないよう単調増加にする
+        thresholds[i] = max(thresholds[i], thresholds[i - 1] + 1)
+    if thresholds[-1] >= 2 ** 63:
+        raise ValueError("最大レベルの必要XPが大きすぎます。")
+    return LevelCurve("power", base, exponent, tuple(thresholds))
+
+
+def custom_curve(values: List[int]) -> LevelCurve:
+    """レベル2以降に必要な累計XPの列からカーブを作る"""
+    if not values:
+        raise ValueError("閾値を1つ以上指定してください。")
+    if len(values) >= MAX_LEVEL:
+        raise ValueError(f"閾値は {MAX_LEVEL - 1} 個までです。")
+    if any(v <= 0 for v in values) or any(b <= a for a, b in zip(values, values[1:])):
+        raise ValueError("閾値は正の数で、小さい順に並べてください。")
+    return LevelCurve("custom", 1.0, 1.0, (0, *values))
+
+
+DEFAULT_CURVE = power_curve()
+
+
+def curve_from_row(kind: str, base: float, exponent: float, thresholds: Optional[str]) -> LevelCurve:
+    if kind == "custom" and thresholds:
+        return custom_curve(json.loads(thresholds)[1:])
+    return power_curve(base, exponent)
+
+
+def save_curve(cursor, guild_id: int, curve: LevelCurve, now):
+    cursor.execute(
+        """
+        INSERT INTO level_curves (guild_id, kind, base, exponent, thresholds, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE kind=VALUES(kind), base=VALUES(base), exponent=VALUES(exponent),
+            thresholds=VALUES(thresholds), updated_at=VALUES(updated_at)
+        """,
+        (guild_id, curve.kind, curve.base, curve.exponent,
+         json.dumps(curve.thresholds) if curve.kind == "custom" else None, now)
+    )
+
+
+def recalculate_levels(guild_id: int, curve: LevelCurve, chunk_size: int = RECALC_CHUNK_SIZE) -> int:
+    """サーバーの全ユーザーのレベルをカーブから再計算する（ブロッキング）
+
+    閾値を level_thresholds に書き出し、user_id の範囲ごとに
+    「閾値以下の行数 = レベル」を相関サブクエリで求める集合演算の UPDATE を流す。
+    行ごとの読み書きは発生しない。変更された行数を返す。
+    """
+    conn = db.connect()
+    cursor = InstrumentedCursor(conn.cursor())
+    try:
+        cursor.execute("DELETE FROM level_thresholds WHERE guild_id=%s", (guild_id,))
+        cursor.executemany(
+            "INSERT INTO level_thresholds (guild_id, level, min_xp) VALUES (%s, %s, %s)",
+            [(guild_id, level, min_xp) for level, min_xp in enumerate(curve.thresholds, 1)]
+        )
+        conn.commit()
+
+        changed = 0
+        last_user_id = -1
+        while True:
+            # このチャンクの末尾の user_id（PK 順に区切る）
+            cursor.execute(
+                "SELECT user_id FROM user_levels WHERE guild_id=%s AND user_id>%s "
+                "ORDER BY user_id LIMIT 1 OFFSET %s",
+                (guild_id, last_user_id, chunk_size - 1)
+            )
+            row = cursor.fetchone()
+            upper = row[0] if row else None
+            cursor.execute(
+                """
+                UPDATE user_levels u
+                SET u.level = GREATEST(1, (
+                    SELECT COUNT(*) FROM level_thresholds t
+                    WHERE t.guild_id = u.guild_id AND t.min_xp <= u.xp
+                ))
+                WHERE u.guild_id=%s AND u.user_id>%s
+                """ + ("AND u.user_id<=%s" if upper is not None else ""),
+                (guild_id, last_user_id, upper) if upper is not None else (guild_id, last_user_id)
+            )
+            changed += cursor.rowcount
+            conn.commit()
+            if upper is None:
+                return changed
+            last_user_id = upper
+    finally:
+        cursor.close()
+        conn.close()
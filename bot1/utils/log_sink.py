@@ -0,0 +1,108 @@
+import asyncio
+import mysql.connector
+from typing import Any, Callable, List, Optional, Sequence
+
+from utils import db
+from utils.metrics import InstrumentedCursor
+
+
+class BatchLogSink:
+    """ログ行をまとめて executemany で書き込む非同期シンク
+
+    put() した行はキューにため、最初の1行が届いてから interval 秒分をまとめて
+    1トランザクションで INSERT する。キューが満杯のときは put() が空きを待つ
+    （バックプレッシャ）。close() で残りをすべて書き出してから接続を閉じる。
+    """
+
+    def __init__(
+        self,
+        statement: str,
+        *,
+        interval: float = 1.0,
+        batch_size: int = 500,
+        max_queue: int = 10000,
+        on_flush: Optional[Callable[[Any, List[Sequence[Any]]], None]] = None
+    ):
+        self.statement = statement
+        self.interval = interval
+        self.batch_size = batch_size
+        # 同じトランザクション内で呼ばれる追加処理 (cursor, rows)
+        self.on_flush = on_flush
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._buffer: List[Sequence[Any]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._writing: Optional[asyncio.Future] = None
+        self._conn = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, row: Sequence[Any]):
+        await self.queue.put(row)
+
+    async def close(self):
+        """書き込みループを止め、未書き込みの行をすべて書き出す"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writing and not self._writing.done():
+            await asyncio.wait([self._writing])
+        self._drain()
+        await self._flush()
+        if self._conn:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+    # -----------------------------
+    # 内部処理
+    # -----------------------------
+    def _drain(self):
+        while not self.queue.empty():
+            self._buffer.append(self.queue.get_nowait())
+
+    async def _run(self):
+        while True:
+            self._buffer.append(await self.queue.get())
+            # interval 秒の間に届いた行をまとめて1回で書き込む
+            await asyncio.sleep(self.interval)
+            self._drain()
+            try:
+                await self._flush()
+            except Exception as e:
+                # ループが止まるとキューが埋まり、put を待つリスナーまで止まるので続ける
+                print(f"ログ書き込みループのエラー: {e!r}")
+
+    async def _flush(self):
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        # キャンセルされても書き込み自体は完了させる
+        self._writing = asyncio.ensure_future(asyncio.to_thread(self._write, rows))
+        await asyncio.shield(self._writing)
+
+    def _write(self, rows: List[Sequence[Any]]):
+        try:
+            if self._conn is None or not self._conn.is_connected():
+                self._conn = db.connect()
+            cursor = InstrumentedCursor(self._conn.cursor())
+            try:
+                for i in range(0, len(rows), self.batch_size):
+                    cursor.executemany(self.statement, rows[i:i + self.batch_size])
+                if self.on_flush:
+                    self.on_flush(cursor, rows)
+                self._conn.commit()
+            finally:
+                cursor.close()
+        except Exception as err:
+            # on_flush の不具合なども含め、途中まで流した行は次の commit に混ざらないよう戻す
+            print(f"ログ書き込みエラー（{len(rows)}件を破棄）: {err!r}")
+            try:
+                if self._conn and self._conn.is_connected():
+                    self._conn.rollback()
+            except mysql.connector.Error:
+                pass
@@ -0,0 +1,95 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from utils.metrics import Histogram
+
+# ループ遅延のバケット境界（秒）
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LoopMonitor:
+    """イベントループの遅延を常時計測し、長くブロックしたコードのスタックを記録する
+
+    ループ内のプローブが interval ごとに sleep して「予定より何秒遅れて起きたか」を
+    ヒストグラムに記録する。別スレッドのウォッチドッグはプローブの最終時刻を監視し、
+    threshold 秒以上更新がなければループスレッドのスタックと実行中のタスクを出力する。
+    """
+
+    def __init__(self, interval: float = 0.25, threshold: float = 0.5, stack_limit: int = 15):
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_limit = stack_limit
+        self.histogram = Histogram(LAG_BUCKETS)
+        self.last_lag = 0.0
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._probe())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            self._beat = time.monotonic()
+            self.last_lag = lag
+            self.histogram.observe(lag)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            # 最後の鼓動の後はプローブが interval だけ sleep するので、その分は遅れに含めない
+            stalled = time.monotonic() - beat - self.interval
+            # 同じブロックについては1回だけ報告する
+            if stalled < self.threshold or reported_beat == beat:
+                continue
+            reported_beat = beat
+            self.stalls += 1
+            self._report(stalled)
+
+    def _report(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        task = asyncio.current_task(self._loop) if self._loop else None
+        if task is not None:
+            coro = task.get_coro()
+            where = f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+        else:
+            where = "タスク外のコールバック"
+        stack = "".join(traceback.format_stack(frame, limit=self.stack_limit)) if frame else "（スタック取得不可）\n"
+        print(f"🐢 イベントループが {stalled * 1000:.0f}ms 以上ブロックされています: {where}\n{stack}", end="")
+
+    def summary(self) -> dict:
+        h = self.histogram
+        return {
+            "last_ms": round(self.last_lag * 1000, 2),
+            "p50_ms": round((h.percentile(0.5) or 0) * 1000, 2),
+            "p99_ms": round((h.percentile(0.99) or 0) * 1000, 2),
+            "max_ms": round(h.max * 1000, 2),
+            "stalls": self.stalls,
+        }
@@ -0,0 +1,77 @@
+from datetime import datetime
+from typing import Any, Dict, List, Sequence, Tuple
+
+# 集計粒度 -> ロールアップテーブル
+ROLLUP_TABLES = {
+    "hour": "member_stats_hourly",
+    "day": "member_stats_daily",
+}
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    guild_id BIGINT NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    joins INT NOT NULL DEFAULT 0,
+    leaves INT NOT NULL DEFAULT 0,
+    member_count INT NULL,
+    last_event_at DATETIME(6) NULL,
+    PRIMARY KEY (guild_id, bucket_start)
+)
+"""
+
+# 期間末のメンバー数は、より新しいイベントのものだけで上書きする
+_UPSERT = """
+INSERT INTO {table} (guild_id, bucket_start, joins, leaves, member_count, last_event_at)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    joins = joins + VALUES(joins),
+    leaves = leaves + VALUES(leaves),
+    member_count = IF(last_event_at IS NULL OR VALUES(last_event_at) >= last_event_at, VALUES(member_count), member_count),
+    last_event_at = GREATEST(COALESCE(last_event_at, VALUES(last_event_at)), VALUES(last_event_at))
+"""
+
+
+def ensure_schema(cursor):
+    """ロールアップテーブルがなければ作成する"""
+    for table in ROLLUP_TABLES.values():
+        cursor.execute(_CREATE_TABLE.format(table=table))
+
+
+def bucket_start(at: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class MemberStatsRollup:
+    """参加/退出ログのバッチから時間別・日別ロールアップを差分更新する
+
+    BatchLogSink の on_flush に渡し、ログの INSERT と同じトランザクションで
+    (guild_id, member_id, at, member_count) の行を集計して UPSERT する。
+    """
+
+    def __init__(self, kind: str):
+        if kind not in ("join", "leave"):
+            raise ValueError(f"unknown kind: {kind}")
+        self.kind = kind
+
+    def __call__(self, cursor, rows: List[Sequence[Any]]):
+        for granularity, table in ROLLUP_TABLES.items():
+            # (guild_id, bucket) -> [件数, 最新のメンバー数, 最新のイベント時刻]
+            buckets: Dict[Tuple[int, datetime], list] = {}
+            for guild_id, _member_id, at, member_count in rows:
+                key = (guild_id, bucket_start(at, granularity))
+                entry = buckets.get(key)
+                if entry is None:
+                    buckets[key] = [1, member_count, at]
+                else:
+                    entry[0] += 1
+                    if at >= entry[2]:
+                        entry[1] = member_count
+                        entry[2] = at
+
+            params = []
+            for (guild_id, start), (count, member_count, last_at) in buckets.items():
+                joins, leaves = (count, 0) if self.kind == "join" else (0, count)
+                params.append((guild_id, start, joins, leaves, member_count, last_at))
+            cursor.executemany(_UPSERT.format(table=table), params)
@@ -0,0 +1,80 @@
+import asyncio
+import discord
+import os
+from typing import Dict, Iterable, Optional
+
+# query_members(user_ids=...) で一度に問い合わせられる上限
+QUERY_BATCH_SIZE = 100
+# REST へのフォールバックで同時に投げる fetch_member の数
+FETCH_CONCURRENCY = 5
+
+CACHE_POLICIES = {
+    "none": discord.MemberCacheFlags.none,
+    "all": discord.MemberCacheFlags.all,
+}
+
+
+def member_cache_flags_from_env() -> discord.MemberCacheFlags:
+    """MEMBER_CACHE_POLICY からメンバーキャッシュの方針を作る
+
+    "none" / "all"、または "voice" と "joined" のカンマ区切り。既定の "voice" は
+    VC に入っているメンバーだけを保持する（tempvoice / vcmove が channel.members を使うため）。
+    """
+    policy = os.getenv("MEMBER_CACHE_POLICY", "voice").strip().lower()
+    if policy in CACHE_POLICIES:
+        return CACHE_POLICIES[policy]()
+    flags = discord.MemberCacheFlags.none()
+    for name in (p.strip() for p in policy.split(",") if p.strip()):
+        if name not in ("voice", "joined"):
+            raise ValueError(f"不明な MEMBER_CACHE_POLICY: {name}")
+        setattr(flags, name, True)
+    return flags
+
+
+async def resolve_members(guild: discord.Guild, user_ids: Iterable[int]) -> Dict[int, discord.Member]:
+    """キャッシュに無いメンバーだけをまとめて取得する
+
+    まず guild.get_member、残りは100件ずつ query_members（ゲートウェイ）で問い合わせ、
+    ゲートウェイで問い合わせられなかった分は fetch_member（REST）で取りに行く。取得したメンバーは
+    キャッシュ方針を崩さないようキャッシュには入れない。サーバーにいない ID は結果に含まれない。
+    """
+    found: Dict[int, discord.Member] = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        member = guild.get_member(user_id)
+        if member is not None:
+            found[user_id] = member
+        else:
+            missing.append(user_id)
+
+    remaining = []
+    for i in range(0, len(missing), QUERY_BATCH_SIZE):
+        batch = missing[i:i + QUERY_BATCH_SIZE]
+        try:
+            members = await guild.query_members(user_ids=batch, limit=len(batch), cache=False)
+        except (asyncio.TimeoutError, discord.ClientException):
+            # members intent が無い・ゲートウェイが応答しないときは REST に任せる
+            remaining = missing[i:]
+            break
+        for member in members:
+            found[member.id] = member
+
+    if remaining:
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def fetch(user_id: int) -> Optional[discord.Member]:
+            async with semaphore:
+                try:
+                    return await guild.fetch_member(user_id)
+                except discord.NotFound:
+                    return None
+
+        for member in await asyncio.gather(*(fetch(user_id) for user_id in remaining)):
+            if member is not None:
+                found[member.id] = member
+    return found
+
+
+async def resolve_member(guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+    """1人分の resolve_members"""
+    return (await resolve_members(guild, [user_id])).get(user_id)
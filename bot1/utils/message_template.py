@@ -0,0 +1,36 @@
+import re
+from typing import Dict, Iterable, List, Tuple
+
+# {name} 形式のプレースホルダ
+_PLACEHOLDER_RE = re.compile(r"\{([a-z_]+)\}")
+
+
+class MessageTemplate:
+    """プレースホルダを事前に分解済みのメッセージテンプレート
+
+    登録時に一度だけ文字列を (プレースホルダか, 文字列) のセグメント列に分解し、
+    送信時は1パスで連結するだけにする。未知の {xxx} はそのまま文字として残す。
+    """
+
+    __slots__ = ("source", "segments")
+
+    def __init__(self, source: str, placeholders: Iterable[str]):
+        self.source = source
+        allowed = frozenset(placeholders)
+        segments: List[Tuple[bool, str]] = []
+        pos = 0
+        for match in _PLACEHOLDER_RE.finditer(source):
+            name = match.group(1)
+            if name not in allowed:
+                continue
+            if match.start() > pos:
+                segments.append((False, source[pos:match.start()]))
+            segments.append((True, name))
+            pos = match.end()
+        if pos < len(source):
+            segments.append((False, source[pos:]))
+        self.segments = tuple(segments)
+
+    def render(self, values: Dict[str, str]) -> str:
+        """values でプレースホルダを埋めた文字列を返す"""
+        return "".join(values[text] if is_key else text for is_key, text in self.segments)
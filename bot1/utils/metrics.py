@@ -0,0 +1,158 @@
+import bisect
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils import tracing
+
+# 既定のバケット境界（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """固定バケットのヒストグラム（Prometheus の histogram と同じ上限値方式）
+
+    observe() はバケット探索と加算だけなので、ホットパスで呼んでも軽い。
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        # 最後の要素は +Inf バケット
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> Optional[float]:
+        """q (0-1) パーセンタイルの推定値（バケット内は線形補間）"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                fraction = (rank - cumulative) / n
+                return min(lower + (upper - lower) * fraction, self.max)
+            cumulative += n
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def cumulative_counts(self) -> List[int]:
+        total = 0
+        result = []
+        for n in self.counts:
+            total += n
+            result.append(total)
+        return result
+
+
+def sql_label(query: str, limit: int = 120) -> str:
+    """SQL 文をメトリクスのラベル用に1行へ正規化する（パラメータは %s のまま）"""
+    label = " ".join(query.split())
+    return label if len(label) <= limit else label[:limit - 1] + "…"
+
+
+class MetricsRegistry:
+    """種類（command / listener / sql）と名前ごとのレイテンシ・エラー数
+
+    SQL はスレッド内から記録されるのでロックで保護する。
+    """
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.errors: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False):
+        key = (kind, name)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.bounds)
+            histogram.observe(seconds)
+            if error:
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Web サービスへ送る JSON 形式のスナップショット"""
+        with self._lock:
+            series = [
+                {
+                    "kind": kind,
+                    "name": name,
+                    "counts": list(histogram.counts),
+                    "sum": histogram.sum,
+                    "count": histogram.count,
+                    "errors": self.errors.get((kind, name), 0),
+                }
+                for (kind, name), histogram in self.histograms.items()
+            ]
+        return {"buckets": list(self.bounds), "series": series}
+
+    def summary(self, kind: str) -> List[Dict[str, Any]]:
+        """指定した種類の (name, count, errors, p50, p95, p99) を p95 の降順で返す"""
+        with self._lock:
+            rows = [
+                {
+                    "name": name,
+                    "count": histogram.count,
+                    "errors": self.errors.get((k, name), 0),
+                    "p50": histogram.percentile(0.5),
+                    "p95": histogram.percentile(0.95),
+                    "p99": histogram.percentile(0.99),
+                }
+                for (k, name), histogram in self.histograms.items()
+                if k == kind
+            ]
+        rows.sort(key=lambda row: row["p95"] or 0, reverse=True)
+        return rows
+
+
+registry = MetricsRegistry()
+
+
+class InstrumentedCursor:
+    """execute / executemany の所要時間を SQL 文ごとに記録するカーソルのラッパー"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, method, query, args, kwargs):
+        label = sql_label(query)
+        started = time.perf_counter()
+        error = False
+        try:
+            with tracing.tracer.child_span("db.query", kind="CLIENT", sql=label):
+                return method(query, *args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            registry.observe("sql", label, time.perf_counter() - started, error)
+
+    def execute(self, query, *args, **kwargs):
+        return self._timed(self._cursor.execute, query, args, kwargs)
+
+    def executemany(self, query, *args, **kwargs):
+        return self._timed(self._cursor.executemany, query, args, kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
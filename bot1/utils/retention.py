@@ -0,0 +1,317 @@
+import gzip
+import json
+import mysql.connector
+import os
+import re
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from utils import db
+
+# 月別パーティション名（pYYYYMM はその月の行を持つ）
+_PARTITION_RE = re.compile(r"^p(\d{4})(\d{2})$")
+
+
+class RetentionPolicy(NamedTuple):
+    table: str
+    time_column: str
+    days: int
+    key_column: str = "id"
+    # True のときは月別 RANGE パーティションで管理し、期限切れの月を丸ごと DROP する
+    partition: bool = False
+    archive: bool = True
+
+
+# 既定の保持期間。RETENTION_DAYS_<TABLE> 環境変数で上書きでき、0 で無効になる
+DEFAULT_POLICIES = [
+    RetentionPolicy("welcome_logs", "joined_at", 180, partition=True),
+    RetentionPolicy("leave_logs", "left_at", 180, partition=True),
+    # 論理削除済みの設定は deleted_at から数える（有効な設定は deleted_at が NULL なので対象外）
+    RetentionPolicy("welcome_settings", "deleted_at", 30),
+    RetentionPolicy("leave_settings", "deleted_at", 30),
+]
+
+
+def load_policies() -> List[RetentionPolicy]:
+    policies = []
+    for policy in DEFAULT_POLICIES:
+        days = int(os.getenv(f"RETENTION_DAYS_{policy.table.upper()}", policy.days))
+        if days > 0:
+            policies.append(policy._replace(days=days))
+    return policies
+
+
+def _month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def _next_month(d: date) -> date:
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+class ArchiveWriter:
+    """期限切れの行を <base>/<table>/<YYYY-MM>.jsonl.gz に追記する
+
+    アーカイブした後の DELETE / DROP が失敗すると、次回に同じ行をもう一度書くことになる。
+    書いたがまだ削除を確認していない分（直前のチャンクのキー、またはパーティション名）だけを
+    <table>/pending.json に残し、次回はそれと重なる行を飛ばす。
+    """
+
+    def __init__(self, base_dir: str, table: str, time_column: str, key_column: str):
+        self.dir = os.path.join(base_dir, table)
+        self.time_column = time_column
+        self.key_column = key_column
+        self._files: Dict[str, Any] = {}
+        self._pending_path = os.path.join(self.dir, "pending.json")
+        self._pending_keys: Set[str] = set()
+        self._pending_partition: Optional[str] = None
+        try:
+            with open(self._pending_path, encoding="utf-8") as f:
+                pending = json.load(f)
+            self._pending_keys = set(pending.get("keys", ()))
+            self._pending_partition = pending.get("partition")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"アーカイブの未確認分を読めません（{self._pending_path}）: {e}")
+
+    def write(self, rows: List[Dict[str, Any]]):
+        for row in rows:
+            if self._pending_keys and _archive_key(row.get(self.key_column)) in self._pending_keys:
+                continue
+            at = row.get(self.time_column)
+            month = at.strftime("%Y-%m") if isinstance(at, (date, datetime)) else "unknown"
+            f = self._files.get(month)
+            if f is None:
+                os.makedirs(self.dir, exist_ok=True)
+                # 追記モードの gzip は複数メンバーになるが、そのまま gzip -dc で読める
+                f = gzip.open(os.path.join(self.dir, f"{month}.jsonl.gz"), "at", encoding="utf-8")
+                self._files[month] = f
+            f.write(json.dumps(row, default=str, ensure_ascii=False) + "\n")
+        # 削除より先に確実にディスクへ書き出す
+        for f in self._files.values():
+            f.flush()
+
+    def partition_archived(self, name: str) -> bool:
+        """前回アーカイブ済みで DROP だけ失敗したパーティションか"""
+        return self._pending_partition == name
+
+    def mark_pending(self, rows: List[Dict[str, Any]] = (), partition: Optional[str] = None):
+        """書き出した分を、削除を確認するまで記録する（書き出しの後・削除の前に呼ぶ）"""
+        keys = [_archive_key(row.get(self.key_column)) for row in rows]
+        self._save_pending({"keys": keys, "partition": partition})
+        self._pending_keys = set(keys)
+        self._pending_partition = partition
+
+    def confirm(self):
+        """削除をコミットしたら呼ぶ"""
+        if self._pending_keys or self._pending_partition:
+            self._save_pending({"keys": [], "partition": None})
+        self._pending_keys = set()
+        self._pending_partition = None
+
+    def _save_pending(self, pending: Dict[str, Any]):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self._pending_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(pending, f)
+        os.replace(tmp, self._pending_path)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+def _archive_key(value: Any) -> str:
+    # JSON に書いて読み戻した値と比べられるよう、書き出すときと同じ形にそろえる
+    return json.dumps(value, default=str)
+
+
+class RetentionRunner:
+    """保持期間を過ぎた行をアーカイブしてから削除する（ブロッキング、スレッドで実行）"""
+
+    def __init__(self, policies: List[RetentionPolicy], archive_dir: str, chunk_size: int = 1000, pause: float = 0.2):
+        self.policies = policies
+        self.archive_dir = archive_dir
+        self.chunk_size = chunk_size
+        self.pause = pause
+        # パーティション化に失敗したテーブル（以降はチャンク削除にフォールバック）
+        self._partition_unavailable = set()
+
+    def run(self) -> Dict[str, int]:
+        """全ポリシーを処理し、テーブルごとの削除件数を返す"""
+        results = {}
+        conn = db.connect()
+        try:
+            for policy in self.policies:
+                try:
+                    results[policy.table] = self._apply(conn, policy)
+                except mysql.connector.Error as err:
+                    print(f"保持期間処理エラー ({policy.table}): {err}")
+                    conn.rollback()
+        finally:
+            conn.close()
+        return results
+
+    def _apply(self, conn, policy: RetentionPolicy) -> int:
+        cutoff = datetime.now() - timedelta(days=policy.days)
+        archive = ArchiveWriter(self.archive_dir, policy.table, policy.time_column, policy.key_column) if policy.archive else None
+        try:
+            if policy.partition and policy.table not in self._partition_unavailable:
+                partitions = self._ensure_partitions(conn, policy)
+                if partitions is not None:
+                    return self._drop_expired_partitions(conn, policy, partitions, cutoff, archive)
+            return self._delete_chunked(conn, policy, cutoff, archive)
+        finally:
+            if archive:
+                archive.close()
+
+    # -----------------------------
+    # チャンク削除（パーティションが使えない場合）
+    # -----------------------------
+    def _delete_chunked(self, conn, policy: RetentionPolicy, cutoff: datetime, archive: Optional[ArchiveWriter]) -> int:
+        cursor = conn.cursor(dictionary=True)
+        deleted = 0
+        try:
+            while True:
+                cursor.execute(
+                    f"SELECT * FROM {policy.table} WHERE {policy.time_column} < %s "
+                    f"ORDER BY {policy.key_column} LIMIT %s",
+                    (cutoff, self.chunk_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                if archive:
+                    archive.write(rows)
+                    archive.mark_pending(rows)
+                keys = [row[policy.key_column] for row in rows]
+                placeholders = ", ".join(["%s"] * len(keys))
+                cursor.execute(f"DELETE FROM {policy.table} WHERE {policy.key_column} IN ({placeholders})", keys)
+                conn.commit()
+                if archive:
+                    archive.confirm()
+                deleted += len(rows)
+                if len(rows) < self.chunk_size:
+                    break
+                # 他のクエリにロックを譲る
+                time.sleep(self.pause)
+        finally:
+            cursor.close()
+        return deleted
+
+    # -----------------------------
+    # 月別パーティション
+    # -----------------------------
+    def _list_partitions(self, cursor, table: str) -> List[str]:
+        cursor.execute(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION",
+            (table,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def _partition_clause(month: date) -> str:
+        return f"PARTITION p{month.strftime('%Y%m')} VALUES LESS THAN (TO_DAYS('{_next_month(month).isoformat()}'))"
+
+    def _ensure_partitions(self, conn, policy: RetentionPolicy) -> Optional[List[str]]:
+        """月別パーティションを用意し、パーティション名一覧を返す。使えない場合は None"""
+        cursor = conn.cursor()
+        try:
+            partitions = self._list_partitions(cursor, policy.table)
+            this_month = _month_start(date.today())
+            # 来月分までは常に用意しておく
+            upto = _next_month(this_month)
+
+            if not partitions:
+                cursor.execute(f"SELECT MIN({policy.time_column}) FROM {policy.table}")
+                oldest = cursor.fetchone()[0]
+                month = _month_start(oldest.date()) if oldest else this_month
+                clauses = []
+                while month <= upto:
+                    clauses.append(self._partition_clause(month))
+                    month = _next_month(month)
+                clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+                try:
+                    cursor.execute(
+                        f"ALTER TABLE {policy.table} PARTITION BY RANGE (TO_DAYS({policy.time_column})) "
+                        f"({', '.join(clauses)})"
+                    )
+                except mysql.connector.Error as err:
+                    # 主キーに時刻列が含まれない等でパーティション化できない
+                    print(f"{policy.table} をパーティション化できないため、チャンク削除で処理します: {err}")
+                    self._partition_unavailable.add(policy.table)
+                    return None
+                return self._list_partitions(cursor, policy.table)
+
+            months = [m for m in (_PARTITION_RE.match(name) for name in partitions) if m]
+            if "pmax" not in partitions or not months:
+                # 想定外のパーティション構成には手を出さない
+                self._partition_unavailable.add(policy.table)
+                return None
+
+            last = date(int(months[-1].group(1)), int(months[-1].group(2)), 1)
+            clauses = []
+            month = _next_month(last)
+            while month <= upto:
+                clauses.append(self._partition_clause(month))
+                month = _next_month(month)
+            if clauses:
+                clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+                cursor.execute(f"ALTER TABLE {policy.table} REORGANIZE PARTITION pmax INTO ({', '.join(clauses)})")
+                partitions = self._list_partitions(cursor, policy.table)
+            return partitions
+        finally:
+            cursor.close()
+
+    def _drop_expired_partitions(
+        self, conn, policy: RetentionPolicy, partitions: List[str], cutoff: datetime, archive: Optional[ArchiveWriter]
+    ) -> int:
+        """月全体が保持期間を過ぎたパーティションをアーカイブして DROP する"""
+        dropped = 0
+        cursor = conn.cursor(dictionary=True)
+        try:
+            for name in partitions:
+                match = _PARTITION_RE.match(name)
+                if not match:
+                    continue
+                month = date(int(match.group(1)), int(match.group(2)), 1)
+                if datetime.combine(_next_month(month), datetime.min.time()) > cutoff:
+                    break
+                # 前回アーカイブまで済んで DROP できなかった月は、書き直さずに DROP する
+                if archive is None or archive.partition_archived(name):
+                    cursor.execute(f"SELECT COUNT(*) AS n FROM {policy.table} PARTITION ({name})")
+                    dropped += cursor.fetchone()["n"]
+                    cursor.execute(f"ALTER TABLE {policy.table} DROP PARTITION {name}")
+                    if archive:
+                        archive.confirm()
+                    continue
+                last_key = None
+                while True:
+                    if last_key is None:
+                        cursor.execute(
+                            f"SELECT * FROM {policy.table} PARTITION ({name}) ORDER BY {policy.key_column} LIMIT %s",
+                            (self.chunk_size,)
+                        )
+                    else:
+                        cursor.execute(
+                            f"SELECT * FROM {policy.table} PARTITION ({name}) WHERE {policy.key_column} > %s "
+                            f"ORDER BY {policy.key_column} LIMIT %s",
+                            (last_key, self.chunk_size)
+                        )
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    archive.write(rows)
+                    dropped += len(rows)
+                    last_key = rows[-1][policy.key_column]
+                archive.mark_pending(partition=name)
+                cursor.execute(f"ALTER TABLE {policy.table} DROP PARTITION {name}")
+                archive.confirm()
+        finally:
+            cursor.close()
+        return dropped
@@ -0,0 +1,132 @@
+import math
+import struct
+import zlib
+from array import array
+from typing import Dict, List, Tuple
+
+_MASK64 = (1 << 64) - 1
+
+
+def hash64(value: int, seed: int = 0) -> int:
+    """整数の 64bit ハッシュ（splitmix64）。プロセスをまたいでも同じ値になる"""
+    z = (value + 0x9E3779B97F4A7C15 * (seed + 1)) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+
+class HyperLogLog:
+    """ユニーク数の推定（2^p バイト、標準誤差 およそ 1.04 / sqrt(2^p)）"""
+    __slots__ = ("p", "registers")
+
+    def __init__(self, p: int = 10, registers: bytes = None):
+        self.p = p
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << p)
+
+    def add(self, value: int):
+        h = hash64(value)
+        index = h >> (64 - self.p)
+        rest = (h << self.p) & _MASK64
+        # 残りのビットの先頭から数えた 0 の個数 + 1
+        rank = 64 - rest.bit_length() + 1 if rest else 64 - self.p + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        if other.p != self.p:
+            raise ValueError("精度の違う HyperLogLog は併合できません。")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # 少ないうちは線形カウンティングの方が正確
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(bytes([self.p]) + bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        raw = zlib.decompress(data)
+        return cls(raw[0], raw[1:])
+
+
+class CountMinSketch:
+    """キーごとの件数の推定（過大評価のみ）と、上位候補の保持
+
+    表だけでは「誰が多いか」を列挙できないので、推定値の大きいキーを
+    最大 top 件だけ候補として一緒に持つ。
+    """
+    __slots__ = ("width", "depth", "top", "table", "candidates")
+
+    def __init__(self, width: int = 256, depth: int = 4, top: int = 20):
+        self.width = width
+        self.depth = depth
+        self.top = top
+        self.table = array("I", bytes(4 * width * depth))
+        # キー -> 推定値
+        self.candidates: Dict[int, int] = {}
+
+    def _cells(self, key: int) -> List[int]:
+        width = self.width
+        return [row * width + hash64(key, row + 1) % width for row in range(self.depth)]
+
+    def add(self, key: int, count: int = 1) -> int:
+        table = self.table
+        estimate = None
+        for cell in self._cells(key):
+            table[cell] += count
+            value = table[cell]
+            if estimate is None or value < estimate:
+                estimate = value
+        self._offer(key, estimate)
+        return estimate
+
+    def estimate(self, key: int) -> int:
+        return min(self.table[cell] for cell in self._cells(key))
+
+    def _offer(self, key: int, estimate: int):
+        candidates = self.candidates
+        if key in candidates or len(candidates) < self.top:
+            candidates[key] = estimate
+            return
+        smallest = min(candidates, key=candidates.get)
+        if estimate > candidates[smallest]:
+            del candidates[smallest]
+            candidates[key] = estimate
+
+    def merge(self, other: "CountMinSketch"):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("大きさの違う Count-Min Sketch は併合できません。")
+        self.table = array("I", map(int.__add__, self.table, other.table))
+        # 候補は併合後の表で推定し直す
+        keys = set(self.candidates) | set(other.candidates)
+        self.candidates = {}
+        for key in keys:
+            self._offer(key, self.estimate(key))
+
+    def heavy_hitters(self, n: int) -> List[Tuple[int, int]]:
+        return sorted(self.candidates.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def to_bytes(self) -> bytes:
+        header = struct.pack("<HHH", self.width, self.depth, len(self.candidates))
+        keys = struct.pack(f"<{len(self.candidates)}Q", *self.candidates)
+        return zlib.compress(header + keys + self.table.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes, top: int = 20) -> "CountMinSketch":
+        raw = zlib.decompress(data)
+        width, depth, n = struct.unpack_from("<HHH", raw)
+        sketch = cls(width, depth, top)
+        keys = struct.unpack_from(f"<{n}Q", raw, 6)
+        sketch.table = array("I")
+        sketch.table.frombytes(raw[6 + 8 * n:])
+        for key in keys:
+            sketch._offer(key, sketch.estimate(key))
+        return sketch
+
@@ -0,0 +1,147 @@
+import aiohttp
+import asyncio
+import datetime
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from utils import db
+from utils.metrics import registry
+
+
+class StatusReporter:
+    """Bot の稼働状況を FastAPI に送る非同期クライアント
+
+    keep-alive の HTTP セッションを使い回し、送信先に届かない間は指数バックオフで
+    送信を間引く。送信はタイムアウト付きの await なので、ダッシュボードが落ちていても
+    イベントループは止まらない。心拍は担当シャードごとに1件ずつ送る。
+    """
+
+    def __init__(
+        self,
+        bot,
+        url: str,
+        name: str,
+        *,
+        metrics_url: Optional[str] = None,
+        timeout: float = 3.0,
+        base_backoff: float = 5.0,
+        max_backoff: float = 60.0
+    ):
+        self.bot = bot
+        self.url = url
+        self.metrics_url = metrics_url
+        self.name = name
+        self.timeout = timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.started_at = time.time()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._failures = 0
+        self._next_attempt = 0.0
+        self._sending = False
+
+    async def start(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=2, keepalive_timeout=60)
+            )
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _loop_lag(self) -> Dict[str, Any]:
+        monitor = getattr(self.bot, "loop_monitor", None)
+        if monitor is not None:
+            return monitor.summary()
+        # 監視が無い場合は、イベントループに制御が戻るまでの待ち時間だけを測る
+        start = time.perf_counter()
+        await asyncio.sleep(0)
+        return {"last_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    def _shard_ids(self) -> List[Optional[int]]:
+        shards = getattr(self.bot, "shards", None)
+        return sorted(shards) if shards else [None]
+
+    def _cluster_id(self) -> int:
+        shard_config = getattr(self.bot, "shard_config", None)
+        return shard_config.cluster_id if shard_config else 0
+
+    async def build_payload(self, running: bool, shard_id: Optional[int] = None,
+                            loop_lag: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if shard_id is None:
+            latency = self.bot.latency
+            guilds = len(self.bot.guilds)
+        else:
+            shard = self.bot.get_shard(shard_id)
+            latency = shard.latency if shard else float("nan")
+            guilds = sum(1 for g in self.bot.guilds if g.shard_id == shard_id)
+        return {
+            "name": self.name,
+            "shard_id": shard_id,
+            "shard_count": getattr(self.bot, "shard_count", None),
+            "cluster_id": self._cluster_id(),
+            "running": running,
+            "timestamp": datetime.datetime.now().isoformat(),
+            "pid": os.getpid(),
+            "uptime": int(time.time() - self.started_at),
+            "latency_ms": round(latency * 1000, 1) if math.isfinite(latency) else None,
+            "guilds": guilds,
+            "loop_lag": loop_lag if loop_lag is not None else await self._loop_lag(),
+            "db": db.pool.stats(),
+        }
+
+    async def build_payloads(self, running: bool) -> List[Dict[str, Any]]:
+        """担当シャードごとの心拍（ループ遅延と DB プールはプロセス共通）"""
+        loop_lag = await self._loop_lag()
+        return [await self.build_payload(running, shard_id, loop_lag) for shard_id in self._shard_ids()]
+
+    async def send(self, running: bool = True, *, force: bool = False) -> bool:
+        """状態を送信する。バックオフ中・送信中は force でない限りスキップする"""
+        return await self._post(self.url, lambda: self.build_payloads(running), force=force)
+
+    async def send_metrics(self) -> bool:
+        """コマンド・リスナー・SQL のレイテンシ統計を送信する"""
+        if not self.metrics_url:
+            return False
+
+        async def payload():
+            return {"name": self.name, "cluster_id": self._cluster_id(), "metrics": registry.snapshot()}
+
+        return await self._post(self.metrics_url, payload)
+
+    async def _post(self, url: str, build_payload, *, force: bool = False) -> bool:
+        if self._session is None:
+            return False
+        now = time.monotonic()
+        if not force and (self._sending or now < self._next_attempt):
+            return False
+
+        self._sending = True
+        try:
+            payload = await build_payload()
+            payloads = payload if isinstance(payload, list) else [payload]
+            await asyncio.gather(*(self._post_one(url, p) for p in payloads))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._failures += 1
+            backoff = min(self.base_backoff * 2 ** (self._failures - 1), self.max_backoff)
+            self._next_attempt = time.monotonic() + backoff
+            if self._failures == 1:
+                print(f"⚠️ ステータスAPIに送信できません（{backoff:.0f}秒後に再試行）: {e!r}")
+            return False
+        else:
+            if self._failures:
+                print(f"✅ ステータスAPIへの送信が復旧しました（失敗 {self._failures} 回）")
+            self._failures = 0
+            self._next_attempt = 0.0
+            return True
+        finally:
+            self._sending = False
+
+    async def _post_one(self, url: str, payload: Dict[str, Any]):
+        async with self._session.post(url, json=payload) as resp:
+            resp.raise_for_status()
@@ -0,0 +1,106 @@
+import math
+import psutil
+import threading
+import time
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+
+class SystemSample(NamedTuple):
+    timestamp: float
+    cpu_percent: float        # システム全体の CPU 使用率
+    process_cpu: float        # Bot プロセスの CPU 使用率
+    memory_percent: float     # システム全体のメモリ使用率
+    rss: int                  # Bot プロセスの常駐メモリ（バイト）
+    open_fds: Optional[int]   # 開いているファイルディスクリプタ数（Windows ではハンドル数）
+    threads: int
+    latency_ms: Optional[float]
+
+
+# min/avg/max を計算する項目
+SUMMARY_FIELDS = ("cpu_percent", "process_cpu", "rss", "open_fds", "threads", "latency_ms")
+
+
+class SystemSampler:
+    """別スレッドで定期的にシステム情報を採取し、固定長のリングバッファに保持する
+
+    psutil の CPU 使用率は前回呼び出しからの差分（interval=None）で取るので、
+    採取自体も待ち時間なしで終わる。イベントループ側は latest() / summary() で
+    バッファを読むだけ。
+    """
+
+    def __init__(self, bot, interval: float = 5.0, size: int = 120):
+        self.bot = bot
+        self.interval = interval
+        self.samples: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._process = psutil.Process()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="system-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def latest(self) -> Optional[SystemSample]:
+        with self._lock:
+            return self.samples[-1] if self.samples else None
+
+    def window(self) -> List[SystemSample]:
+        with self._lock:
+            return list(self.samples)
+
+    def summary(self) -> Dict[str, Tuple[float, float, float]]:
+        """バッファ内の各項目の (min, avg, max)"""
+        samples = self.window()
+        result = {}
+        for field in SUMMARY_FIELDS:
+            values = [getattr(sample, field) for sample in samples if getattr(sample, field) is not None]
+            if values:
+                result[field] = (min(values), sum(values) / len(values), max(values))
+        return result
+
+    def _open_fds(self) -> Optional[int]:
+        try:
+            return self._process.num_fds()
+        except AttributeError:
+            return self._process.num_handles()
+        except psutil.Error:
+            return None
+
+    def _sample(self) -> SystemSample:
+        latency = self.bot.latency
+        with self._process.oneshot():
+            return SystemSample(
+                timestamp=time.time(),
+                cpu_percent=psutil.cpu_percent(interval=None),
+                process_cpu=self._process.cpu_percent(interval=None),
+                memory_percent=psutil.virtual_memory().percent,
+                rss=self._process.memory_info().rss,
+                open_fds=self._open_fds(),
+                threads=self._process.num_threads(),
+                latency_ms=latency * 1000 if math.isfinite(latency) else None,
+            )
+
+    def _run(self):
+        # 1回目の cpu_percent は基準値を取るだけなので、少し待ってから採取を始める
+        psutil.cpu_percent(interval=None)
+        self._process.cpu_percent(interval=None)
+        if self._stop.wait(1.0):
+            return
+        while True:
+            try:
+                sample = self._sample()
+                with self._lock:
+                    self.samples.append(sample)
+            except Exception as e:
+                # 1回の失敗でスレッドが終わると、最後の値が表示され続けるので採取を続ける
+                print(f"システム情報の採取エラー: {e!r}")
+            if self._stop.wait(self.interval):
+                return
@@ -0,0 +1,237 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+
+class Trace:
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, sampled: bool):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "timestamp_us", "_started", "duration_us", "tags")
+
+    def __init__(self, trace: Trace, name: str, parent: Optional["Span"], kind: Optional[str], tags: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.timestamp_us = time.time_ns() // 1000
+        self._started = time.perf_counter_ns()
+        self.duration_us: Optional[int] = None
+        self.tags = {key: str(value) for key, value in tags.items()}
+
+    def set_tag(self, key: str, value: Any):
+        self.tags[key] = str(value)
+
+    def to_zipkin(self, service: str) -> Dict[str, Any]:
+        data = {
+            "traceId": self.trace.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": self.timestamp_us,
+            "duration": self.duration_us or 0,
+            "localEndpoint": {"serviceName": service},
+            "tags": self.tags,
+        }
+        if self.parent_id:
+            data["parentId"] = self.parent_id
+        if self.kind:
+            data["kind"] = self.kind
+        return data
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """contextvars ベースの軽量トレーサー
+
+    イベント・インタラクションごとにルートスパンを開き、その中の DB クエリ・
+    Discord REST 呼び出し・スレッドプール実行を子スパンとして記録する。
+    ルートの開始時にサンプリングし、対象外でも slow_threshold 以上かかった
+    トレースは書き出す（テールレイテンシの調査用）。出力は Zipkin v2 形式の
+    JSON を1行1スパンでローテーションするファイルへ、別スレッドで書き込む。
+    """
+
+    def __init__(self, service: str, path: str, sample_rate: float, slow_threshold: float,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5):
+        self.service = service
+        self.sample_rate = sample_rate
+        self.slow_threshold_us = int(slow_threshold * 1_000_000)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        # ファイルと書き込みスレッドは start() で用意する（import しただけでは作らない）
+        self._logger: Optional[logging.Logger] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+    def start(self):
+        if self._listener is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            self.path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log_queue: queue.Queue = queue.Queue(maxsize=10000)
+        self._listener = logging.handlers.QueueListener(log_queue, handler)
+        logger = logging.getLogger("monenobot.tracing")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._listener.start()
+        self._logger = logger
+
+    def close(self):
+        if self._listener is None:
+            return
+        self._listener.stop()
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+        self._listener = None
+        self._logger = None
+
+    # -----------------------------
+    # スパン操作
+    # -----------------------------
+    def start_root(self, name: str, **tags: Any) -> Span:
+        """ルートスパンを開始し、現在のコンテキストのスパンにする"""
+        trace = Trace(sampled=random.random() < self.sample_rate)
+        span = Span(trace, name, None, None, tags)
+        trace.spans.append(span)
+        _current_span.set(span)
+        return span
+
+    def finish(self, span: Span, error: bool = False):
+        if span.duration_us is not None:
+            return
+        span.duration_us = (time.perf_counter_ns() - span._started) // 1000
+        if error:
+            span.set_tag("error", "true")
+        # ルートが終わった時点でトレース全体を書き出すか決める
+        if span.parent_id is None:
+            trace = span.trace
+            if trace.sampled or span.duration_us >= self.slow_threshold_us:
+                for s in trace.spans:
+                    if s.duration_us is not None:
+                        self._export(s)
+
+    @contextmanager
+    def root_span(self, name: str, **tags: Any):
+        token = _current_span.set(None)
+        span = self.start_root(name, **tags)
+        error = False
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.finish(span, error)
+            _current_span.reset(token)
+
+    @contextmanager
+    def child_span(self, name: str, kind: Optional[str] = None, **tags: Any):
+        """現在のスパンの子スパン。トレース外では何もしない"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(parent.trace, name, parent, kind, tags)
+        parent.trace.spans.append(span)
+        token = _current_span.set(span)
+        error = False
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span, error)
+
+    def _export(self, span: Span):
+        # start() 前（テストやスクリプトからの import）は書き出さない
+        if self._logger is None:
+            return
+        try:
+            self._logger.info(json.dumps(span.to_zipkin(self.service), ensure_ascii=False))
+        except queue.Full:
+            pass
+
+
+def _from_env() -> Tracer:
+    return Tracer(
+        service=os.getenv("TRACE_SERVICE_NAME", "monenobot"),
+        path=os.getenv("TRACE_FILE", "traces/spans.jsonl"),
+        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 0.01)),
+        slow_threshold=float(os.getenv("TRACE_SLOW_SECONDS", 1.0)),
+    )
+
+
+# 設定を読むだけで、ファイル・スレッドは Bot の setup_hook で tracer.start() してから作る
+tracer = _from_env()
+
+
+def detach():
+    """現在のタスクを呼び出し元のトレースから切り離す
+
+    create_task はコンテキストをコピーするので、コマンドやイベントの中から
+    起動した裏方のタスクはそのスパンを持ち続け、終わったトレースに子スパンを
+    付け足してしまう。長く動くタスクの先頭で呼ぶ。
+    """
+    _current_span.set(None)
+
+
+def create_detached_task(coro, *, name: Optional[str] = None) -> asyncio.Task:
+    """呼び出し元のスパンを引き継がないタスクを作る"""
+    async def run():
+        detach()
+        return await coro
+
+    return asyncio.create_task(run(), name=name)
+
+
+async def to_thread(func, /, *args, **kwargs):
+    """asyncio.to_thread と同じだが、スレッドプールの待ち時間を子スパンに記録する"""
+    if _current_span.get() is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    submitted = time.perf_counter()
+    name = getattr(func, "__qualname__", getattr(func, "__name__", "call"))
+
+    def run():
+        with tracer.child_span(f"thread:{name}") as span:
+            span.set_tag("queue_wait_ms", f"{(time.perf_counter() - submitted) * 1000:.2f}")
+            return func(*args, **kwargs)
+
+    return await asyncio.to_thread(run)
+
+
+def instrument_http(http):
+    """discord.py の HTTPClient.request を子スパン付きに差し替える"""
+    original = http.request
+
+    @functools.wraps(original)
+    async def request(route, **kwargs):
+        with tracer.child_span("discord.http", kind="CLIENT", method=route.method, path=route.path):
+            return await original(route, **kwargs)
+
+    http.request = request
@@ -0,0 +1,144 @@
+import asyncio
+import datetime
+import gzip
+import html
+import json
+import os
+import zipfile
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import discord
+
+# この件数ごとにまとめてスレッドで書き込む（メモリに持つのはこの分だけ）
+WRITE_BATCH = 200
+# これ以下の添付ファイルはダウンロードして zip に保存する（CDN の URL は期限付きで失効するため）
+ATTACHMENT_MAX_BYTES = 8 * 1024 * 1024
+# 1つのトランスクリプトで保存する添付ファイルの合計の上限
+ATTACHMENT_TOTAL_BYTES = 25 * 1024 * 1024
+
+
+class TranscriptFiles(NamedTuple):
+    jsonl_path: str
+    html_path: Optional[str]
+    messages: int
+    attachments: int
+    # ダウンロードして保存した添付ファイル（無ければ attachments_path は None）
+    attachments_path: Optional[str] = None
+    saved_attachments: int = 0
+
+
+def message_record(message: discord.Message) -> Dict[str, Any]:
+    return {
+        "id": message.id,
+        "created_at": message.created_at.isoformat(),
+        "edited_at": message.edited_at.isoformat() if message.edited_at else None,
+        "author": {"id": message.author.id, "name": str(message.author), "bot": message.author.bot},
+        "content": message.content,
+        "attachments": [
+            {"filename": a.filename, "url": a.url, "size": a.size, "content_type": a.content_type}
+            for a in message.attachments
+        ],
+        "embeds": [embed.to_dict() for embed in message.embeds],
+        "reply_to": message.reference.message_id if message.reference else None,
+    }
+
+
+def _html_row(record: Dict[str, Any]) -> str:
+    attachments = "".join(
+        f'<div class="att"><a href="{html.escape(a["url"])}">{html.escape(a["filename"])}</a> ({a["size"]:,} bytes)'
+        + (f' — 添付ファイルの zip 内: {html.escape(a["saved_as"])}' if a.get("saved_as") else "")
+        + "</div>"
+        for a in record["attachments"]
+    )
+    return (
+        f'<div class="msg"><span class="time">{html.escape(record["created_at"][:19].replace("T", " "))}</span> '
+        f'<span class="author">{html.escape(record["author"]["name"])}</span>'
+        f'<div class="content">{html.escape(record["content"])}</div>{attachments}</div>\n'
+    )
+
+
+class _TranscriptWriter:
+    """gzip JSONL（と任意の HTML）に追記していく。ファイル操作はすべてスレッドから呼ぶ"""
+
+    def __init__(self, jsonl_path: str, html_path: Optional[str], attachments_path: str, title: str):
+        self.jsonl = gzip.open(jsonl_path, "wt", encoding="utf-8")
+        self.attachments_path = attachments_path
+        # 添付ファイルを1つも保存しなければ zip は作らない
+        self.attachments: Optional[zipfile.ZipFile] = None
+        self.html = open(html_path, "w", encoding="utf-8") if html_path else None
+        if self.html:
+            self.html.write(
+                "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+                f"<title>{html.escape(title)}</title><style>"
+                "body{font-family:sans-serif;background:#313338;color:#dbdee1}"
+                ".msg{padding:4px 0;border-bottom:1px solid #3f4147}.time{color:#949ba4;font-size:12px}"
+                ".author{font-weight:bold}.content{white-space:pre-wrap}.att a{color:#00a8fc}"
+                f"</style></head><body><h1>{html.escape(title)}</h1>\n"
+            )
+
+    def write(self, records: List[Dict[str, Any]]):
+        self.jsonl.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+        if self.html:
+            self.html.write("".join(_html_row(r) for r in records))
+
+    def add_attachment(self, name: str, data: bytes):
+        if self.attachments is None:
+            # 画像・動画はほとんど圧縮済みなので無圧縮で詰める
+            self.attachments = zipfile.ZipFile(self.attachments_path, "w", zipfile.ZIP_STORED)
+        self.attachments.writestr(name, data)
+
+    def close(self):
+        self.jsonl.close()
+        if self.attachments is not None:
+            self.attachments.close()
+        if self.html:
+            self.html.write("</body></html>\n")
+            self.html.close()
+
+
+async def export_channel(channel: discord.TextChannel, directory: str, *, with_html: bool = False) -> TranscriptFiles:
+    """チャンネルの履歴を古い順にストリーミングしてトランスクリプトを書き出す
+
+    channel.history() を WRITE_BATCH 件ずつスレッドに渡して書き込むので、
+    メッセージ数が多くてもメモリに載るのは1バッチ分だけ。添付ファイルは
+    URL・ファイル名・サイズを記録し、ATTACHMENT_MAX_BYTES 以下のものは合計
+    ATTACHMENT_TOTAL_BYTES までダウンロードして <base>.attachments.zip に保存する
+    （それ以外は期限付きの CDN URL しか残らない）。
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    base = os.path.join(directory, f"{channel.guild.id}-{channel.id}-{stamp}")
+    jsonl_path = base + ".jsonl.gz"
+    html_path = base + ".html" if with_html else None
+    attachments_path = base + ".attachments.zip"
+
+    writer = await asyncio.to_thread(_TranscriptWriter, jsonl_path, html_path, attachments_path, f"#{channel.name}")
+    messages = attachments = saved = saved_bytes = 0
+    batch: List[Dict[str, Any]] = []
+    try:
+        async for message in channel.history(limit=None, oldest_first=True):
+            record = message_record(message)
+            for i, attachment in enumerate(message.attachments):
+                if attachment.size > ATTACHMENT_MAX_BYTES or saved_bytes + attachment.size > ATTACHMENT_TOTAL_BYTES:
+                    continue
+                try:
+                    data = await attachment.read()
+                except discord.HTTPException as e:
+                    print(f"添付ファイルを保存できません（{attachment.filename}）: {e}")
+                    continue
+                name = f"{message.id}-{i}-{attachment.filename}"
+                await asyncio.to_thread(writer.add_attachment, name, data)
+                record["attachments"][i]["saved_as"] = name
+                saved += 1
+                saved_bytes += len(data)
+            batch.append(record)
+            messages += 1
+            attachments += len(record["attachments"])
+            if len(batch) >= WRITE_BATCH:
+                await asyncio.to_thread(writer.write, batch)
+                batch = []
+        if batch:
+            await asyncio.to_thread(writer.write, batch)
+    finally:
+        await asyncio.to_thread(writer.close)
+    return TranscriptFiles(jsonl_path, html_path, messages, attachments, attachments_path if saved else None, saved)
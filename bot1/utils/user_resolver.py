@@ -0,0 +1,144 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import discord
+
+from utils.members import resolve_members
+
+
+class UserInfo(NamedTuple):
+    """表示に必要な分だけのユーザー情報"""
+    id: int
+    name: str
+    display_name: str
+    avatar_url: str
+    bot: bool
+
+    @classmethod
+    def of(cls, user: discord.abc.User) -> "UserInfo":
+        return cls(user.id, user.name, user.display_name, user.display_avatar.url, user.bot)
+
+
+class UserResolver:
+    """ユーザー ID -> 表示名・アイコンを引く、Bot 全体で共有のリゾルバ
+
+    (サーバー, ユーザー) ごとに LRU で保持し、存在しないユーザーも一定時間
+    ネガティブキャッシュする。キャッシュに無い分は、サーバー指定があれば
+    query_members でまとめて、残りは fetch_user を同時実行数を絞って並行に取得する。
+    同じユーザーの取得が同時に走っていれば、その結果を待って使い回す。
+    """
+
+    def __init__(self, bot, capacity: int = 10000, ttl: float = 600.0,
+                 negative_ttl: float = 300.0, concurrency: int = 5):
+        self.bot = bot
+        self.capacity = capacity
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._cache: "OrderedDict[Tuple[int, int], Tuple[float, Optional[UserInfo]]]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self._fetch_slots = asyncio.Semaphore(concurrency)
+        self.hits = 0
+        self.misses = 0
+
+    # -----------------------------
+    # キャッシュ
+    # -----------------------------
+    def _get(self, key: Tuple[int, int]) -> Tuple[bool, Optional[UserInfo]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return False, None
+        expires, info = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return False, None
+        self._cache.move_to_end(key)
+        return True, info
+
+    def _put(self, key: Tuple[int, int], info: Optional[UserInfo]):
+        ttl = self.ttl if info is not None else self.negative_ttl
+        self._cache[key] = (time.monotonic() + ttl, info)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, user_id: int, guild_id: Optional[int] = None):
+        self._cache.pop((guild_id or 0, user_id), None)
+
+    # -----------------------------
+    # 解決
+    # -----------------------------
+    async def resolve_many(self, user_ids: Iterable[int],
+                           guild: Optional[discord.Guild] = None) -> Dict[int, Optional[UserInfo]]:
+        """ID ごとの UserInfo（見つからなければ None）。guild を渡すとサーバーでの表示名を使う"""
+        scope = guild.id if guild else 0
+        result: Dict[int, Optional[UserInfo]] = {}
+        missing: List[int] = []
+        for user_id in dict.fromkeys(user_ids):
+            cached = guild.get_member(user_id) if guild else self.bot.get_user(user_id)
+            if cached is not None:
+                result[user_id] = UserInfo.of(cached)
+                self.hits += 1
+                continue
+            found, info = self._get((scope, user_id))
+            if found:
+                result[user_id] = info
+                self.hits += 1
+            else:
+                missing.append(user_id)
+        if not missing:
+            return result
+        self.misses += len(missing)
+
+        if guild is not None:
+            members = await resolve_members(guild, missing)
+            for user_id, member in members.items():
+                info = UserInfo.of(member)
+                self._put((scope, user_id), info)
+                result[user_id] = info
+            # サーバーを抜けたユーザーはグローバルな名前で表示する
+            missing = [user_id for user_id in missing if user_id not in members]
+
+        users = await asyncio.gather(*(self._fetch_user(user_id) for user_id in missing))
+        for user_id, info in zip(missing, users):
+            if guild is not None:
+                self._put((scope, user_id), info)
+            result[user_id] = info
+        return result
+
+    async def resolve(self, user_id: int, guild: Optional[discord.Guild] = None) -> Optional[UserInfo]:
+        return (await self.resolve_many([user_id], guild))[user_id]
+
+    async def _fetch_user(self, user_id: int) -> Optional[UserInfo]:
+        found, info = self._get((0, user_id))
+        if found:
+            return info
+        future = self._inflight.get(user_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = future
+        try:
+            async with self._fetch_slots:
+                try:
+                    info = UserInfo.of(await self.bot.fetch_user(user_id))
+                    self._put((0, user_id), info)
+                except discord.NotFound:
+                    info = None
+                    self._put((0, user_id), None)
+                except discord.HTTPException as e:
+                    # 一時的な失敗はキャッシュせず、今回だけ不明として扱う
+                    print(f"ユーザー取得エラー ({user_id}): {e}")
+                    info = None
+            future.set_result(info)
+            return info
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._inflight[user_id]
+
+    @staticmethod
+    def label(info: Optional[UserInfo], user_id: int) -> str:
+        return info.display_name if info else f"不明なユーザー (ID: {user_id})"
@@ -0,0 +1,216 @@
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import discord
+
+from utils.level_curve import LevelCurve
+from utils.metrics import InstrumentedCursor
+
+VOICE_SETTINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS level_voice_settings (
+    guild_id BIGINT PRIMARY KEY,
+    enabled TINYINT(1) NOT NULL DEFAULT 1,
+    xp_per_minute INT NOT NULL,
+    require_unmuted TINYINT(1) NOT NULL DEFAULT 0,
+    min_members INT NOT NULL,
+    updated_at DATETIME NOT NULL
+)
+"""
+
+# 1回の IN (...) に入れるユーザー数
+SETTLE_BATCH = 500
+
+SessionKey = Tuple[int, int]
+
+
+class VoiceXPSettings(NamedTuple):
+    enabled: bool = True
+    xp_per_minute: int = 5
+    # True ならミュート中は加算しない（スピーカーミュートは常に対象外）
+    require_unmuted: bool = False
+    # チャンネルにこの人数以上（Bot とスピーカーミュートを除く）いるときだけ加算する
+    min_members: int = 2
+
+
+class LevelUp(NamedTuple):
+    guild_id: int
+    user_id: int
+    level: int
+    notify_channel_id: Optional[int]
+    role_id: Optional[int]
+
+
+def eligible_members(channel, settings: VoiceXPSettings) -> Set[int]:
+    """チャンネル内で今 XP が貯まるメンバー"""
+    if not settings.enabled or channel is None or channel == channel.guild.afk_channel:
+        return set()
+    listeners = []
+    for member in channel.members:
+        voice = member.voice
+        if member.bot or voice is None or voice.self_deaf or voice.deaf:
+            continue
+        listeners.append((member.id, voice.self_mute or voice.mute))
+    if len(listeners) < settings.min_members:
+        return set()
+    return {user_id for user_id, muted in listeners if not (settings.require_unmuted and muted)}
+
+
+def voice_channels(guild: discord.Guild) -> Iterable:
+    return [*guild.voice_channels, *guild.stage_channels]
+
+
+class VoiceSessionTracker:
+    """VC に居る時間をメモリ上で数え、定期的にまとめて XP に換算する
+
+    イベントごとに DB へは書かず、(サーバー, ユーザー) -> 加算開始時刻 と
+    未精算の秒数だけを持つ。精算は settle() でアクティブなセッション数に比例する
+    だけなので、数百人が同時に VC に居ても軽い。
+    """
+
+    def __init__(self):
+        self._started: Dict[SessionKey, float] = {}
+        self._pending: Dict[SessionKey, float] = {}
+
+    @property
+    def active(self) -> int:
+        return len(self._started)
+
+    def set_active(self, key: SessionKey, active: bool, now: float):
+        started = self._started.get(key)
+        if active and started is None:
+            self._started[key] = now
+        elif not active and started is not None:
+            del self._started[key]
+            self._pending[key] = self._pending.get(key, 0.0) + now - started
+
+    def sync_channel(self, guild_id: int, present: Iterable[int], eligible: Set[int], now: float):
+        """チャンネルに居る全員について、加算するかどうかを揃える"""
+        for user_id in present:
+            self.set_active((guild_id, user_id), user_id in eligible, now)
+
+    def sync_guild(self, guild_id: int, eligible: Set[int], now: float):
+        """VC の状態キャッシュからサーバー全体のセッションを作り直す（再起動・再接続後）"""
+        for key in [key for key in self._started if key[0] == guild_id and key[1] not in eligible]:
+            self.set_active(key, False, now)
+        for user_id in eligible:
+            self.set_active((guild_id, user_id), True, now)
+
+    def forget_guild(self, guild_id: int):
+        for store in (self._started, self._pending):
+            for key in [key for key in store if key[0] == guild_id]:
+                del store[key]
+
+    def restore(self, awards: Dict[SessionKey, int], xp_per_minute: Callable[[int], int]):
+        """書き込めなかった XP を秒数に戻し、次の精算で改めて付与する"""
+        for key, xp in awards.items():
+            rate = xp_per_minute(key[0])
+            if rate > 0:
+                # 浮動小数の誤差で 1XP 欠けないよう、わずかに多めに戻す
+                self._pending[key] = self._pending.get(key, 0.0) + xp * 60 / rate + 1e-6
+
+    def settle(self, now: float, xp_per_minute: Callable[[int], int]) -> Dict[SessionKey, int]:
+        """ここまでの時間を XP に換算して返す。1XP に満たない端数は次回に持ち越す"""
+        for key, started in self._started.items():
+            self._pending[key] = self._pending.get(key, 0.0) + now - started
+            self._started[key] = now
+        awards: Dict[SessionKey, int] = {}
+        pending: Dict[SessionKey, float] = {}
+        for key, seconds in self._pending.items():
+            rate = xp_per_minute(key[0])
+            if rate <= 0:
+                continue
+            xp = int(seconds * rate // 60)
+            if xp:
+                awards[key] = xp
+            # VC を抜けたユーザーの端数は捨てる（_pending を際限なく増やさない）
+            if key in self._started:
+                pending[key] = seconds - xp * 60 / rate
+        self._pending = pending
+        return awards
+
+
+def settle_voice_xp(conn, awards: Dict[SessionKey, int], curve_for: Callable[[int], LevelCurve],
+                    now: datetime) -> Tuple[List[LevelUp], Dict[SessionKey, int]]:
+    """精算した XP を user_levels にまとめて加算する（ブロッキング）
+
+    サーバーごとに対象ユーザーを IN (...) でまとめて読み、既存の行は相対加算の
+    UPDATE、初めての人は相対加算の upsert を executemany で流す。
+    レベルが上がった人と、書き込めなかった分（次回に持ち越す）を返す。
+    """
+    by_guild: Dict[int, Dict[int, int]] = {}
+    for (guild_id, user_id), xp in awards.items():
+        by_guild.setdefault(guild_id, {})[user_id] = xp
+
+    cursor = InstrumentedCursor(conn.cursor())
+    level_ups: List[LevelUp] = []
+    failed: Dict[SessionKey, int] = {}
+    try:
+        for guild_id, users in by_guild.items():
+            curve = curve_for(guild_id)
+            user_ids = list(users)
+            for start in range(0, len(user_ids), SETTLE_BATCH):
+                batch = user_ids[start:start + SETTLE_BATCH]
+                committed = False
+                try:
+                    placeholders = ", ".join(["%s"] * len(batch))
+                    cursor.execute(
+                        f"SELECT user_id, xp, level, notify_channel_id FROM user_levels "
+                        f"WHERE guild_id=%s AND user_id IN ({placeholders})",
+                        (guild_id, *batch)
+                    )
+                    existing = {row[0]: row[1:] for row in cursor.fetchall()}
+
+                    updates, inserts, raised = [], [], []
+                    for user_id in batch:
+                        gained = users[user_id]
+                        if user_id in existing:
+                            xp, level, notify_channel_id = existing[user_id]
+                            new_level = curve.level_for(xp + gained)
+                            updates.append((gained, new_level, now, guild_id, user_id))
+                            if new_level > level:
+                                raised.append((user_id, new_level, notify_channel_id))
+                        else:
+                            inserts.append((guild_id, user_id, gained, curve.level_for(gained), 10, now))
+                    # on_message と同時に書いても消し合わないよう、どちらも XP は相対で足す
+                    if updates:
+                        cursor.executemany(
+                            "UPDATE user_levels SET xp=xp+%s, level=GREATEST(level, %s), updated_at=%s "
+                            "WHERE guild_id=%s AND user_id=%s",
+                            updates
+                        )
+                    if inserts:
+                        # 読んだ後に on_message が行を作っていても、上書きせずに足す
+                        cursor.executemany(
+                            "INSERT INTO user_levels (guild_id, user_id, xp, level, xp_per_message, created_at) "
+                            "VALUES (%s, %s, %s, %s, %s, %s) "
+                            "ON DUPLICATE KEY UPDATE xp=xp+VALUES(xp), level=GREATEST(level, VALUES(level))",
+                            inserts
+                        )
+                    conn.commit()
+                    committed = True
+
+                    if raised:
+                        levels = sorted({level for _, level, _ in raised})
+                        cursor.execute(
+                            f"SELECT level, role_id FROM level_roles WHERE guild_id=%s "
+                            f"AND level IN ({', '.join(['%s'] * len(levels))})",
+                            (guild_id, *levels)
+                        )
+                        roles = dict(cursor.fetchall())
+                        level_ups.extend(
+                            LevelUp(guild_id, user_id, level, notify_channel_id, roles.get(level))
+                            for user_id, level, notify_channel_id in raised
+                        )
+                except Exception as e:
+                    # 1つのバッチの失敗で他のサーバー・バッチの分まで捨てない
+                    print(f"VC の XP 書き込みエラー（サーバー {guild_id}・{len(batch)} 人）: {e}")
+                    if committed:
+                        continue
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                    failed.update({(guild_id, user_id): users[user_id] for user_id in batch})
+        return level_ups, failed
+    finally:
+        cursor.close()
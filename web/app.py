@@ -1 +1,221 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Set, Tuple
 
+from fastapi import Body, FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+# 最後の心拍からこの秒数を過ぎた Bot は stale として扱う
+STALE_AFTER = float(os.getenv("BOT_STALE_AFTER", 15))
+# 購読者ごとに溜めておくイベント数（遅いクライアントは古いものから捨てる）
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class BotRegistry:
+    """Bot（シャード単位）ごとの最新ステータスを保持するメモリ上のレジストリ
+
+    心拍の反映は dict の1回の書き込み（O(1)）で、変化は購読者のキューへ
+    シリアライズ済みの SSE イベントとして配る。
+    """
+
+    def __init__(self, stale_after: float):
+        self.stale_after = stale_after
+        self.bots: Dict[str, Dict[str, Any]] = {}
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    @staticmethod
+    def key_of(payload: Dict[str, Any]) -> str:
+        shard_id = payload.get("shard_id")
+        return payload["name"] if shard_id is None else f"{payload['name']}#{shard_id}"
+
+    def update(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        entry = dict(payload)
+        entry["received_at"] = time.time()
+        entry["stale"] = False
+        self.bots[self.key_of(payload)] = entry
+        self.publish("update", entry)
+        return entry
+
+    def sweep(self, now: Optional[float] = None):
+        """一定時間心拍のない Bot を stale にする"""
+        now = time.time() if now is None else now
+        deadline = now - self.stale_after
+        for entry in self.bots.values():
+            if not entry["stale"] and entry["running"] and entry["received_at"] < deadline:
+                entry["stale"] = True
+                self.publish("stale", entry)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"stale_after": self.stale_after, "bots": list(self.bots.values())}
+
+    # -----------------------------
+    # 購読（Server-Sent Events）
+    # -----------------------------
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event: str, data: Any):
+        # 購読者数に関係なくシリアライズは1回だけ
+        message = format_sse(event, data)
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+registry = BotRegistry(STALE_AFTER)
+# (Bot 名, クラスタ ID) -> 最新のメトリクススナップショット
+bot_metrics: Dict[Tuple[str, int], Dict[str, Any]] = {}
+
+
+def _label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def render_prometheus() -> str:
+    """Bot から送られたレイテンシ統計と稼働状況を Prometheus のテキスト形式にする"""
+    lines = [
+        "# HELP monenobot_up Bot が稼働中で心拍が途切れていなければ 1",
+        "# TYPE monenobot_up gauge",
+    ]
+    for entry in registry.bots.values():
+        up = 1 if entry["running"] and not entry["stale"] else 0
+        shard = "" if entry.get("shard_id") is None else entry["shard_id"]
+        lines.append(f"monenobot_up{_labels(bot=entry['name'], shard=shard)} {up}")
+
+    lines += [
+        "# HELP monenobot_handler_latency_seconds コマンド・リスナー・SQL の所要時間",
+        "# TYPE monenobot_handler_latency_seconds histogram",
+    ]
+    errors = []
+    for (bot_name, cluster_id), snapshot in bot_metrics.items():
+        bounds = [str(bound) for bound in snapshot["buckets"]] + ["+Inf"]
+        for series in snapshot["series"]:
+            base = {"bot": bot_name, "cluster": cluster_id, "kind": series["kind"], "name": series["name"]}
+            cumulative = 0
+            for bound, count in zip(bounds, series["counts"]):
+                cumulative += count
+                lines.append(f"monenobot_handler_latency_seconds_bucket{_labels(**base, le=bound)} {cumulative}")
+            lines.append(f"monenobot_handler_latency_seconds_sum{_labels(**base)} {series['sum']}")
+            lines.append(f"monenobot_handler_latency_seconds_count{_labels(**base)} {series['count']}")
+            errors.append(f"monenobot_handler_errors_total{_labels(**base)} {series['errors']}")
+
+    lines += [
+        "# HELP monenobot_handler_errors_total コマンド・リスナー・SQL のエラー数",
+        "# TYPE monenobot_handler_errors_total counter",
+    ]
+    lines += errors
+    return "\n".join(lines) + "\n"
+
+
+async def sweep_loop():
+    while True:
+        await asyncio.sleep(1)
+        registry.sweep()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    task = asyncio.create_task(sweep_loop())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+app = FastAPI(title="monenobot status", lifespan=lifespan)
+
+
+@app.post("/api/bot_status")
+async def post_bot_status(payload: Dict[str, Any] = Body(...)):
+    """Bot からの心拍を受け取る"""
+    if not isinstance(payload.get("name"), str) or not payload["name"]:
+        raise HTTPException(status_code=422, detail="name is required")
+    payload["running"] = bool(payload.get("running", True))
+    registry.update(payload)
+    return {"ok": True}
+
+
+@app.get("/api/bot_status")
+async def get_bot_status():
+    """全 Bot の現在の状態"""
+    return registry.snapshot()
+
+
+@app.get("/api/bot_status/stream")
+async def stream_bot_status(request: Request):
+    """状態の変化を Server-Sent Events で配信する（接続直後に snapshot を送る）"""
+    queue = registry.subscribe()
+
+    async def events():
+        try:
+            yield format_sse("snapshot", registry.snapshot())
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # プロキシに切断されないようにコメント行を送る
+                    yield ": keepalive\n\n"
+                    continue
+                yield message
+        finally:
+            registry.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/bot_metrics")
+async def post_bot_metrics(payload: Dict[str, Any] = Body(...)):
+    """Bot からのレイテンシ統計（累積値のスナップショット）を受け取る"""
+    name = payload.get("name")
+    metrics = payload.get("metrics")
+    if not isinstance(name, str) or not name or not isinstance(metrics, dict):
+        raise HTTPException(status_code=422, detail="name and metrics are required")
+    bot_metrics[(name, int(payload.get("cluster_id") or 0))] = metrics
+    return {"ok": True}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus 用のエクスポジション"""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/bot_status/{name}")
+async def get_single_bot_status(name: str):
+    """指定した Bot の全シャードの状態"""
+    shards = sorted(
+        (entry for entry in registry.bots.values() if entry["name"] == name),
+        key=lambda entry: entry.get("shard_id") or 0
+    )
+    if not shards:
+        raise HTTPException(status_code=404, detail="unknown bot")
+    return {"name": name, "shards": shards}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=8000)